@@ -0,0 +1,104 @@
+import json
+import boto3
+import os
+from spectral_decode import open_image
+from detector_calibration import (
+    build_master, save_master, get_masters, MASTER_TYPES, MIN_MASTER_FRAMES
+)
+from s3_uploads import is_device_upload
+
+s3_client = boto3.client('s3')
+dynamodb_client = boto3.client('dynamodb')
+
+S3_BUCKET = os.environ['S3_BUCKET']
+DEVICES_TABLE = os.environ['DEVICES_TABLE']
+
+
+def lambda_handler(event, context):
+    """
+    Construye el frame maestro dark o flat de un dispositivo y exposición
+    Endpoint: POST /devices/{deviceId}/masters
+    Body: {type: "dark" | "flat", exposure, imageS3Keys: [...]}
+
+    El flat se construye restando el dark de su misma exposición si existe,
+    por eso conviene subir primero el burst dark.
+    """
+    try:
+        user_id = event['requestContext']['authorizer']['claims']['sub']
+        device_id = event['pathParameters']['deviceId']
+        body = json.loads(event.get('body') or '{}')
+
+        kind = body.get('type')
+        exposure = body.get('exposure')
+        keys = body.get('imageS3Keys') or []
+
+        if kind not in MASTER_TYPES:
+            return _resp(400, {'error': f"type debe ser uno de: {', '.join(MASTER_TYPES)}"})
+        if not isinstance(keys, list) or len(keys) < MIN_MASTER_FRAMES:
+            return _resp(400, {'error': f'Se requieren al menos {MIN_MASTER_FRAMES} imageS3Keys'})
+
+        error = _check_owner(user_id, device_id)
+        if error:
+            return error
+        # Solo frames subidos por el usuario para este dispositivo (presign_upload)
+        if not all(is_device_upload(key, user_id, device_id) for key in keys):
+            return _resp(403, {'error': 'imageS3Keys deben ser subidas propias de este dispositivo'})
+
+        print(f"🌑 Maestro {kind} de {device_id} (exposición {exposure}) con {len(keys)} frames")
+
+        dark = None
+        if kind == 'flat':
+            dark, _, _ = get_masters(device_id, exposure)
+
+        try:
+            master, info = build_master(_frames(keys), kind, dark=dark)
+        except ValueError as e:
+            return _resp(400, {'error': str(e)})
+
+        key = save_master(device_id, kind, exposure, master, frames=info['frames'])
+
+        print(f"✅ Maestro guardado: {key} ({info['buildMs']} ms)")
+
+        return _resp(200, {
+            'success': True,
+            'deviceId': device_id,
+            'exposure': exposure,
+            'masterS3Key': key,
+            **info
+        })
+
+    except Exception as e:
+        print(f"Error construyendo maestro: {str(e)}")
+        return _resp(500, {'error': str(e)})
+
+
+def _check_owner(user_id, device_id):
+    """Respuesta 404/403 si el dispositivo no existe o no es del usuario, si no None"""
+    device = dynamodb_client.get_item(
+        TableName=DEVICES_TABLE,
+        Key={'deviceId': {'S': device_id}},
+        ProjectionExpression='userId'
+    ).get('Item')
+    if not device:
+        return _resp(404, {'error': 'Dispositivo no encontrado'})
+    if device.get('userId', {}).get('S') != user_id:
+        return _resp(403, {'error': 'No autorizado'})
+    return None
+
+
+def _frames(keys):
+    """Frames del burst de a uno (solo el actual queda en memoria)"""
+    for key in keys:
+        response = s3_client.get_object(Bucket=S3_BUCKET, Key=key)
+        yield open_image(response['Body'].read())
+
+
+def _resp(status, body):
+    return {
+        'statusCode': status,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(body)
+    }
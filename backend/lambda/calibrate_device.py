@@ -0,0 +1,108 @@
+import json
+import boto3
+import base64
+import os
+from spectral_decode import open_image, decode_image, column_profile
+from spectral_roi import get_band, clear_band_cache
+from spectral_peaks import find_peaks
+from wavelength_calibration import (
+    lamp_lines, fit_calibration, save_calibration, DEFAULT_LAMP, CALIBRATION_DEGREE
+)
+from s3_uploads import is_device_upload
+
+s3_client = boto3.client('s3')
+dynamodb_client = boto3.client('dynamodb')
+
+S3_BUCKET = os.environ['S3_BUCKET']
+DEVICES_TABLE = os.environ['DEVICES_TABLE']
+
+
+def lambda_handler(event, context):
+    """
+    Calibra la longitud de onda de un dispositivo con un frame de lámpara
+    Endpoint: POST /devices/{deviceId}/calibration
+    Body: {imageData (base64) o imageS3Key, lamp: ["Hg", ...], degree}
+    """
+    try:
+        user_id = event['requestContext']['authorizer']['claims']['sub']
+        device_id = event['pathParameters']['deviceId']
+        body = json.loads(event.get('body') or '{}')
+
+        error = _check_owner(user_id, device_id)
+        if error:
+            return error
+
+        lamp = body.get('lamp') or list(DEFAULT_LAMP)
+        if isinstance(lamp, str):
+            lamp = [lamp]
+        degree = int(body.get('degree', CALIBRATION_DEGREE))
+
+        if body.get('imageS3Key'):
+            # Solo un frame subido por el usuario para este dispositivo (presign_upload)
+            if not is_device_upload(body['imageS3Key'], user_id, device_id):
+                return _resp(403, {'error': 'imageS3Key debe ser una subida propia de este dispositivo'})
+            response = s3_client.get_object(Bucket=S3_BUCKET, Key=body['imageS3Key'])
+            image_bytes = response['Body'].read()
+        elif body.get('imageData'):
+            image_bytes = base64.b64decode(body['imageData'])
+        else:
+            return _resp(400, {'error': 'Se requiere imageData o imageS3Key'})
+
+        print(f"🔦 Calibrando {device_id} con lámpara {', '.join(lamp)}")
+
+        # Perfil de la lámpara con el mismo decode que el procesamiento
+        decoded, _ = decode_image(open_image(image_bytes))
+        band, _ = get_band(decoded)
+        profile = column_profile(decoded, band)
+        peaks = find_peaks(profile)
+
+        try:
+            model = fit_calibration(
+                peaks['positions'], peaks['prominences'], len(profile),
+                lamp_lines(lamp), degree=degree
+            )
+        except ValueError as e:
+            return _resp(400, {'error': str(e), 'peakCount': int(peaks['indices'].size)})
+
+        version = save_calibration(device_id, model, lamp=lamp, width=len(profile))
+        # La cámara pudo moverse al calibrar: volver a detectar la banda
+        clear_band_cache(device_id)
+
+        print(f"✅ Calibración v{version}: {len(model['matches'])} líneas, rms {model['rmsNm']} nm")
+
+        return _resp(200, {
+            'success': True,
+            'deviceId': device_id,
+            'version': version,
+            'lamp': lamp,
+            **model
+        })
+
+    except Exception as e:
+        print(f"Error calibrando: {str(e)}")
+        return _resp(500, {'error': str(e)})
+
+
+def _check_owner(user_id, device_id):
+    """Respuesta 404/403 si el dispositivo no existe o no es del usuario, si no None"""
+    device = dynamodb_client.get_item(
+        TableName=DEVICES_TABLE,
+        Key={'deviceId': {'S': device_id}},
+        ProjectionExpression='userId'
+    ).get('Item')
+    if not device:
+        return _resp(404, {'error': 'Dispositivo no encontrado'})
+    if device.get('userId', {}).get('S') != user_id:
+        return _resp(403, {'error': 'No autorizado'})
+    return None
+
+
+def _resp(status, body):
+    return {
+        'statusCode': status,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(body)
+    }
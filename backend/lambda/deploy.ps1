@@ -12,7 +12,8 @@ $folders = @(
     "lambda/get_observations",
     "lambda/get_observation_detail",
     "lambda/process_spectral_image",
-    "lambda/iot_rule_handler"
+    "lambda/iot_rule_handler",
+    "lambda/shared"
 )
 
 foreach ($folder in $folders) {
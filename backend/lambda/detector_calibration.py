@@ -0,0 +1,348 @@
+import io
+import os
+import re
+import tempfile
+import time
+from collections import OrderedDict
+import boto3
+import numpy as np
+from botocore.exceptions import BotoCoreError, ClientError
+from spectral_decode import decode_image, BAND_BYTES
+from spectral_stack import STACK_SPOOL_DIR, chunked_median
+
+s3_client = boto3.client('s3')
+
+S3_BUCKET = os.environ.get('S3_BUCKET')
+
+# Frames maestros de detector por dispositivo y exposición
+#
+#   dark  mediana de frames con el sensor tapado: corriente oscura y offset
+#         (en unidades de promedio de canales, como column_profile)
+#   flat  mediana de frames iluminados con luz continua, menos el dark de su
+#         exposición, dividida por su propia media móvil a lo largo de cada
+#         fila: queda solo la respuesta pixel a pixel (sin la forma de la
+#         lámpara ni la iluminación de la rendija)
+#
+# Se guardan en S3 como .npy float32 del tamaño del frame decodificado
+MASTER_TYPES = ('dark', 'flat')
+MASTER_PREFIX = 'calibration'
+
+# Frames mínimos de un burst de calibración
+MIN_MASTER_FRAMES = 3
+
+# Bytes (n frames x filas x ancho float32) de cada bloque de la mediana
+MASTER_CHUNK_BYTES = int(os.environ.get('MASTER_CHUNK_BYTES', str(16 << 20)))
+
+# Ventana (pixeles) de la media móvil que separa la respuesta de la lámpara
+FLAT_SMOOTH_WINDOW = 31
+
+# Pixeles con menos de esta fracción de la iluminación máxima no se corrigen
+FLAT_MIN_LEVEL = 0.1
+
+# Caché de maestros en contenedores calientes: memoria y /tmp, en bytes
+MASTER_MEMORY_BYTES = int(os.environ.get('MASTER_MEMORY_BYTES', str(128 << 20)))
+MASTER_DISK_BYTES = int(os.environ.get('MASTER_DISK_BYTES', str(256 << 20)))
+MASTER_CACHE_DIR = os.environ.get('MASTER_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'masters'))
+
+# Segundos antes de revalidar (ETag) un maestro cacheado contra S3
+MASTER_CACHE_TTL = int(os.environ.get('MASTER_CACHE_TTL', '600'))
+
+# Maestros preparados para aplicar (dark, o 1 / flat) por clave S3
+# key -> {'array', 'etag', 'checkedAt', 'bytes'}; array None si no existe
+_memory_cache = OrderedDict()
+_memory_bytes = 0
+
+
+def master_key(device_id, kind, exposure=None):
+    """Clave S3 del maestro de un dispositivo y exposición"""
+    if kind not in MASTER_TYPES:
+        raise ValueError(f"Tipo de maestro desconocido: {kind}")
+    return f"{MASTER_PREFIX}/{device_id}/{kind}_{exposure_tag(exposure)}.npy"
+
+
+def exposure_tag(exposure):
+    """Exposición como parte de una clave ('default' si no se indica)"""
+    if exposure is None or exposure == '':
+        return 'default'
+    return re.sub(r'[^A-Za-z0-9.-]', '_', str(exposure))
+
+
+def build_master(images, kind, dark=None):
+    """
+    Combina un burst de calibración en un frame maestro
+
+    images: iterable de imágenes PIL (abiertas, sin decodificar); cada una se
+    decodifica igual que en el procesamiento y se escribe a un archivo
+    temporal, así la memoria queda en O(un frame) sin importar el burst.
+    La mediana se calcula por bloques de filas leídos del archivo.
+    dark: maestro dark (mismo tamaño) restado de un flat antes de normalizarlo
+
+    Retorna (maestro float32 alto x ancho, info del burst)
+    """
+    if kind not in MASTER_TYPES:
+        raise ValueError(f"Tipo de maestro desconocido: {kind}")
+
+    start = time.perf_counter()
+    with tempfile.TemporaryFile(dir=STACK_SPOOL_DIR) as spool:
+        count, size = 0, None
+        for image in images:
+            decoded, _ = decode_image(image)
+            if size is None:
+                size = decoded.size
+            elif decoded.size != size:
+                raise ValueError(f"Frame de {decoded.size[0]}x{decoded.size[1]}, "
+                                 f"el burst es de {size[0]}x{size[1]}")
+            _spool_frame(decoded, spool)
+            count += 1
+
+        if count < MIN_MASTER_FRAMES:
+            raise ValueError(f"Se requieren al menos {MIN_MASTER_FRAMES} frames (llegaron {count})")
+
+        spool.flush()
+        width, height = size
+        frames = np.memmap(spool, dtype=np.float32, mode='r', shape=(count, height, width))
+        master = np.empty((height, width), dtype=np.float32)
+        chunked_median(frames, master, MASTER_CHUNK_BYTES)
+        del frames
+
+    if dark is not None:
+        if dark.shape != master.shape:
+            raise ValueError("El dark no tiene el tamaño de los frames del flat")
+        np.subtract(master, dark, out=master)
+    if kind == 'flat':
+        master = _normalize_flat(master)
+
+    info = {
+        'type': kind,
+        'frames': count,
+        'size': [width, height],
+        'darkSubtracted': dark is not None,
+        'mean': round(float(master.mean()), 4),
+        'std': round(float(master.std()), 4),
+        'buildMs': round((time.perf_counter() - start) * 1000, 2)
+    }
+    return master, info
+
+
+def save_master(device_id, kind, exposure, master, frames=0):
+    """Guarda el maestro en S3 y en la caché del contenedor; retorna la clave"""
+    key = master_key(device_id, kind, exposure)
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(master, dtype='<f4'))
+    response = s3_client.put_object(
+        Bucket=S3_BUCKET,
+        Key=key,
+        Body=buffer.getvalue(),
+        ContentType='application/octet-stream',
+        Metadata={'deviceId': device_id, 'type': kind, 'exposure': exposure_tag(exposure),
+                  'frames': str(frames)}
+    )
+    # Este contenedor usa la versión nueva de inmediato; los demás al revalidar
+    _store(key, _prepare(kind, master), response.get('ETag', '').strip('"'))
+    return key
+
+
+def get_masters(device_id, exposure=None, size=None):
+    """
+    Maestros listos para aplicar a frames de (device_id, exposure)
+
+    Retorna (dark o None, ganancia 1/flat o None, info con el ETag de cada
+    maestro en darkVersion/flatVersion). Con size=(ancho, alto)
+    se descartan los maestros de otro tamaño (cambió la resolución del frame).
+    S3 se consulta solo ante una falta en caché o al vencer MASTER_CACHE_TTL.
+    """
+    info = {'exposure': exposure_tag(exposure), 'dark': False, 'flat': False}
+    if not device_id or not S3_BUCKET:
+        return None, None, info
+
+    arrays = []
+    for kind in MASTER_TYPES:
+        array, etag = _load(master_key(device_id, kind, exposure), kind)
+        if array is not None and size is not None and array.shape != (size[1], size[0]):
+            print(f"⚠️ Maestro {kind} de {device_id} es {array.shape[1]}x{array.shape[0]}, "
+                  f"frame {size[0]}x{size[1]}: se omite")
+            info['sizeMismatch'] = True
+            array = None
+        info[kind] = array is not None
+        if array is not None:
+            info[f'{kind}Version'] = etag
+        arrays.append(array)
+    return arrays[0], arrays[1], info
+
+
+def corrected_profile(image, dark=None, gain=None, rows=None, band_bytes=BAND_BYTES):
+    """
+    Equivalente a column_profile con corrección de detector por pixel:
+    (promedio de canales - dark) * gain, con gain = 1 / flat
+
+    La imagen se recorre en bandas de filas sobre un único buffer float32
+    del tamaño de una banda; resta y producto se hacen en el lugar, sin
+    copias del frame completo.
+    """
+    width, height = image.size
+    top, bottom = rows if rows else (0, height)
+    band_rows = max(1, min(bottom - top, band_bytes // (width * 4)))
+
+    work = np.empty((band_rows, width), dtype=np.float32)
+    total = np.zeros(width, dtype=np.float64)
+    for start in range(top, bottom, band_rows):
+        stop = min(start + band_rows, bottom)
+        chunk = np.asarray(image.crop((0, start, width, stop)))
+        buffer = _channel_mean(chunk, work[:stop - start])
+        apply_masters(buffer, dark, gain, start)
+        total += buffer.sum(axis=0, dtype=np.float64)
+    return total / float(max(1, bottom - top))
+
+
+def apply_masters(buffer, dark=None, gain=None, top=0):
+    """Corrige en el lugar un bloque float32 de filas que empieza en la fila top"""
+    rows = slice(top, top + buffer.shape[0])
+    if dark is not None:
+        np.subtract(buffer, dark[rows], out=buffer)
+    if gain is not None:
+        np.multiply(buffer, gain[rows], out=buffer)
+    return buffer
+
+
+def clear_master_cache(device_id=None):
+    """Olvida los maestros de la memoria del contenedor (de un dispositivo o todos)"""
+    global _memory_bytes
+    prefix = f"{MASTER_PREFIX}/{device_id}/" if device_id else ''
+    for key in [k for k in _memory_cache if k.startswith(prefix)]:
+        _memory_bytes -= _memory_cache.pop(key)['bytes']
+
+
+def _load(key, kind):
+    """Maestro preparado y su ETag desde memoria, /tmp o S3 (en ese orden)"""
+    now = time.time()
+    entry = _memory_cache.get(key)
+    if entry is not None and now - entry['checkedAt'] < MASTER_CACHE_TTL:
+        _memory_cache.move_to_end(key)
+        return entry['array'], entry['etag']
+
+    try:
+        head = s3_client.head_object(Bucket=S3_BUCKET, Key=key)
+    except (ClientError, BotoCoreError) as e:
+        code = e.response.get('Error', {}).get('Code') if isinstance(e, ClientError) else None
+        if code not in ('404', 'NoSuchKey', 'NotFound'):
+            # Error transitorio: se sigue usando el maestro en memoria (si hay)
+            # y se reintenta al vencer el TTL; no se recuerda como inexistente
+            print(f"⚠️ No se pudo consultar el maestro {key}: {e}")
+            if entry is None:
+                return None, None
+            entry['checkedAt'] = now
+            _memory_cache.move_to_end(key)
+            return entry['array'], entry['etag']
+        # Sin maestro: se recuerda para no consultar S3 en cada frame
+        _store(key, None, None)
+        return None, None
+
+    etag = head['ETag'].strip('"')
+    if entry is not None and entry['etag'] == etag:
+        entry['checkedAt'] = now
+        _memory_cache.move_to_end(key)
+        return entry['array'], etag
+
+    path = os.path.join(MASTER_CACHE_DIR, f"{key.replace('/', '__')}.{etag}")
+    if os.path.exists(path):
+        os.utime(path)
+        master = np.load(path)
+    else:
+        body = s3_client.get_object(Bucket=S3_BUCKET, Key=key)['Body'].read()
+        master = np.load(io.BytesIO(body))
+        _write_disk(path, body)
+        print(f"📥 Maestro descargado: {key}")
+
+    array = _prepare(kind, master)
+    _store(key, array, etag)
+    return array, etag
+
+
+def _prepare(kind, master):
+    """dark tal cual; flat como ganancia 1 / flat (producto en vez de división por frame)"""
+    master = np.asarray(master, dtype=np.float32)
+    if kind == 'dark':
+        return master
+    gain = np.ones_like(master)
+    np.divide(1.0, master, out=gain, where=master > 0)
+    return gain
+
+
+def _store(key, array, etag):
+    """Guarda en la caché de memoria y desaloja los menos usados si se pasa del límite"""
+    global _memory_bytes
+    if key in _memory_cache:
+        _memory_bytes -= _memory_cache.pop(key)['bytes']
+    nbytes = array.nbytes if array is not None else 0
+    if nbytes > MASTER_MEMORY_BYTES:
+        return
+    _memory_cache[key] = {'array': array, 'etag': etag, 'checkedAt': time.time(), 'bytes': nbytes}
+    _memory_bytes += nbytes
+    while _memory_bytes > MASTER_MEMORY_BYTES:
+        _, evicted = _memory_cache.popitem(last=False)
+        _memory_bytes -= evicted['bytes']
+
+
+def _write_disk(path, body):
+    """Escribe el .npy en /tmp y borra los menos usados si se pasa de MASTER_DISK_BYTES"""
+    if len(body) > MASTER_DISK_BYTES:
+        return
+    os.makedirs(MASTER_CACHE_DIR, exist_ok=True)
+    files = []
+    for name in os.listdir(MASTER_CACHE_DIR):
+        stat = os.stat(os.path.join(MASTER_CACHE_DIR, name))
+        files.append((stat.st_mtime, stat.st_size, name))
+    used = sum(size for _, size, _ in files)
+    for _, size, name in sorted(files):
+        if used + len(body) <= MASTER_DISK_BYTES:
+            break
+        os.remove(os.path.join(MASTER_CACHE_DIR, name))
+        used -= size
+
+    partial = f"{path}.part"
+    with open(partial, 'wb') as f:
+        f.write(body)
+    os.replace(partial, path)
+
+
+def _spool_frame(image, spool, band_bytes=BAND_BYTES):
+    """Escribe el frame como promedio de canales float32, por bandas de filas"""
+    width, height = image.size
+    band_rows = max(1, band_bytes // (width * 4))
+    work = np.empty((band_rows, width), dtype=np.float32)
+    for top in range(0, height, band_rows):
+        bottom = min(top + band_rows, height)
+        chunk = np.asarray(image.crop((0, top, width, bottom)))
+        buffer = _channel_mean(chunk, work[:bottom - top])
+        spool.write(buffer.tobytes())
+
+
+def _channel_mean(chunk, out):
+    """Promedio de canales de un recorte (filas, ancho[, canales]) escrito en out float32"""
+    if chunk.ndim == 3:
+        np.sum(chunk, axis=2, dtype=np.float32, out=out)
+        np.multiply(out, 1.0 / chunk.shape[2], out=out)
+    else:
+        np.copyto(out, chunk, casting='unsafe')
+    return out
+
+
+def _normalize_flat(flat):
+    """
+    Divide cada fila por su media móvil: queda la respuesta relativa de cada
+    pixel (~1). Donde la iluminación es menor a FLAT_MIN_LEVEL del máximo la
+    respuesta no es medible y se deja en 1.
+    """
+    height, width = flat.shape
+    window = min(FLAT_SMOOTH_WINDOW, width)
+    level = max(float(flat.max()), 1e-6) * FLAT_MIN_LEVEL
+    chunk_rows = max(1, MASTER_CHUNK_BYTES // (width * 8 * 2))
+    for top in range(0, height, chunk_rows):
+        rows = flat[top:top + chunk_rows]
+        padded = np.pad(rows.astype(np.float64), ((0, 0), (window // 2, window - 1 - window // 2)), mode='edge')
+        cumsum = np.pad(np.cumsum(padded, axis=1), ((0, 0), (1, 0)))
+        smooth = (cumsum[:, window:] - cumsum[:, :-window]) / window
+        lit = smooth > level
+        np.divide(rows, smooth, out=rows, where=lit)
+        rows[~lit] = 1.0
+    return flat
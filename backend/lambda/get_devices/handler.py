@@ -1,11 +1,17 @@
 import json
 import boto3
 import os
-from decimal import Decimal
+import time
+from datetime import datetime
+from instrumentation import instrumented, stage, record_size
+from dynamodb_json import items_json, serialized_size
+from presence import PRESENCE_TABLE, is_online, last_seen
 
-dynamodb = boto3.resource('dynamodb')
-devices_table = dynamodb.Table(os.environ['DEVICES_TABLE'])
+# Cliente de bajo nivel: los items se escriben como JSON sin pasar por Decimal
+dynamodb_client = boto3.client('dynamodb')
+DEVICES_TABLE = os.environ['DEVICES_TABLE']
 
+@instrumented
 def lambda_handler(event, context):
     """
     GET /devices
@@ -18,18 +24,23 @@ def lambda_handler(event, context):
         print(f"Obteniendo dispositivos para usuario: {user_id}")
         
         # Query por userId usando GSI
-        response = devices_table.query(
-            IndexName='UserIdIndex',
-            KeyConditionExpression='userId = :userId',
-            ExpressionAttributeValues={
-                ':userId': user_id
-            }
-        )
+        with stage('dynamodbQuery'):
+            response = dynamodb_client.query(
+                TableName=DEVICES_TABLE,
+                IndexName='UserIdIndex',
+                KeyConditionExpression='userId = :userId',
+                ExpressionAttributeValues={
+                    ':userId': {'S': user_id}
+                }
+            )
         
         devices = response.get('Items', [])
+        apply_presence(devices)
+        record_size('items', sum(serialized_size(d) for d in devices))
         
-        # Convertir Decimals a float para JSON
-        devices = json.loads(json.dumps(devices, default=decimal_default))
+        # Items AttributeValue -> JSON en una pasada
+        with stage('serialize'):
+            body = f'{{"devices": {items_json(devices)}, "count": {len(devices)}}}'
         
         print(f"Encontrados {len(devices)} dispositivos")
         
@@ -39,10 +50,7 @@ def lambda_handler(event, context):
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({
-                'devices': devices,
-                'count': len(devices)
-            })
+            'body': body
         }
         
     except KeyError:
@@ -76,7 +84,15 @@ def lambda_handler(event, context):
             'body': json.dumps({'error': str(e)})
         }
 
-def decimal_default(obj):
-    if isinstance(obj, Decimal):
-        return float(obj)
-    raise TypeError
\ No newline at end of file
+def apply_presence(devices):
+    """
+    isOnline y lastSeen derivados del registro de presencia (ver presence):
+    en línea si el último heartbeat es más reciente que el umbral
+    """
+    seen = last_seen(dynamodb_client, PRESENCE_TABLE, [d['deviceId']['S'] for d in devices])
+    now = time.time()
+    for device in devices:
+        timestamp = seen.get(device['deviceId']['S'])
+        device['isOnline'] = {'BOOL': is_online(timestamp, now)}
+        if timestamp is not None:
+            device['lastSeen'] = {'S': datetime.utcfromtimestamp(timestamp).isoformat()}
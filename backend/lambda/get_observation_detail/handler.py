@@ -1,38 +1,98 @@
 import json
 import boto3
 import os
-from decimal import Decimal
+from instrumentation import instrumented, stage, record_size
+from dynamodb_json import item_json, serialized_size
+from spectral_format import ENCODING, ENCODED_FIELDS, decode_array, read_npy
 
-dynamodb = boto3.resource('dynamodb')
-observations_table = dynamodb.Table(os.environ['OBSERVATIONS_TABLE'])
+# Cliente de bajo nivel: el item se escribe como JSON sin pasar por Decimal
+dynamodb_client = boto3.client('dynamodb')
+s3_client = boto3.client('s3')
 
+OBSERVATIONS_TABLE = os.environ['OBSERVATIONS_TABLE']
+
+S3_BUCKET = os.environ.get('S3_BUCKET')
+
+@instrumented
 def lambda_handler(event, context):
     user_id = event['requestContext']['authorizer']['claims']['sub']
     observation_id = event['pathParameters']['observationId']
 
-    resp = observations_table.get_item(Key={'observationId': observation_id})
+    with stage('dynamodbGet'):
+        resp = dynamodb_client.get_item(
+            TableName=OBSERVATIONS_TABLE,
+            Key={'observationId': {'S': observation_id}}
+        )
     item = resp.get('Item')
 
     if not item:
         return _resp(404, {'error': 'Observación no encontrada'})
+    record_size('item', serialized_size(item))
 
-    if item.get('userId') != user_id:
+    if item.get('userId', {}).get('S') != user_id:
         return _resp(403, {'error': 'No autorizado'})
 
-    item = json.loads(json.dumps(item, default=_decimal))
-    return _resp(200, {'observation': item})
+    # ?resolution=N entrega el nivel reducido de al menos N puntos (o el completo)
+    params = event.get('queryStringParameters') or {}
+    resolution = params.get('resolution')
+    if resolution not in (None, '', 'full'):
+        try:
+            resolution = int(resolution)
+        except ValueError:
+            return _resp(400, {'error': 'resolution debe ser un número de puntos o "full"'})
+    else:
+        resolution = None
+
+    if 'M' in item.get('spectralData', {}):
+        with stage('decodeSpectral'):
+            item['spectralData'] = {'M': _decode_spectral(item['spectralData']['M'], resolution)}
+
+    with stage('serialize'):
+        body = f'{{"observation": {item_json(item)}}}'
+    return _resp(200, body=body)
+
+def _decode_spectral(data, resolution=None):
+    """
+    Restaura wavelengths y spectralProfile como arrays JSON
+    data es el mapa AttributeValue de spectralData; los arrays decodificados
+    se insertan ya codificados ({'JSON': texto})
+    Con resolution se decodifica solo el nivel reducido que corresponde;
+    sin ella, el perfil completo (blobs SPC1 o .npy en S3)
+    """
+    data = dict(data)
+    levels = data.pop('profileLevels', {}).get('M', {})
+    sizes = sorted(int(size) for size in levels)
+    if sizes:
+        data['availableResolutions'] = {'JSON': json.dumps(sizes)}
 
-def _decimal(o):
-    if isinstance(o, Decimal):
-        return float(o)
-    raise TypeError
+    level = next((size for size in sizes if size >= resolution), None) if resolution else None
+    encoding = data.pop('encoding', {}).get('S')
+    if level is not None:
+        data.pop('spectrumS3Key', None)
+        fields = levels[str(level)]['M']
+        for field in ENCODED_FIELDS:
+            data[field] = {'JSON': json.dumps(decode_array(fields[field]['B']))}
+        data['resolution'] = {'N': str(level)}
+    elif encoding == ENCODING:
+        for field in ENCODED_FIELDS:
+            if field in data:
+                data[field] = {'JSON': json.dumps(decode_array(data[field]['B']))}
+    elif data.get('spectrumS3Key'):
+        with stage('s3Get'):
+            obj = s3_client.get_object(Bucket=S3_BUCKET, Key=data['spectrumS3Key']['S'])
+            npy_bytes = obj['Body'].read()
+        record_size('spectrumObject', len(npy_bytes))
+        for field, values in zip(ENCODED_FIELDS, read_npy(npy_bytes)):
+            data[field] = {'JSON': json.dumps(values)}
+    return data
 
-def _resp(code, body):
+def _resp(code, payload=None, body=None):
+    """payload se codifica con json.dumps; body es texto JSON ya armado"""
     return {
         'statusCode': code,
         'headers': {
             'Content-Type': 'application/json',
             'Access-Control-Allow-Origin': '*'
         },
-        'body': json.dumps(body)
-    }
\ No newline at end of file
+        'body': body if body is not None else json.dumps(payload)
+    }
@@ -1,11 +1,14 @@
 import json
 import boto3
 import os
-from decimal import Decimal
+from instrumentation import instrumented, stage, record_size
+from dynamodb_json import items_json, serialized_size
 
-dynamodb = boto3.resource('dynamodb')
-observations_table = dynamodb.Table(os.environ['OBSERVATIONS_TABLE'])
+# Cliente de bajo nivel: los items se escriben como JSON sin pasar por Decimal
+dynamodb_client = boto3.client('dynamodb')
+OBSERVATIONS_TABLE = os.environ['OBSERVATIONS_TABLE']
 
+@instrumented
 def lambda_handler(event, context):
     """
     GET /observations?deviceId={deviceId}&limit={limit}
@@ -29,31 +32,46 @@ def lambda_handler(event, context):
             # Primero verificar que el dispositivo pertenece al usuario
             # (en producción deberías hacer esta validación)
             
-            response = observations_table.query(
-                IndexName='DeviceIdIndex',
-                KeyConditionExpression='deviceId = :deviceId',
-                ExpressionAttributeValues={
-                    ':deviceId': device_id
-                },
-                Limit=limit,
-                ScanIndexForward=False  # Orden descendente (más recientes primero)
-            )
+            with stage('dynamodbQuery'):
+                response = dynamodb_client.query(
+                    TableName=OBSERVATIONS_TABLE,
+                    IndexName='DeviceIdIndex',
+                    KeyConditionExpression='deviceId = :deviceId',
+                    ExpressionAttributeValues={
+                        ':deviceId': {'S': device_id}
+                    },
+                    Limit=limit,
+                    ScanIndexForward=False  # Orden descendente (más recientes primero)
+                )
         else:
             # Query por userId - todas las observaciones del usuario
-            response = observations_table.query(
-                IndexName='UserIdIndex',
-                KeyConditionExpression='userId = :userId',
-                ExpressionAttributeValues={
-                    ':userId': user_id
-                },
-                Limit=limit,
-                ScanIndexForward=False
-            )
+            with stage('dynamodbQuery'):
+                response = dynamodb_client.query(
+                    TableName=OBSERVATIONS_TABLE,
+                    IndexName='UserIdIndex',
+                    KeyConditionExpression='userId = :userId',
+                    ExpressionAttributeValues={
+                        ':userId': {'S': user_id}
+                    },
+                    Limit=limit,
+                    ScanIndexForward=False
+                )
         
         observations = response.get('Items', [])
+        record_size('items', sum(serialized_size(obs) for obs in observations))
         
-        # Convertir Decimals a float para JSON
-        observations = json.loads(json.dumps(observations, default=decimal_default))
+        # Los arrays espectrales binarios solo se entregan en el detalle
+        for obs in observations:
+            spectral = obs.get('spectralData', {}).get('M')
+            if spectral is not None:
+                spectral.pop('profileLevels', None)
+                if spectral.pop('encoding', None):
+                    spectral.pop('wavelengths', None)
+                    spectral.pop('spectralProfile', None)
+        
+        # Items AttributeValue -> JSON en una pasada
+        with stage('serialize'):
+            body = f'{{"observations": {items_json(observations)}, "count": {len(observations)}}}'
         
         print(f"Encontradas {len(observations)} observaciones")
         
@@ -63,10 +81,7 @@ def lambda_handler(event, context):
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({
-                'observations': observations,
-                'count': len(observations)
-            })
+            'body': body
         }
         
     except Exception as e:
@@ -82,8 +97,3 @@ def lambda_handler(event, context):
             },
             'body': json.dumps({'error': str(e)})
         }
-
-def decimal_default(obj):
-    if isinstance(obj, Decimal):
-        return float(obj)
-    raise TypeError
\ No newline at end of file
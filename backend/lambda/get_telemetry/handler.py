@@ -0,0 +1,109 @@
+import json
+import boto3
+import math
+import os
+import time
+from datetime import datetime, timezone
+from instrumentation import instrumented, stage, record_size, count
+from telemetry import TELEMETRY_TABLE, bucket_of, parse_time, decode_blocks, downsample
+
+# Cliente de bajo nivel: los bloques llegan como bytes sin pasar por Binary
+dynamodb_client = boto3.client('dynamodb')
+DEVICES_TABLE = os.environ['DEVICES_TABLE']
+
+DEFAULT_RANGE_SECONDS = 24 * 3600
+# Rango máximo por consulta (un item por hora)
+MAX_RANGE_SECONDS = 31 * 24 * 3600
+DEFAULT_POINTS = 200
+MAX_POINTS = 2000
+
+@instrumented
+def lambda_handler(event, context):
+    """
+    GET /devices/{deviceId}/telemetry?from=ISO&to=ISO&points=N&metrics=temperature,humidity
+    Series de sensores reducidas a ~N intervalos (promedio, mínimo y máximo)
+    Solo lee los items de las horas que cubre el rango
+    """
+    user_id = event['requestContext']['authorizer']['claims']['sub']
+    device_id = event['pathParameters']['deviceId']
+    params = event.get('queryStringParameters') or {}
+
+    try:
+        end = parse_time(params['to']) if params.get('to') else time.time()
+        start = parse_time(params['from']) if params.get('from') else end - DEFAULT_RANGE_SECONDS
+        points = int(params.get('points') or DEFAULT_POINTS)
+    except ValueError:
+        return _resp(400, {'error': 'from/to deben ser ISO 8601 o epoch y points un entero'})
+    if not 0 < end - start <= MAX_RANGE_SECONDS:
+        return _resp(400, {'error': f'el rango debe ser positivo y de hasta {MAX_RANGE_SECONDS // 86400} días'})
+    if not 1 <= points <= MAX_POINTS:
+        return _resp(400, {'error': f'points debe estar entre 1 y {MAX_POINTS}'})
+    metrics = set(params['metrics'].split(',')) if params.get('metrics') else None
+
+    with stage('dynamodbGet'):
+        device = dynamodb_client.get_item(
+            TableName=DEVICES_TABLE,
+            Key={'deviceId': {'S': device_id}},
+            ProjectionExpression='userId'
+        ).get('Item')
+    if not device:
+        return _resp(404, {'error': 'Dispositivo no encontrado'})
+    if device.get('userId', {}).get('S') != user_id:
+        return _resp(403, {'error': 'No autorizado'})
+
+    series = {}
+    query = {
+        'TableName': TELEMETRY_TABLE,
+        'KeyConditionExpression': 'deviceId = :deviceId AND #hour BETWEEN :first AND :last',
+        'ExpressionAttributeNames': {'#hour': 'hour'},
+        'ExpressionAttributeValues': {
+            ':deviceId': {'S': device_id},
+            ':first': {'N': str(bucket_of(start))},
+            ':last': {'N': str(bucket_of(end))},
+        },
+        'ProjectionExpression': '#hour, blocks',
+    }
+    buckets = 0
+    while True:
+        with stage('dynamodbQuery'):
+            response = dynamodb_client.query(**query)
+        with stage('decode'):
+            for item in response.get('Items', []):
+                blocks = [block['B'] for block in item['blocks']['L']]
+                record_size('blocks', sum(len(block) for block in blocks))
+                for name, values in decode_blocks(int(item['hour']['N']), blocks).items():
+                    if metrics is None or name in metrics:
+                        series.setdefault(name, []).extend(values)
+        buckets += len(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            break
+        query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    count('telemetryBuckets', buckets)
+
+    # Intervalo en segundos enteros, de al menos 1 s
+    step = max(1, math.ceil((end - start) / points))
+    with stage('downsample'):
+        body = {
+            'deviceId': device_id,
+            'from': _iso(start),
+            'to': _iso(end),
+            'step': step,
+            'series': {
+                name: [dict(point, t=_iso(point['t'])) for point in downsample(values, start, end, step)]
+                for name, values in sorted(series.items())
+            },
+        }
+    return _resp(200, body)
+
+def _iso(t):
+    return datetime.fromtimestamp(t, timezone.utc).isoformat()
+
+def _resp(code, payload):
+    return {
+        'statusCode': code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(payload)
+    }
@@ -0,0 +1,65 @@
+"""
+Formato de los mensajes de los dispositivos: JSON o MessagePack
+
+El firmware puede publicar cualquiera de los dos en los mismos topics
+(ArduinoJson: serializeJson / serializeMsgPack). En MessagePack los campos
+binarios (imageData, data de las partes) van como bin, sin base64: el
+mensaje MQTT es ~25% más chico y el ESP32 no codifica base64.
+
+Las reglas de IoT entregan el payload tal cual llegó:
+
+    SELECT encode(*, 'base64') AS payload, topic() AS topic FROM 'orionseye/+/image'
+
+(una regla no puede leer campos de un payload que no es JSON) y el
+formato se detecta por mensaje con el primer byte: '{' es JSON; un map de
+MessagePack empieza con 0x80-0x8f, 0xde o 0xdf. Un evento sin payload es
+el formato anterior (la regla ya hizo SELECT * del JSON).
+"""
+import base64
+import json
+import msgpack
+from instrumentation import stage, record_size, set_property
+
+MSGPACK_MAP_PREFIXES = frozenset(range(0x80, 0x90)) | {0xde, 0xdf}
+
+
+def decode_event(event):
+    """Mensaje del dispositivo (dict con topic) a partir del evento de la regla"""
+    if 'payload' not in event:
+        set_property('payloadFormat', 'json')
+        return event
+
+    with stage('payloadDecode'):
+        raw = base64.b64decode(event['payload'])
+        record_size('devicePayload', len(raw))
+        payload_format = detect_format(raw)
+        if payload_format == 'msgpack':
+            message = msgpack.unpackb(raw, raw=False)
+        else:
+            message = json.loads(raw)
+    if not isinstance(message, dict):
+        raise ValueError(f"El mensaje debe ser un objeto, no {type(message).__name__}")
+    set_property('payloadFormat', payload_format)
+    message['topic'] = event.get('topic', '')
+    if 'receivedAt' in event:
+        # Hora de recepción en IoT Core (timestamp() de la regla de /data)
+        message['receivedAt'] = event['receivedAt']
+    return message
+
+
+def detect_format(raw):
+    """'json' o 'msgpack' según el primer byte del payload"""
+    stripped = raw.lstrip()
+    if stripped[:1] == b'{':
+        return 'json'
+    if raw and raw[0] in MSGPACK_MAP_PREFIXES:
+        return 'msgpack'
+    raise ValueError(f"Formato de payload desconocido (primer byte {raw[:1].hex() or 'vacío'})")
+
+
+def binary_field(value):
+    """Bytes de un campo binario: bin de MessagePack tal cual, o texto base64 de JSON"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    with stage('base64Decode'):
+        return base64.b64decode(value)
@@ -1,24 +1,50 @@
 import json
+import os
 import boto3
 from datetime import datetime
+from instrumentation import instrumented, stage, record_size, set_property
+from claim_check import put_image
+from image_transfer import handle_chunk
+from device_payload import decode_event, binary_field
+from device_writes import DeviceWriter
+from presence import PRESENCE_TABLE, heartbeat
+from telemetry import TELEMETRY_TABLE, sample_from_message, append_samples, bucket_of
+from sqs_batch import is_batch, consume
 
 lambda_client = boto3.client('lambda')
+s3_client = boto3.client('s3')
+sqs_client = boto3.client('sqs')
 dynamodb = boto3.resource('dynamodb')
+devices_table = dynamodb.Table(os.environ['DEVICES_TABLE'])
+presence_table = dynamodb.Table(PRESENCE_TABLE)
+telemetry_table = dynamodb.Table(TELEMETRY_TABLE)
 
+S3_BUCKET = os.environ.get('S3_BUCKET')
+# Con cola, las imágenes se procesan en lotes (ver sqs_batch); sin ella, una invocación por imagen
+IMAGE_QUEUE_URL = os.environ.get('IMAGE_QUEUE_URL')
+
+@instrumented
 def lambda_handler(event, context):
     """
     Maneja mensajes MQTT del ESP32 vía IoT Rules
     Topics:
       - orionseye/{deviceId}/image
+      - orionseye/{deviceId}/chunk   (imagen por partes, ver image_transfer.py)
       - orionseye/{deviceId}/status
       - orionseye/{deviceId}/data
+    Los mensajes /data llegan por la cola de telemetría en lotes (ver save_sensor_batch)
     """
+    if is_batch(event):
+        return save_sensor_batch(event['Records'])
+    
     try:
         print(f"Mensaje IoT recibido: {json.dumps(event)}")
         
+        # JSON o MessagePack, según el mensaje (ver device_payload)
+        message = decode_event(event)
+        
         # Extraer deviceId del topic
-        topic = event.get('topic', '')
-        message = event
+        topic = message.get('topic', '')
         
         # Topic format: orionseye/{deviceId}/image
         parts = topic.split('/')
@@ -28,25 +54,27 @@ def lambda_handler(event, context):
         if not device_id:
             print("No se pudo extraer deviceId del topic")
             return {'statusCode': 400, 'body': 'Invalid topic'}
+        set_property('topicType', topic_type)
+        
+        # Cualquier mensaje del dispositivo cuenta como heartbeat
+        record_presence(device_id)
         
         # Determinar tipo de mensaje
         if topic_type == 'image':
             # Procesar imagen espectral
             print(f"Procesando imagen del dispositivo: {device_id}")
+            submit_image(device_id, message)
             
-            response = lambda_client.invoke(
-                FunctionName='orions-eye-process-image-dev',
-                InvocationType='Event',  # Asíncrono
-                Payload=json.dumps({
-                    'deviceId': device_id,
-                    'imageData': message.get('imageData'),
-                    'imageS3Key': message.get('imageS3Key'),
-                    'userId': message.get('userId'),
-                    'timestamp': message.get('timestamp', datetime.utcnow().isoformat())
-                })
+        elif topic_type == 'chunk':
+            # Parte de una imagen grande; al completarse se envía a procesamiento
+            status = handle_chunk(
+                device_id, message,
+                lambda image_ref, metadata: submit_image(device_id, metadata, image_ref)
             )
-            
-            print(f"Lambda de procesamiento invocada")
+            return {
+                'statusCode': 400 if status == 'invalid' else 200,
+                'body': json.dumps({'transfer': status})
+            }
             
         elif topic_type == 'status':
             # Actualizar estado del dispositivo
@@ -73,27 +101,108 @@ def lambda_handler(event, context):
             'body': json.dumps({'error': str(e)})
         }
 
+def submit_image(device_id, message, image_ref=None):
+    """
+    Envía la imagen a procesamiento: a la cola de imágenes si está configurada,
+    si no con una invocación asíncrona
+    La imagen va antes a S3 por contenido (claim_check) y el payload lleva solo
+    la referencia: su tamaño no depende del frame (límite de 256 KB asíncrono)
+    """
+    if image_ref is None and message.get('imageData'):
+        image_bytes = binary_field(message['imageData'])
+        record_size('image', len(image_bytes))
+        with stage('s3Put'):
+            image_ref = put_image(s3_client, S3_BUCKET, image_bytes, message.get('contentType'),
+                                  metadata={'deviceId': device_id, 'type': 'spectral_image'})
+    payload = json.dumps({
+        'deviceId': device_id,
+        'imageRef': image_ref,
+        'imageS3Key': message.get('imageS3Key'),
+        'exposure': message.get('exposure'),
+        'userId': message.get('userId'),
+        'timestamp': message.get('timestamp', datetime.utcnow().isoformat())
+    })
+    record_size('invokePayload', len(payload))
+    if IMAGE_QUEUE_URL:
+        with stage('sqsSend'):
+            sqs_client.send_message(QueueUrl=IMAGE_QUEUE_URL, MessageBody=payload)
+        print(f"Imagen encolada para procesamiento")
+        return
+    with stage('lambdaInvoke'):
+        lambda_client.invoke(
+            FunctionName='orions-eye-process-image-dev',
+            InvocationType='Event',  # Asíncrono
+            Payload=payload
+        )
+    print(f"Lambda de procesamiento invocada")
+
+def record_presence(device_id):
+    """
+    Actualiza lastSeen en el PresenceTable (ver presence); el DevicesTable
+    solo se escribe cuando el dispositivo vuelve a estar en línea
+    """
+    try:
+        if heartbeat(presence_table, device_id):
+            writer = DeviceWriter(devices_table)
+            writer.update(device_id, {'isOnline': True})
+            writer.flush()
+            print(f"Dispositivo en línea: {device_id}")
+    except Exception as e:
+        print(f"Error registrando presencia: {e}")
+
 def update_device_status(device_id, message):
-    """Actualiza el estado del dispositivo en DynamoDB"""
-    import os
-    devices_table = dynamodb.Table(os.environ['DEVICES_TABLE'])
-    
+    """
+    Actualiza el estado del dispositivo en DynamoDB; si no cambió y la
+    última escritura es reciente, no escribe (ver device_writes)
+    """
+    writer = DeviceWriter(devices_table)
+    writer.update(device_id, {'status': message.get('status', 'online')}, skippable=True)
     try:
-        devices_table.update_item(
-            Key={'deviceId': device_id},
-            UpdateExpression='SET #status = :status, lastUpdate = :timestamp, isOnline = :online',
-            ExpressionAttributeNames={'#status': 'status'},
-            ExpressionAttributeValues={
-                ':status': message.get('status', 'online'),
-                ':timestamp': datetime.utcnow().isoformat(),
-                ':online': True
-            }
-        )
+        writer.flush()
         print(f"Estado actualizado para {device_id}")
     except Exception as e:
         print(f"Error actualizando estado: {e}")
 
 def save_sensor_data(device_id, message):
-    """Guarda datos de sensores adicionales"""
-    print(f"💾 Guardando datos de sensores: {message}")
-    # TODO: Implementar si el ESP32 tiene sensores adicionales (temperatura, etc)
\ No newline at end of file
+    """Guarda una muestra de sensores (temperatura, etc) en el TelemetryTable"""
+    sample = sample_from_message(message)
+    if sample is None:
+        print(f"⚠️ Mensaje de datos sin valores numéricos: {device_id}")
+        return
+    t, values = sample
+    if append_samples(telemetry_table, [(device_id, t, values)]):
+        raise RuntimeError(f"No se pudo guardar la telemetría de {device_id}")
+    print(f"💾 Telemetría guardada: {device_id} {sorted(values)}")
+
+def save_sensor_batch(records):
+    """
+    Lote de mensajes /data de la cola de telemetría: las muestras se agrupan
+    y se escribe un bloque por dispositivo y hora; los mensajes de un bloque
+    que falló vuelven a la cola
+    """
+    def parse(message):
+        try:
+            message = decode_event(message)
+        except ValueError as e:
+            # Un payload ilegible no mejora con reintentos
+            print(f"⚠️ Mensaje de datos ilegible: {e}")
+            return []
+        parts = message.get('topic', '').split('/')
+        sample = sample_from_message(message)
+        if len(parts) < 2 or not parts[1] or sample is None:
+            print(f"⚠️ Mensaje de datos inválido: {message.get('topic')}")
+            return []
+        return [(parts[1],) + sample]
+    
+    def commit(pending):
+        samples = [sample for _, samples in pending for sample in samples]
+        # También son heartbeats de sus dispositivos
+        for device_id in {sample[0] for sample in samples}:
+            record_presence(device_id)
+        failed = set(append_samples(telemetry_table, samples))
+        return sorted({
+            message_id for message_id, samples in pending
+            for device_id, t, _ in samples if (device_id, bucket_of(t)) in failed
+        })
+    
+    return consume(records, parse, commit)
@@ -0,0 +1,315 @@
+"""
+Transferencia de imágenes por partes sobre MQTT (topic orionseye/{deviceId}/chunk)
+
+Un mensaje MQTT de IoT Core admite 128 KB; las imágenes grandes del
+ESP32-CAM se envían en partes:
+
+    {
+      "transferId": "a1b2c3",     único por imagen en el dispositivo
+      "seq": 0,                   0 .. total-1, en cualquier orden
+      "total": 12,
+      "crc": 3735928559,          CRC-32 de los bytes de esta parte
+      "data": "<base64>",         bytes sin base64 (bin) si el mensaje es MessagePack
+      // opcionales, en cualquier parte (se guarda la primera vez que llegan):
+      "size": 180344, "imageCrc": 123456789, "contentType": "image/jpeg",
+      "exposure": 100, "userId": "...", "timestamp": "..."
+    }
+
+Cada parte se guarda como un item del TransfersTable (transferKey =
+deviceId#transferId, seq) y su número se agrega (ADD) al set `received`
+del item cabecera (seq = -1). Guardar una parte y agregarla al set son
+idempotentes: duplicados y reenvíos no cuentan dos veces y no hay contador
+que pueda desincronizarse. Todo expira por TTL (TRANSFER_TTL_SECONDS); la
+cabecera renueva su expiración con cada parte, así una transferencia lenta
+no pierde el set `received` a mitad de camino.
+
+Cuando el set está completo se reensambla, se verifica tamaño y CRC de la
+imagen, se sube a S3 por contenido (claim_check) y se envía a procesamiento UNA sola vez: la
+invocación que gana la escritura condicional de `submittedAt` es la única
+que invoca.
+
+Las partes de un envío seguido se procesan en invocaciones concurrentes y
+pueden guardarse en desorden: un hueco solo cuenta como pérdida si la
+transferencia estuvo detenida. La cabecera guarda la hora de la última
+parte (lastChunkAt); una parte que llega después de NACK_INTERVAL_SECONDS
+sin partes nuevas provoca un NACK de las que siguen faltando. El firmware
+reenvía la última parte si no recibe transferComplete en
+DEVICE_RESEND_SECONDS (mayor que NACK_INTERVAL_SECONDS), así una pérdida
+siempre termina en un NACK (NACK_INTERVAL_SECONDS se limita a la mitad de
+ese timeout aunque se configure mayor).
+
+Respuestas al dispositivo en orionseye/{deviceId}/command:
+  {"command": "resend", "transferId": ..., "missing": [...]}
+      al llegar una parte tras una pausa y con huecos, o una parte con CRC
+      incorrecto (como mucho una cada NACK_INTERVAL_SECONDS por transferencia)
+  {"command": "transferComplete", "transferId": ..., "s3Key": ...}
+      al enviarse a procesamiento, y de nuevo si llegan partes repetidas
+      de una transferencia ya completa (el ACK anterior pudo perderse)
+"""
+import json
+import os
+import time
+import zlib
+from decimal import Decimal
+import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from instrumentation import stage, count, record_size, set_property
+from claim_check import put_image
+from device_payload import binary_field
+
+dynamodb = boto3.resource('dynamodb')
+s3_client = boto3.client('s3')
+iot_data_client = boto3.client('iot-data')
+
+TRANSFERS_TABLE = os.environ.get('TRANSFERS_TABLE')
+transfers_table = dynamodb.Table(TRANSFERS_TABLE) if TRANSFERS_TABLE else None
+
+S3_BUCKET = os.environ.get('S3_BUCKET')
+
+TRANSFER_TTL_SECONDS = int(os.environ.get('TRANSFER_TTL_SECONDS', '600'))
+# Timeout del firmware para reenviar la última parte sin transferComplete
+DEVICE_RESEND_SECONDS = 5
+# Debe ser menor que DEVICE_RESEND_SECONDS para que el reenvío provoque el NACK
+NACK_INTERVAL_SECONDS = min(float(os.environ.get('NACK_INTERVAL_SECONDS', '2')), DEVICE_RESEND_SECONDS / 2)
+MAX_CHUNKS = 1024
+MAX_TRANSFER_BYTES = 8 * 1024 * 1024
+# Partes listadas por NACK (el dispositivo vuelve a pedir si faltan más)
+MAX_NACK_SEQS = 64
+
+# Campos del mensaje que describen la imagen y se guardan en la cabecera
+METADATA_FIELDS = ('size', 'imageCrc', 'contentType', 'exposure', 'userId', 'timestamp')
+
+HEADER_SEQ = -1
+
+
+def handle_chunk(device_id, message, submit):
+    """
+    Guarda una parte y, si completa la transferencia, envía la imagen
+    submit(image_ref, metadata) invoca el procesamiento; se llama una sola vez por
+    transferencia (metadata: campos de METADATA_FIELDS recibidos)
+    Retorna el estado: stored, duplicate, corrupt, complete, submitted o invalid
+    """
+    if transfers_table is None:
+        raise RuntimeError("TRANSFERS_TABLE no está configurada")
+
+    try:
+        transfer_id = str(message['transferId'])
+        seq, total = int(message['seq']), int(message['total'])
+        data = binary_field(message['data'])
+        crc = int(message['crc'])
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"⚠️ Parte inválida de {device_id}: {e}")
+        return 'invalid'
+    if not 0 < total <= MAX_CHUNKS or not 0 <= seq < total or len(transfer_id) > 64:
+        print(f"⚠️ Parte fuera de rango de {device_id}: seq={seq} total={total}")
+        return 'invalid'
+    # Antes de guardar nada: tamaño declarado, o el mínimo que implican las
+    # partes anteriores a la última (todas del mismo tamaño que esta)
+    try:
+        declared = int(message.get('size') or 0)
+    except (TypeError, ValueError):
+        declared = 0
+    if declared > MAX_TRANSFER_BYTES or (seq < total - 1 and (total - 1) * len(data) >= MAX_TRANSFER_BYTES):
+        print(f"⚠️ Transferencia de {device_id} excede {MAX_TRANSFER_BYTES} bytes: seq={seq} total={total}")
+        count('transfersTooLarge')
+        return 'invalid'
+    set_property('transferId', transfer_id)
+    record_size('chunk', len(data))
+
+    transfer_key = f"{device_id}#{transfer_id}"
+    if zlib.crc32(data) != crc:
+        print(f"⚠️ CRC incorrecto en {transfer_key} parte {seq}")
+        count('chunksCorrupt')
+        _nack(device_id, transfer_id, transfer_key, [seq])
+        return 'corrupt'
+
+    now = time.time()
+    with stage('chunkStore'):
+        transfers_table.put_item(Item={
+            'transferKey': transfer_key,
+            'seq': seq,
+            'data': data,
+            'expiresAt': int(now) + TRANSFER_TTL_SECONDS
+        })
+        header = _add_received(transfer_key, seq, total, message, now)
+
+    received = {int(s) for s in header.get('received', ())}
+    if int(header['total']) != total:
+        print(f"⚠️ {transfer_key}: total {total} no coincide con {header['total']}")
+        return 'invalid'
+
+    if 'submittedAt' in header:
+        # Ya se envió: el dispositivo no recibió el ACK y sigue reenviando
+        count('chunksDuplicate')
+        _publish(device_id, {'command': 'transferComplete', 'transferId': transfer_id,
+                             's3Key': header.get('s3Key')})
+        return 'duplicate'
+
+    if len(received) < total:
+        # Huecos tras una pausa (ver docstring del módulo): las partes que faltan se perdieron
+        idle = now - int(header['previousChunkAt']) / 1000
+        if idle >= NACK_INTERVAL_SECONDS:
+            missing = sorted(set(range(total)) - received)
+            _nack(device_id, transfer_id, transfer_key, missing)
+        return 'stored'
+
+    return _complete(device_id, transfer_id, transfer_key, header, submit)
+
+
+def _add_received(transfer_key, seq, total, message, now):
+    """
+    Agrega seq al set de la cabecera (idempotente) y retorna la cabecera actualizada
+    previousChunkAt: lastChunkAt (ms) antes de esta parte (SET lee el item anterior)
+    """
+    names = {'#total': 'total'}
+    values = {':seq': {seq}, ':total': total, ':expires': int(now) + TRANSFER_TTL_SECONDS,
+              ':now': int(now * 1000)}
+    assignments = ['#total = if_not_exists(#total, :total)', 'expiresAt = :expires',
+                   'previousChunkAt = if_not_exists(lastChunkAt, :now)', 'lastChunkAt = :now']
+    for field in METADATA_FIELDS:
+        if message.get(field) is not None:
+            names[f'#{field}'] = field
+            value = message[field]
+            values[f':{field}'] = Decimal(str(value)) if isinstance(value, float) else value
+            assignments.append(f'#{field} = if_not_exists(#{field}, :{field})')
+
+    response = transfers_table.update_item(
+        Key={'transferKey': transfer_key, 'seq': HEADER_SEQ},
+        UpdateExpression=f"SET {', '.join(assignments)} ADD received :seq",
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+        ReturnValues='ALL_NEW'
+    )
+    return response['Attributes']
+
+
+def _complete(device_id, transfer_id, transfer_key, header, submit):
+    """Reensambla, verifica, sube a S3 y envía a procesamiento si esta invocación gana"""
+    with stage('reassemble'):
+        image_bytes = _reassemble(transfer_key, int(header['total']))
+    record_size('image', len(image_bytes))
+
+    size, image_crc = header.get('size'), header.get('imageCrc')
+    if (size is not None and int(size) != len(image_bytes)) or \
+            (image_crc is not None and int(image_crc) != zlib.crc32(image_bytes)):
+        # Las partes pasaron su CRC pero no forman la imagen declarada: se pide todo de nuevo
+        print(f"❌ {transfer_key}: imagen reensamblada no coincide (tamaño o CRC)")
+        count('transfersCorrupt')
+        _discard(transfer_key, int(header['total']))
+        _nack(device_id, transfer_id, transfer_key, list(range(int(header['total']))), force=True)
+        return 'corrupt'
+
+    with stage('s3Put'):
+        # Clave por contenido: si dos invocaciones llegan acá, la segunda no reescribe
+        image_ref = put_image(s3_client, S3_BUCKET, image_bytes, header.get('contentType'),
+                              metadata={'deviceId': device_id, 'transferId': transfer_id})
+    s3_key = image_ref['s3Key']
+
+    if not _claim_submit(transfer_key, s3_key):
+        print(f"♻️ {transfer_key} ya fue enviada por otra invocación")
+        return 'complete'
+
+    try:
+        submit(image_ref, _metadata(header))
+    except Exception:
+        # Libera la marca para que un reenvío del dispositivo pueda reintentar
+        transfers_table.update_item(
+            Key={'transferKey': transfer_key, 'seq': HEADER_SEQ},
+            UpdateExpression='REMOVE submittedAt'
+        )
+        raise
+
+    count('transfersSubmitted')
+    print(f"✅ Transferencia {transfer_key} completa ({len(image_bytes)} bytes): {s3_key}")
+    _publish(device_id, {'command': 'transferComplete', 'transferId': transfer_id, 's3Key': s3_key})
+    return 'submitted'
+
+
+def _metadata(header):
+    """Campos descriptivos de la cabecera, sin Decimals"""
+    metadata = {}
+    for field in METADATA_FIELDS:
+        value = header.get(field)
+        if isinstance(value, Decimal):
+            value = int(value) if value == value.to_integral_value() else float(value)
+        if value is not None:
+            metadata[field] = value
+    return metadata
+
+
+def _reassemble(transfer_key, total):
+    chunks = {}
+    kwargs = {
+        'KeyConditionExpression': Key('transferKey').eq(transfer_key) & Key('seq').gte(0),
+        'ConsistentRead': True
+    }
+    while True:
+        response = transfers_table.query(**kwargs)
+        for item in response.get('Items', []):
+            data = item['data']
+            chunks[int(item['seq'])] = bytes(data.value if hasattr(data, 'value') else data)
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    if len(chunks) != total:
+        raise RuntimeError(f"{transfer_key}: {len(chunks)} de {total} partes en la tabla")
+    # Partes de tamaños distintos pueden pasar el control de handle_chunk
+    size = sum(len(chunk) for chunk in chunks.values())
+    if size > MAX_TRANSFER_BYTES:
+        raise ValueError(f"{transfer_key}: imagen de {size} bytes excede el máximo")
+    return b''.join(chunks[seq] for seq in range(total))
+
+
+def _claim_submit(transfer_key, s3_key):
+    """Escritura condicional: solo una invocación envía la transferencia"""
+    try:
+        transfers_table.update_item(
+            Key={'transferKey': transfer_key, 'seq': HEADER_SEQ},
+            UpdateExpression='SET submittedAt = :now, s3Key = :key',
+            ConditionExpression='attribute_not_exists(submittedAt)',
+            ExpressionAttributeValues={':now': int(time.time()), ':key': s3_key}
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+
+def _discard(transfer_key, total):
+    with transfers_table.batch_writer() as batch:
+        for seq in range(HEADER_SEQ, total):
+            batch.delete_item(Key={'transferKey': transfer_key, 'seq': seq})
+
+
+def _nack(device_id, transfer_id, transfer_key, missing, force=False):
+    """Pide reenviar partes; limitado a un NACK cada NACK_INTERVAL_SECONDS por transferencia"""
+    now = time.time()
+    if not force:
+        try:
+            transfers_table.update_item(
+                Key={'transferKey': transfer_key, 'seq': HEADER_SEQ},
+                UpdateExpression='SET nackedAt = :now, expiresAt = :expires',
+                ConditionExpression='attribute_not_exists(nackedAt) OR nackedAt < :limit',
+                ExpressionAttributeValues={
+                    ':now': int(now * 1000),
+                    ':limit': int((now - NACK_INTERVAL_SECONDS) * 1000),
+                    ':expires': int(now) + TRANSFER_TTL_SECONDS
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return
+            raise
+    count('nacks')
+    print(f"🔁 NACK {transfer_key}: faltan {len(missing)} partes")
+    _publish(device_id, {'command': 'resend', 'transferId': transfer_id, 'missing': missing[:MAX_NACK_SEQS]})
+
+
+def _publish(device_id, message):
+    try:
+        iot_data_client.publish(topic=f"orionseye/{device_id}/command", qos=1, payload=json.dumps(message))
+    except Exception as e:
+        print(f"⚠️ No se pudo publicar a {device_id}: {e}")
@@ -0,0 +1,153 @@
+import csv
+import os
+import numpy as np
+
+# Archivo de líneas incluido con la función: solo las líneas fuertes que el
+# espectrógrafo (FWHM ~2-3 nm, 8 bits) puede detectar y separar. Miles de
+# líneas débiles caerían varias en cada ventana de tolerancia y diluirían el
+# ranking sin agregar identificaciones. Un catálogo completo (ej. NIST ASD)
+# se carga igual con SPECTRAL_LINES_PATH; la búsqueda no depende del tamaño
+CATALOG_PATH = os.environ.get(
+    'SPECTRAL_LINES_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spectral_lines.csv')
+)
+
+DEFAULT_TOLERANCE_NM = 5.0
+MAX_CANDIDATES = 3
+
+# Catálogo cargado una sola vez por contenedor
+_catalog = None
+
+
+class LineCatalog:
+    """
+    Catálogo de líneas de referencia en arrays numpy ordenados por longitud de onda
+    Permite emparejar todos los picos detectados con un solo searchsorted
+    """
+
+    def __init__(self, wavelengths, strengths, elements, ions, labels):
+        order = np.argsort(wavelengths, kind='stable')
+        self.wavelengths = np.asarray(wavelengths, dtype=np.float64)[order]
+        self.strengths = np.asarray(strengths, dtype=np.float64)[order]
+        self.elements = np.asarray(elements, dtype=object)[order]
+        self.ions = np.asarray(ions, dtype=object)[order]
+        self.labels = np.asarray(labels, dtype=object)[order]
+
+        # Peso relativo normalizado para el ranking de candidatos
+        max_strength = self.strengths.max() if self.strengths.size else 1.0
+        self.weights = self.strengths / (max_strength or 1.0)
+
+    def __len__(self):
+        return self.wavelengths.size
+
+    @classmethod
+    def from_csv(cls, path):
+        """
+        Carga el catálogo desde CSV con columnas:
+        element, ion, wavelength_nm, relative_strength, label (opcional)
+        Las líneas que empiezan con # se ignoran
+        """
+        wavelengths, strengths, elements, ions, labels = [], [], [], [], []
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = csv.DictReader(line for line in f if not line.startswith('#'))
+            for row in rows:
+                element = row['element'].strip()
+                ion = row['ion'].strip()
+                wavelengths.append(float(row['wavelength_nm']))
+                strengths.append(float(row.get('relative_strength') or 1.0))
+                elements.append(element)
+                ions.append(ion)
+                labels.append((row.get('label') or '').strip() or f"{element} {ion}")
+        return cls(wavelengths, strengths, elements, ions, labels)
+
+    def match(self, wavelengths, tolerance=DEFAULT_TOLERANCE_NM, max_candidates=MAX_CANDIDATES):
+        """
+        Empareja todas las longitudes de onda contra el catálogo en una pasada
+
+        Retorna arrays (k, max_candidates) ordenados de mejor a peor:
+          indices  índice en el catálogo (-1 si no hay candidato)
+          deltas   diferencia observada - referencia (nm)
+          scores   peso de la línea * gaussiana de la distancia (sigma = tolerance/2)
+        """
+        observed = np.atleast_1d(np.asarray(wavelengths, dtype=np.float64))
+        k = observed.size
+
+        lo = np.searchsorted(self.wavelengths, observed - tolerance, side='left')
+        hi = np.searchsorted(self.wavelengths, observed + tolerance, side='right')
+        width = int((hi - lo).max()) if k else 0
+
+        if width == 0:
+            empty = np.full((k, max_candidates), -1, dtype=np.intp)
+            return empty, np.zeros((k, max_candidates)), np.zeros((k, max_candidates))
+
+        # Ventana de candidatos por pico: matriz k x width
+        idx = lo[:, None] + np.arange(width)
+        valid = idx < hi[:, None]
+        idx = np.where(valid, idx, 0)
+
+        deltas = observed[:, None] - self.wavelengths[idx]
+        scores = self.weights[idx] * np.exp(-0.5 * (deltas / (tolerance / 2.0)) ** 2)
+        scores = np.where(valid, scores, -np.inf)
+
+        # Mejores candidatos por fila (selección parcial si la ventana es ancha)
+        if width > max_candidates:
+            order = np.argpartition(-scores, max_candidates - 1, axis=1)[:, :max_candidates]
+            top = np.take_along_axis(scores, order, axis=1)
+            order = np.take_along_axis(order, np.argsort(-top, axis=1, kind='stable'), axis=1)
+        else:
+            order = np.argsort(-scores, axis=1, kind='stable')
+        rows = np.arange(k)[:, None]
+        best_idx = idx[rows, order]
+        best_scores = scores[rows, order]
+        best_deltas = deltas[rows, order]
+
+        missing = ~np.isfinite(best_scores)
+        best_idx[missing] = -1
+        best_scores[missing] = 0.0
+        best_deltas[missing] = 0.0
+
+        # Completar columnas si la ventana es menor que max_candidates
+        if best_idx.shape[1] < max_candidates:
+            pad = max_candidates - best_idx.shape[1]
+            best_idx = np.pad(best_idx, ((0, 0), (0, pad)), constant_values=-1)
+            best_scores = np.pad(best_scores, ((0, 0), (0, pad)))
+            best_deltas = np.pad(best_deltas, ((0, 0), (0, pad)))
+
+        return best_idx, best_deltas, best_scores
+
+    def identify(self, wavelengths, tolerance=DEFAULT_TOLERANCE_NM, max_candidates=MAX_CANDIDATES):
+        """
+        Identifica cada longitud de onda y retorna por pico:
+        {'element': etiqueta del mejor candidato o 'Unknown', 'candidates': [...]}
+        """
+        indices, deltas, scores = self.match(wavelengths, tolerance, max_candidates)
+        total = scores.sum(axis=1, keepdims=True)
+        confidence = np.divide(scores, total, out=np.zeros_like(scores), where=total > 0)
+
+        results = []
+        for row_idx, row_delta, row_conf in zip(indices.tolist(), deltas.tolist(), confidence.tolist()):
+            candidates = [
+                {
+                    'element': self.elements[i],
+                    'ion': self.ions[i],
+                    'label': self.labels[i],
+                    'wavelength': round(float(self.wavelengths[i]), 3),
+                    'delta': round(delta, 3),
+                    'confidence': round(conf, 3)
+                }
+                for i, delta, conf in zip(row_idx, row_delta, row_conf) if i >= 0
+            ]
+            results.append({
+                'element': candidates[0]['label'] if candidates else 'Unknown',
+                'candidates': candidates
+            })
+        return results
+
+
+def get_catalog():
+    """Catálogo por defecto, cargado una vez y reutilizado en contenedores calientes"""
+    global _catalog
+    if _catalog is None:
+        _catalog = LineCatalog.from_csv(CATALOG_PATH)
+        print(f"Catálogo de líneas cargado: {len(_catalog)} líneas")
+    return _catalog
@@ -0,0 +1,47 @@
+import os
+import time
+import boto3
+from datetime import datetime
+from boto3.dynamodb.conditions import Key
+from instrumentation import instrumented, count
+from device_writes import DeviceWriter
+from presence import PRESENCE_TABLE, PRESENCE_INDEX, PRESENCE_TIMEOUT_SECONDS, shard_keys, expire
+
+dynamodb = boto3.resource('dynamodb')
+presence_table = dynamodb.Table(PRESENCE_TABLE)
+devices_table = dynamodb.Table(os.environ['DEVICES_TABLE'])
+
+@instrumented
+def lambda_handler(event, context):
+    """
+    Barrido periódico (EventBridge, cada minuto)
+    Marca fuera de línea a los dispositivos sin heartbeat en
+    PRESENCE_TIMEOUT_SECONDS. Solo lee el índice disperso de presencia
+    (dispositivos marcados en línea), no toda la flota
+    """
+    cutoff = int(time.time()) - PRESENCE_TIMEOUT_SECONDS
+    writer = DeviceWriter(devices_table)
+    expired = 0
+    
+    for shard in shard_keys():
+        query = {
+            'IndexName': PRESENCE_INDEX,
+            'KeyConditionExpression': Key('presence').eq(shard) & Key('lastSeen').lt(cutoff),
+        }
+        while True:
+            response = presence_table.query(**query)
+            for item in response.get('Items', []):
+                device_id = item['deviceId']
+                if not expire(presence_table, device_id, cutoff):
+                    continue
+                last_seen = datetime.utcfromtimestamp(int(item['lastSeen'])).isoformat()
+                writer.update(device_id, {'isOnline': False, 'lastSeen': last_seen})
+                expired += 1
+            if 'LastEvaluatedKey' not in response:
+                break
+            query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    
+    writer.flush()
+    count('devicesExpired', expired)
+    print(f"Dispositivos fuera de línea: {expired}")
+    return {'expired': expired}
@@ -1,45 +1,210 @@
 import json
+import math
 import os
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from datetime import datetime, timezone
 import uuid
+from instrumentation import instrumented, stage, count
+from s3_uploads import upload_key, parse_upload_key
 
-s3 = boto3.client("s3")
+# Cliente del contenedor: firmar una URL es solo CPU (~0.5 ms); crear el
+# cliente cuesta cientos de ms, así que se crea una vez y firma todas
+s3 = boto3.client("s3", config=Config(signature_version="s3v4"))
 BUCKET = os.environ["S3_BUCKET"]
+# Cliente de bajo nivel: solo se lee el dueño del dispositivo
+dynamodb_client = boto3.client("dynamodb")
+DEVICES_TABLE = os.environ["DEVICES_TABLE"]
 
+EXPIRES_IN = 300  # 5 min
+# Las partes de una subida grande pueden tardar más en subirse todas
+MULTIPART_EXPIRES_IN = 3600
+
+# URLs por llamada en un burst
+MAX_BURST_URLS = 50
+
+# Límites de S3 para subidas multiparte
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+MAX_PARTS = 10000
+
+@instrumented
 def lambda_handler(event, context):
+    """
+    POST /observations/presign
+      {"deviceId": ...}                 una URL PUT
+      {"deviceId": ..., "count": N}     N URLs de un burst; las claves comparten burstId
+      {"deviceId": ..., "multipart": true, "size": bytes[, "partSize": bytes]}
+                                        inicia una subida multiparte: una URL por parte
+      {"action": "complete", "s3Key": ..., "uploadId": ..., "parts": [{"partNumber": 1, "eTag": ...}]}
+      {"action": "abort", "s3Key": ..., "uploadId": ...}
+    Al crearse el objeto, la notificación de S3 procesa la imagen (ver s3_uploads)
+    """
     # usuario desde Cognito
     user_id = event["requestContext"]["authorizer"]["claims"]["sub"]
 
     body = json.loads(event.get("body") or "{}")
-    device_id = body.get("deviceId", "unknown-device")
+    action = body.get("action", "presign")
+    if action == "complete":
+        return complete_multipart(user_id, body)
+    if action == "abort":
+        return abort_multipart(user_id, body)
+    if action != "presign":
+        return _resp(400, {"error": f"action desconocida: {action}"})
+
+    device_id = body.get("deviceId")
     content_type = body.get("contentType", "image/jpeg")
+    if not isinstance(device_id, str) or not device_id or "/" in device_id:
+        return _resp(400, {"error": "deviceId es requerido y no puede contener '/'"})
+
+    # Solo el dueño del dispositivo puede subir observaciones a su nombre
+    with stage("dynamodbGet"):
+        device = dynamodb_client.get_item(
+            TableName=DEVICES_TABLE,
+            Key={"deviceId": {"S": device_id}},
+            ProjectionExpression="userId"
+        ).get("Item")
+    if not device:
+        return _resp(404, {"error": "Dispositivo no encontrado"})
+    if device.get("userId", {}).get("S") != user_id:
+        return _resp(403, {"error": "No autorizado"})
+
+    if body.get("multipart"):
+        return start_multipart(user_id, device_id, content_type, body)
+
+    try:
+        n = int(body.get("count", 1))
+    except (TypeError, ValueError):
+        n = 0
+    if not 1 <= n <= MAX_BURST_URLS:
+        return _resp(400, {"error": f"count debe estar entre 1 y {MAX_BURST_URLS}"})
+
+    # keys únicos; un burst comparte burstId y hora en la clave
+    now = datetime.now(timezone.utc)
+    burst_id = str(uuid.uuid4()) if "count" in body else None
+    uploads = []
+    with stage("presign"):
+        for _ in range(n):
+            obs_id = str(uuid.uuid4())
+            key = upload_key(user_id, device_id, obs_id, now, burst_id)
+            uploads.append({
+                "uploadUrl": _presign("put_object", {"Key": key, "ContentType": content_type}, EXPIRES_IN),
+                "s3Key": key,
+                "observationId": obs_id,
+            })
+    count("urlsSigned", n)
+
+    if burst_id is None:
+        return _resp(200, dict(uploads[0], bucket=BUCKET, expiresIn=EXPIRES_IN))
+    return _resp(200, {
+        "burstId": burst_id,
+        "uploads": uploads,
+        "bucket": BUCKET,
+        "expiresIn": EXPIRES_IN,
+    })
+
+def start_multipart(user_id, device_id, content_type, body):
+    """Inicia la subida multiparte y firma una URL por parte para subirlas en paralelo"""
+    try:
+        size = int(body["size"])
+        part_size = max(MIN_PART_SIZE, int(body.get("partSize", DEFAULT_PART_SIZE)))
+    except (KeyError, TypeError, ValueError):
+        return _resp(400, {"error": "size (bytes) es requerido para una subida multiparte"})
+    parts = max(1, math.ceil(size / part_size))
+    if size <= 0 or parts > MAX_PARTS:
+        return _resp(400, {"error": f"size inválido: máximo {MAX_PARTS} partes de {part_size} bytes"})
 
-    # key único
-    ts = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
     obs_id = str(uuid.uuid4())
-    key = f"observations/{user_id}/{device_id}/{ts}_{obs_id}.jpg"
-
-    upload_url = s3.generate_presigned_url(
-        ClientMethod="put_object",
-        Params={
-            "Bucket": BUCKET,
-            "Key": key,
-            "ContentType": content_type,
-        },
-        ExpiresIn=300,  # 5 min
+    key = upload_key(user_id, device_id, obs_id, datetime.now(timezone.utc))
+    with stage("createMultipartUpload"):
+        upload_id = s3.create_multipart_upload(Bucket=BUCKET, Key=key, ContentType=content_type)["UploadId"]
+
+    with stage("presign"):
+        urls = [
+            {
+                "partNumber": number,
+                "uploadUrl": _presign("upload_part", {"Key": key, "UploadId": upload_id, "PartNumber": number},
+                                      MULTIPART_EXPIRES_IN),
+            }
+            for number in range(1, parts + 1)
+        ]
+    count("urlsSigned", parts)
+
+    return _resp(200, {
+        "uploadId": upload_id,
+        "s3Key": key,
+        "observationId": obs_id,
+        "partSize": part_size,
+        "parts": urls,
+        "bucket": BUCKET,
+        "expiresIn": MULTIPART_EXPIRES_IN,
+    })
+
+def complete_multipart(user_id, body):
+    """Une las partes (con los ETag que devolvió cada PUT); el objeto creado dispara el procesamiento"""
+    fields = _own_upload(user_id, body)
+    if fields is None:
+        return _resp(403, {"error": "s3Key no pertenece al usuario"})
+    try:
+        parts = sorted(
+            ({"PartNumber": int(part["partNumber"]), "ETag": part["eTag"]} for part in body["parts"]),
+            key=lambda part: part["PartNumber"],
+        )
+        upload_id = body["uploadId"]
+    except (KeyError, TypeError, ValueError):
+        return _resp(400, {"error": "uploadId y parts [{partNumber, eTag}] son requeridos"})
+
+    try:
+        with stage("completeMultipartUpload"):
+            response = s3.complete_multipart_upload(
+                Bucket=BUCKET,
+                Key=body["s3Key"],
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+    except ClientError as e:
+        # InvalidPart, InvalidPartOrder, NoSuchUpload (ya completada o abortada)...
+        return _resp(400, {"error": e.response["Error"]["Code"]})
+
+    return _resp(200, {
+        "s3Key": body["s3Key"],
+        "observationId": fields["observationId"],
+        "eTag": response.get("ETag"),
+    })
+
+def abort_multipart(user_id, body):
+    fields = _own_upload(user_id, body)
+    if fields is None:
+        return _resp(403, {"error": "s3Key no pertenece al usuario"})
+    try:
+        s3.abort_multipart_upload(Bucket=BUCKET, Key=body["s3Key"], UploadId=body["uploadId"])
+    except KeyError:
+        return _resp(400, {"error": "uploadId es requerido"})
+    except ClientError as e:
+        return _resp(400, {"error": e.response["Error"]["Code"]})
+    return _resp(200, {"s3Key": body["s3Key"], "aborted": True})
+
+def _own_upload(user_id, body):
+    """Campos de la clave si es una subida del usuario, si no None"""
+    fields = parse_upload_key(str(body.get("s3Key", "")))
+    if fields is None or fields["userId"] != user_id:
+        return None
+    return fields
+
+def _presign(operation, params, expires_in):
+    return s3.generate_presigned_url(
+        ClientMethod=operation,
+        Params=dict(params, Bucket=BUCKET),
+        ExpiresIn=expires_in,
     )
 
+def _resp(status, payload):
     return {
-        "statusCode": 200,
+        "statusCode": status,
         "headers": {
             "Content-Type": "application/json",
             "Access-Control-Allow-Origin": "*",
         },
-        "body": json.dumps({
-            "uploadUrl": upload_url,
-            "s3Key": key,
-            "bucket": BUCKET,
-            "expiresIn": 300,
-        })
-    }
\ No newline at end of file
+        "body": json.dumps(payload)
+    }
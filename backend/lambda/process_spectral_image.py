@@ -2,26 +2,91 @@ import json
 import boto3
 import base64
 import os
+import uuid
 from datetime import datetime
 from decimal import Decimal
 import numpy as np
-from PIL import Image
-import io
+import time
+import tracemalloc
+from spectral_decode import open_image, decode_image, column_profile
+from spectral_roi import get_band
+from spectral_peaks import find_peaks
+from line_catalog import get_catalog, DEFAULT_TOLERANCE_NM
+from wavelength_calibration import get_wavelengths, get_calibration
+from spectral_codec import pack_spectral_data, unpack_spectral_data
+from spectral_lod import build_levels
+from spectral_stack import ProfileStack
+from detector_calibration import get_masters, corrected_profile
+from result_cache import content_hash, cache_key, get_result, put_result, store_image, store_spectrum
+from instrumentation import instrumented, stage, record_size, set_property
+from dynamodb_json import serialize_item, serialized_size
+from claim_check import read_image
+from sqs_batch import is_batch, consume, batch_write
+from s3_uploads import is_upload_notification, upload_events
+from device_writes import DeviceWriter
 
 s3_client = boto3.client('s3')
 dynamodb = boto3.resource('dynamodb')
-observations_table = dynamodb.Table(os.environ['OBSERVATIONS_TABLE'])
+OBSERVATIONS_TABLE = os.environ['OBSERVATIONS_TABLE']
+observations_table = dynamodb.Table(OBSERVATIONS_TABLE)
+# Cliente de bajo nivel del mismo recurso: el item va ya serializado
+dynamodb_client = dynamodb.meta.client
 devices_table = dynamodb.Table(os.environ['DEVICES_TABLE'])
 
 S3_BUCKET = os.environ['S3_BUCKET']
 
+# Tolerancia (nm) para emparejar picos con el catálogo de líneas sin
+# calibración; con calibración se reduce a LINE_TOLERANCE_SIGMAS * rms del
+# ajuste (no menos de LINE_TOLERANCE_MIN_NM), así la ventana no junta varias
+# líneas del catálogo cuando la escala de longitudes de onda es conocida
+LINE_TOLERANCE_NM = float(os.environ.get('LINE_TOLERANCE_NM', DEFAULT_TOLERANCE_NM))
+LINE_TOLERANCE_SIGMAS = 3.0
+LINE_TOLERANCE_MIN_NM = 1.0
+
+# FWHM mínimo de una línea relativo a la mediana del frame: los picos más
+# angostos son pixeles calientes o rayos cósmicos que sobrevivieron a la
+# reducción del frame
+MIN_LINE_WIDTH_RATIO = float(os.environ.get('MIN_LINE_WIDTH_RATIO', '0.4'))
+
+# Versión del análisis espectral: incrementar cuando cambie el resultado
+# para el mismo frame (invalida la caché de resultados)
+ALGORITHM_VERSION = 2
+
+@instrumented
 def lambda_handler(event, context):
     """
     Procesa imágenes espectrales del ESP32
-    1. Recibe imagen en base64 o desde S3
-    2. Analiza el espectro
-    3. Guarda metadata en DynamoDB
-    4. Retorna datos procesados
+    - Invocación con una imagen: ver process_image
+    - Lote de SQS (cola de imágenes): procesa los registros en paralelo,
+      escribe las observaciones con BatchWriteItem y retorna los fallos
+      parciales para que solo esos mensajes se reintenten (ver sqs_batch).
+      Un mensaje puede ser una notificación de S3 de una subida prefirmada
+    - Notificación de S3 directa: procesa los objetos subidos (ver s3_uploads)
+    """
+    if is_batch(event):
+        return consume(event['Records'], _process_record, _commit_observations)
+    if is_upload_notification(event):
+        response = {'statusCode': 200, 'body': json.dumps({'success': True})}
+        for upload in upload_events(event):
+            response = process_image(upload, save_observation)
+            if response['statusCode'] != 200:
+                # La invocación asíncrona de S3 se reintenta
+                raise RuntimeError(json.loads(response['body']).get('error'))
+        return response
+    return process_image(event, save_observation)
+
+
+def process_image(event, save):
+    """
+    1. Recibe imagen por referencia S3 verificada (imageRef), en base64 o desde
+       S3 (o un burst de claves S3 a apilar)
+    2. Si el mismo contenido ya se analizó (hash SHA-256 + versiones de
+       calibración y algoritmo) reutiliza el resultado; un reenvío del mismo
+       dispositivo no crea otra observación
+    3. Analiza el espectro
+    4. Guarda la observación: save(item, deviceId, observationId, timestamp)
+       recibe el item ya serializado (AttributeValue)
+    5. Retorna datos procesados
     """
     try:
         print("📸 Procesando imagen espectral...")
@@ -30,54 +95,115 @@ def lambda_handler(event, context):
         device_id = event.get('deviceId')
         user_id = event.get('userId')
         
-        # Imagen puede venir en base64 o referencia S3
+        # Imagen puede venir como referencia claim check (imageRef), en base64,
+        # clave S3 o un burst de claves S3
+        image_ref = event.get('imageRef')
         image_data = event.get('imageData')
         image_s3_key = event.get('imageS3Key')
+        image_s3_keys = event.get('imageS3Keys')
+        # Ajuste de exposición del sensor: elige los maestros dark/flat
+        exposure = event.get('exposure')
         
         if not device_id:
             raise ValueError("deviceId es requerido")
+        set_property('deviceId', device_id)
         
-        # 1. Obtener la imagen
-        if image_s3_key:
-            # Descargar desde S3
-            response = s3_client.get_object(Bucket=S3_BUCKET, Key=image_s3_key)
-            image_bytes = response['Body'].read()
-        elif image_data:
-            # Decodificar base64
-            image_bytes = base64.b64decode(image_data)
-        else:
-            raise ValueError("Se requiere imageData o imageS3Key")
-        
-        # 2. Procesar la imagen
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        print(f"📏 Imagen: {image.size[0]}x{image.size[1]}, mode: {image.mode}")
+        # Subidas prefirmadas: el id viene de la clave S3, así una notificación
+        # repetida encuentra la observación y no vuelve a procesar
+        requested_id = event.get('observationId')
+        if requested_id and _observation_exists(requested_id):
+            print(f"♻️ Observación ya creada: {requested_id}")
+            set_property('duplicate', True)
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'success': True, 'duplicate': True, 'observationId': requested_id})
+            }
         
-        # 3. Analizar espectro
-        spectral_data = analyze_spectrum(image)
+        digest = key = cached = None
+        stored_data = None
+        if image_s3_keys:
+            # Modo apilado: todos los frames del burst dan una sola observación
+            with stage('analysis'):
+                spectral_data = analyze_burst(image_s3_keys, device_id, event.get('stackMethod', 'sigma_clip'), exposure)
+            image_s3_key = image_s3_keys[spectral_data['stack']['reference']]
+        else:
+            # 1. Obtener la imagen
+            if image_ref:
+                # Claim check del IoT handler: bytes crudos, el SHA-256 se calcula al recibirlos
+                with stage('s3Get'):
+                    image_bytes, digest = read_image(s3_client, S3_BUCKET, image_ref)
+                image_s3_key = image_ref['s3Key']
+            elif image_s3_key:
+                # Descargar desde S3
+                with stage('s3Get'):
+                    response = s3_client.get_object(Bucket=S3_BUCKET, Key=image_s3_key)
+                    image_bytes = response['Body'].read()
+            elif isinstance(image_data, (bytes, bytearray)):
+                # Bytes sin base64 (llamadas directas con el mensaje MessagePack ya decodificado)
+                image_bytes = bytes(image_data)
+            elif image_data:
+                # Decodificar base64
+                with stage('base64Decode'):
+                    image_bytes = base64.b64decode(image_data)
+            else:
+                raise ValueError("Se requiere imageRef, imageData, imageS3Key o imageS3Keys")
+            record_size('image', len(image_bytes))
+            
+            # 2. Resultado ya calculado para este contenido
+            with stage('cacheLookup'):
+                digest = digest or content_hash(image_bytes)
+                key = cache_key(digest, calibration_version(device_id, exposure), ALGORITHM_VERSION)
+                cached = get_result(key)
+                # Con observationId pedido (subidas prefirmadas) solo se reutiliza
+                # el análisis: la observación siempre se escribe con ese id
+                is_duplicate = (cached and not requested_id and cached['deviceId'] == device_id
+                                and _observation_exists(cached['observationId']))
+            if is_duplicate:
+                print(f"♻️ Contenido ya procesado: {cached['observationId']}")
+                set_property('duplicate', True)
+                return _duplicate_response(cached)
+            
+            # 3. Abrir la imagen (solo cabecera; valida tamaño antes de decodificar)
+            image = open_image(image_bytes)
+            image_format = image.format
+            
+            if cached:
+                # Mismo contenido y calibración (otro dispositivo o una escritura
+                # interrumpida): no hace falta volver a analizar
+                print(f"♻️ Reutilizando análisis de {cached['observationId']}")
+                stored_data = cached['spectralData']
+                spectral_data = load_spectral_data(stored_data)
+                image_s3_key = image_s3_key or cached.get('imageS3Key')
+            else:
+                print(f"📏 Imagen: {image.size[0]}x{image.size[1]}, mode: {image.mode}")
+                
+                # 4. Analizar espectro
+                with stage('analysis'):
+                    spectral_data = analyze_spectrum(image, device_id, exposure)
         
-        # 4. Guardar imagen en S3 si no estaba
+        # 5. Guardar imagen en S3 si no estaba (por contenido: los duplicados comparten objeto)
         if not image_s3_key:
-            timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-            image_s3_key = f"observations/{device_id}/{timestamp}_spectrum.jpg"
-            
-            s3_client.put_object(
-                Bucket=S3_BUCKET,
-                Key=image_s3_key,
-                Body=image_bytes,
-                ContentType='image/jpeg',
-                Metadata={
-                    'deviceId': device_id,
-                    'timestamp': timestamp,
-                    'type': 'spectral_image'
-                }
-            )
-            print(f"✅ Imagen guardada en S3: {image_s3_key}")
-        
-        # 5. Crear observación en DynamoDB
-        observation_id = f"obs_{device_id}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+            with stage('s3Put'):
+                image_s3_key = store_image(
+                    s3_client, S3_BUCKET, digest, image_bytes, image_format,
+                    metadata={'deviceId': device_id, 'type': 'spectral_image'}
+                )
+        
+        # 6. Crear observación en DynamoDB
+        observation_id = requested_id or new_observation_id(device_id)
         timestamp = datetime.utcnow().isoformat()
         
+        # Arrays espectrales como blobs binarios (o .npy en S3 si son grandes)
+        if stored_data is None:
+            with stage('pack'):
+                stored_data, spectrum_npy = pack_spectral_data(spectral_data)
+            if spectrum_npy:
+                # Por contenido: el resultado cacheado puede reutilizarlo otra observación
+                with stage('s3Put'):
+                    spectrum_s3_key = store_spectrum(s3_client, S3_BUCKET, spectrum_npy)
+                stored_data['spectrumS3Key'] = spectrum_s3_key
+                print(f"✅ Espectro guardado en S3: {spectrum_s3_key}")
+        
         observation = {
             'observationId': observation_id,
             'deviceId': device_id,
@@ -85,23 +211,49 @@ def lambda_handler(event, context):
             'timestamp': timestamp,
             'imageUrl': f"https://{S3_BUCKET}.s3.amazonaws.com/{image_s3_key}",
             'imageS3Key': image_s3_key,
-            'spectralData': spectral_data,
+            'spectralData': stored_data,
+            'algorithmVersion': ALGORITHM_VERSION,
             'status': 'processed',
             'createdAt': timestamp
         }
+        if image_s3_keys:
+            observation['burstS3Keys'] = image_s3_keys
+        if digest:
+            observation['contentHash'] = digest
+        if exposure is not None:
+            # Permite reprocesar con los mismos maestros dark/flat
+            observation['exposure'] = exposure
+        if event.get('burstId'):
+            # Frames subidos juntos (presign_upload con count)
+            observation['burstId'] = event['burstId']
         
-        observations_table.put_item(Item=convert_floats_to_decimals(observation))
-        print(f"Observación guardada: {observation_id}")
+        # La escritura condicional del resultado decide entre reenvíos concurrentes
+        if key and not cached:
+            with stage('cachePut'):
+                claimed = put_result(key, convert_floats_to_decimals({
+                    'contentHash': digest,
+                    'deviceId': device_id,
+                    'observationId': observation_id,
+                    'imageS3Key': image_s3_key,
+                    'imageUrl': observation['imageUrl'],
+                    'spectralData': stored_data,
+                    'algorithmVersion': ALGORITHM_VERSION,
+                    'createdAt': timestamp
+                }))
+            if not claimed:
+                winner = get_result(key)
+                if winner and winner['deviceId'] == device_id and not requested_id:
+                    print(f"♻️ Otra invocación procesó el mismo contenido: {winner['observationId']}")
+                    return _duplicate_response(winner)
+        elif cached and cached['deviceId'] == device_id and not requested_id:
+            # La invocación anterior registró el resultado pero no la observación
+            observation_id = observation['observationId'] = cached['observationId']
         
-        # 6. Actualizar dispositivo
-        devices_table.update_item(
-            Key={'deviceId': device_id},
-            UpdateExpression='SET lastUpdate = :timestamp, lastObservation = :obsId',
-            ExpressionAttributeValues={
-                ':timestamp': timestamp,
-                ':obsId': observation_id
-            }
-        )
+        with stage('serialize'):
+            item = serialize_item(observation)
+        record_size('item', serialized_size(item))
+        # 7. Guardar y actualizar dispositivo (en un lote, al confirmar el lote)
+        save(item, device_id, observation_id, timestamp)
         
         return {
             'statusCode': 200,
@@ -110,7 +262,7 @@ def lambda_handler(event, context):
                 'observationId': observation_id,
                 'imageUrl': observation['imageUrl'],
                 'spectralData': spectral_data
-            })
+            }, default=decimal_default)
         }
         
     except Exception as e:
@@ -124,58 +276,136 @@ def lambda_handler(event, context):
         }
 
 
-def analyze_spectrum(image):
+def save_observation(item, device_id, observation_id, timestamp):
+    """Escribe la observación y actualiza el dispositivo (invocación individual)"""
+    with stage('dynamodbPut'):
+        dynamodb_client.put_item(TableName=OBSERVATIONS_TABLE, Item=item)
+    print(f"Observación guardada: {observation_id}")
+    update_device(device_id, observation_id, timestamp)
+
+
+def update_device(device_id, observation_id, timestamp, writer=None):
+    """Última observación del dispositivo; con writer queda pendiente hasta su flush()"""
+    pending = writer or DeviceWriter(devices_table)
+    pending.update(device_id, {'lastUpdate': timestamp, 'lastObservation': observation_id})
+    if writer is None:
+        pending.flush()
+
+
+def _process_record(payload):
+    """Un mensaje del lote: procesa y deja la escritura pendiente para el commit"""
+    writes = []
+    events = upload_events(payload) if is_upload_notification(payload) else [payload]
+    for event in events:
+        response = process_image(event, lambda *write: writes.append(write))
+        if response['statusCode'] != 200:
+            raise ValueError(json.loads(response['body']).get('error'))
+    return writes
+
+
+def new_observation_id(device_id):
+    """
+    Id de una observación sin observationId pedido: fecha (ordena por
+    tiempo) y un sufijo aleatorio, porque un lote puede traer varias
+    imágenes del mismo dispositivo en el mismo segundo
+    """
+    return f"obs_{device_id}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:12]}"
+
+
+def _commit_observations(pending):
+    """
+    Escribe las observaciones del lote con BatchWriteItem y actualiza cada
+    dispositivo una vez, con su observación más reciente
+    Retorna los messageIds cuyas observaciones no se pudieron escribir
+    """
+    # observationId -> messageIds que la escriben (una notificación repetida
+    # en el mismo lote trae el mismo id: se escribe una vez y falla para todos)
+    owners = {}
+    items = []
+    for message_id, writes in pending:
+        for item, _, observation_id, _ in writes:
+            if observation_id not in owners:
+                items.append(item)
+            owners.setdefault(observation_id, set()).add(message_id)
+    unwritten = batch_write(dynamodb_client, OBSERVATIONS_TABLE, items, 'observationId')
+    failed = {message_id for item in unwritten for message_id in owners[item['observationId']['S']]}
+    print(f"Observaciones guardadas: {len(items) - len(unwritten)} de {len(items)}")
+    
+    # Una escritura por dispositivo, con su observación más reciente
+    writer = DeviceWriter(devices_table)
+    committed = sorted(
+        (timestamp, device_id, observation_id)
+        for message_id, writes in pending if message_id not in failed
+        for _, device_id, observation_id, timestamp in writes
+    )
+    for timestamp, device_id, observation_id in committed:
+        update_device(device_id, observation_id, timestamp, writer)
+    try:
+        writer.flush()
+    except Exception as e:
+        # Las observaciones ya están escritas: sus mensajes no deben volver a la cola
+        print(f"No se pudo actualizar dispositivo: {e}")
+    return sorted(failed)
+
+
+def calibration_version(device_id, exposure=None):
+    """
+    Versión de todo lo que calibra el análisis del dispositivo: modelo de
+    longitud de onda y maestros dark/flat de la exposición (ETags)
+    Ambos están cacheados en el contenedor; no agrega lecturas por frame
+    """
+    model = get_calibration(device_id)
+    _, _, masters = get_masters(device_id, exposure)
+    return '.'.join([
+        str(model['version'] if model else 0),
+        (masters.get('darkVersion') or '-')[:12],
+        (masters.get('flatVersion') or '-')[:12]
+    ])
+
+
+def _observation_exists(observation_id):
+    resp = observations_table.get_item(
+        Key={'observationId': observation_id},
+        ProjectionExpression='observationId'
+    )
+    return 'Item' in resp
+
+
+def _duplicate_response(cached):
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'success': True,
+            'duplicate': True,
+            'observationId': cached['observationId'],
+            'imageUrl': cached.get('imageUrl'),
+            'spectralData': load_spectral_data(cached['spectralData'])
+        }, default=decimal_default)
+    }
+
+
+def load_spectral_data(stored_data):
+    """spectralData guardado a listas; si los arrays están en S3 descarga el .npy"""
+    npy_bytes = None
+    if stored_data.get('spectrumS3Key'):
+        with stage('s3Get'):
+            response = s3_client.get_object(Bucket=S3_BUCKET, Key=stored_data['spectrumS3Key'])
+            npy_bytes = response['Body'].read()
+    return unpack_spectral_data(stored_data, npy_bytes)
+
+
+def analyze_spectrum(image, device_id=None, exposure=None):
     """
     Analiza la imagen espectral y extrae datos
+    Si se indica device_id, la banda del espectro detectada se cachea por dispositivo
+    y se aplican sus maestros dark/flat de la exposición indicada
     """
     try:
-        # Convertir a array numpy
-        img_array = np.array(image)
-        
-        # Si es RGB, convertir a escala de grises
-        if len(img_array.shape) == 3:
-            img_gray = np.mean(img_array, axis=2)
-        else:
-            img_gray = img_array
-        
-        # Extraer perfil horizontal (promedio vertical)
-        spectrum_profile = np.mean(img_gray, axis=0)
-        
-        # Normalizar entre 0-100
-        spectrum_normalized = ((spectrum_profile - spectrum_profile.min()) / 
-                               (spectrum_profile.max() - spectrum_profile.min()) * 100)
-        
-        # Detectar picos
-        peaks = detect_peaks(spectrum_normalized)
-        
-        # Calcular longitudes de onda aproximadas (calibración necesaria)
-        # Asumiendo espectro visible 400-700nm
-        wavelengths = np.linspace(400, 700, len(spectrum_normalized))
-        
-        # Identificar líneas espectrales prominentes
-        spectral_lines = []
-        for peak_idx in peaks:
-            wavelength = float(wavelengths[peak_idx])
-            intensity = float(spectrum_normalized[peak_idx])
-            
-            # Identificar elemento (simplificado)
-            element = identify_element(wavelength)
-            
-            spectral_lines.append({
-                'wavelength': round(wavelength, 2),
-                'intensity': round(intensity, 2),
-                'element': element
-            })
-        
-        return {
-            'spectralProfile': spectrum_normalized.tolist(),
-            'wavelengths': wavelengths.tolist(),
-            'spectralLines': spectral_lines,
-            'peakCount': len(peaks),
-            'averageIntensity': float(np.mean(spectrum_normalized)),
-            'maxIntensity': float(np.max(spectrum_normalized)),
-            'imageSize': list(image.size)
-        }
+        spectrum_profile, frame_info = extract_spectrum(image, device_id, exposure)
+        with stage('analyzeProfile'):
+            spectral_data = analyze_profile(spectrum_profile, device_id)
+        spectral_data.update(frame_info)
+        return spectral_data
         
     except Exception as e:
         print(f"Error en análisis: {e}")
@@ -186,40 +416,133 @@ def analyze_spectrum(image):
         }
 
 
-def detect_peaks(data, threshold=70):
+def analyze_burst(image_s3_keys, device_id=None, method='sigma_clip', exposure=None):
     """
-    Detecta picos en el perfil espectral
+    Apila un burst de frames (claves S3) y analiza el perfil combinado
+    Los frames se descargan y reducen de a uno; en memoria queda solo el actual
     """
-    peaks = []
-    for i in range(1, len(data) - 1):
-        if data[i] > threshold and data[i] > data[i-1] and data[i] > data[i+1]:
-            peaks.append(i)
-    return peaks
+    stack = ProfileStack()
+    frame_info = None
+    try:
+        for key in image_s3_keys:
+            with stage('s3Get'):
+                response = s3_client.get_object(Bucket=S3_BUCKET, Key=key)
+                image_bytes = response['Body'].read()
+            record_size('image', len(image_bytes))
+            image = open_image(image_bytes)
+            profile, info = extract_spectrum(image, device_id, exposure)
+            stack.add(profile)
+            frame_info = frame_info or info
+        
+        stacked, stack_info = stack.combine(method)
+    finally:
+        stack.close()
+    
+    print(f"🧮 Apilados {stack_info['kept']}/{stack_info['frames']} frames ({method})")
+    
+    with stage('analyzeProfile'):
+        spectral_data = analyze_profile(stacked, device_id)
+    spectral_data.update(frame_info)
+    spectral_data['stack'] = stack_info
+    return spectral_data
 
 
-def identify_element(wavelength):
+def extract_spectrum(image, device_id=None, exposure=None):
     """
-    Identifica posibles elementos basándose en longitud de onda
-    (Simplificado - necesita calibración real)
-    """
-    # Líneas espectrales conocidas (nm)
-    spectral_lines = {
-        'H-alpha': 656.3,    # Hidrógeno
-        'H-beta': 486.1,     # Hidrógeno
-        'He': 587.6,         # Helio
-        'Na-D': 589.0,       # Sodio
-        'O': 630.0,          # Oxígeno
-        'Fe': 532.8,         # Hierro
-        'Ca': 422.7,         # Calcio
-    }
+    Decodifica la imagen y extrae el perfil horizontal del espectro
+    Retorna (perfil float64, info del frame: imageSize, band, decode, detector)
+    """
+    # Decodificar con reducción JPEG y acumuladores enteros
+    start = time.perf_counter()
+    image_size = list(image.size)
+    with stage('decode'):
+        decoded, decode_info = decode_image(image)
+    
+    # Filas que contienen el espectro (fuera de ellas solo hay fondo y ruido)
+    with stage('band'):
+        band, band_info = get_band(decoded, device_id)
     
-    # Buscar coincidencia (tolerancia ±5nm)
-    tolerance = 5
-    for element, line_wavelength in spectral_lines.items():
-        if abs(wavelength - line_wavelength) < tolerance:
-            return element
+    # Maestros dark/flat del dispositivo (cacheados en el contenedor)
+    dark, gain, detector_info = get_masters(device_id, exposure, decoded.size)
     
-    return 'Unknown'
+    # Perfil horizontal: promedio vertical solo dentro de la banda
+    with stage('profile'):
+        if dark is None and gain is None:
+            spectrum_profile = column_profile(decoded, band)
+        else:
+            spectrum_profile = corrected_profile(decoded, dark, gain, band)
+    decode_info['decodeMs'] = round((time.perf_counter() - start) * 1000, 2)
+    if tracemalloc.is_tracing():
+        decode_info['tracedPeakBytes'] = tracemalloc.get_traced_memory()[1]
+    
+    return spectrum_profile, {'imageSize': image_size, 'band': band_info, 'decode': decode_info,
+                              'detector': detector_info}
+
+
+def analyze_profile(spectrum_profile, device_id=None):
+    """
+    Detecta e identifica las líneas de un perfil espectral (un frame o un apilado)
+    """
+    # Normalizar entre 0-100
+    spectrum_normalized = ((spectrum_profile - spectrum_profile.min()) / 
+                           (spectrum_profile.max() - spectrum_profile.min()) * 100)
+    
+    # Detectar picos (umbral adaptativo según el ruido del frame)
+    peaks = find_peaks(spectrum_normalized, min_width_ratio=MIN_LINE_WIDTH_RATIO)
+    
+    # Longitudes de onda según la calibración del dispositivo
+    # (sin calibración: espectro visible 400-700nm lineal)
+    wavelengths, calibration_info = get_wavelengths(device_id, len(spectrum_normalized))
+    
+    # Longitud de onda de cada pico en su posición sub-pixel
+    pixels = np.arange(len(wavelengths))
+    peak_wavelengths = np.interp(peaks['positions'], pixels, wavelengths)
+    # Dispersión local (nm/pixel) para convertir el FWHM
+    nm_per_pixel = np.abs(np.interp(peaks['positions'], pixels, np.gradient(wavelengths)))
+    
+    # Identificar todos los picos contra el catálogo en una sola pasada
+    identified = get_catalog().identify(peak_wavelengths, tolerance=line_tolerance(calibration_info))
+    
+    spectral_lines = []
+    for i, match in enumerate(identified):
+        spectral_lines.append({
+            'wavelength': round(float(peak_wavelengths[i]), 2),
+            'intensity': round(float(peaks['heights'][i]), 2),
+            'prominence': round(float(peaks['prominences'][i]), 2),
+            'fwhm': round(float(peaks['widths'][i] * nm_per_pixel[i]), 2),
+            'snr': round(float(peaks['snr'][i]), 1),
+            'element': match['element'],
+            'candidates': match['candidates']
+        })
+    
+    return {
+        'spectralProfile': spectrum_normalized.tolist(),
+        'wavelengths': wavelengths.tolist(),
+        # Perfiles reducidos (min/max por tramo) para gráficos
+        'profileLevels': build_levels(wavelengths, spectrum_normalized),
+        'spectralLines': spectral_lines,
+        'peakCount': len(spectral_lines),
+        'noiseLevel': round(peaks['noise'], 3),
+        'averageIntensity': float(np.mean(spectrum_normalized)),
+        'maxIntensity': float(np.max(spectrum_normalized)),
+        'calibration': calibration_info
+    }
+
+
+def line_tolerance(calibration_info):
+    """Tolerancia (nm) de identificación según la calibración del dispositivo"""
+    if not calibration_info.get('calibrated'):
+        return LINE_TOLERANCE_NM
+    rms = float(calibration_info.get('rmsNm') or LINE_TOLERANCE_NM)
+    return min(LINE_TOLERANCE_NM, max(LINE_TOLERANCE_SIGMAS * rms, LINE_TOLERANCE_MIN_NM))
+
+
+def identify_element(wavelength):
+    """
+    Identifica posibles elementos basándose en longitud de onda
+    (usa el catálogo de líneas; necesita calibración real)
+    """
+    return get_catalog().identify([wavelength], tolerance=LINE_TOLERANCE_NM)[0]['element']
 
 
 def convert_floats_to_decimals(obj):
@@ -233,4 +556,11 @@ def convert_floats_to_decimals(obj):
     elif isinstance(obj, float):
         return Decimal(str(obj))
     else:
-        return obj
\ No newline at end of file
+        return obj
+
+
+def decimal_default(obj):
+    """Serializa los Decimal leídos de DynamoDB"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError
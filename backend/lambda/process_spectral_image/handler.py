@@ -2,23 +2,48 @@ import json
 import boto3
 import base64
 import os
+import uuid
 from datetime import datetime
-from decimal import Decimal
 import io
+from instrumentation import instrumented, stage, record_size, set_property
+from dynamodb_json import serialize_item, serialized_size
+from sqs_batch import is_batch, consume, batch_write
+from s3_uploads import is_upload_notification, upload_events
+from device_writes import DeviceWriter
+from claim_check import put_image
 
 s3_client = boto3.client('s3')
 dynamodb = boto3.resource('dynamodb')
-observations_table = dynamodb.Table(os.environ['OBSERVATIONS_TABLE'])
+OBSERVATIONS_TABLE = os.environ['OBSERVATIONS_TABLE']
+# Cliente de bajo nivel del mismo recurso: el item va ya serializado
+dynamodb_client = dynamodb.meta.client
 devices_table = dynamodb.Table(os.environ['DEVICES_TABLE'])
 
 S3_BUCKET = os.environ['S3_BUCKET']
 
+@instrumented
 def lambda_handler(event, context):
     """
     Procesa imágenes espectrales del ESP32
-    Recibe: imagen en base64 o referencia S3
+    Recibe: referencia S3 (imageRef/imageS3Key) o imagen en base64, o un lote
+    de SQS con esas mismas cargas (fallos parciales, ver sqs_batch), o una
+    notificación de S3 de una subida prefirmada (ver s3_uploads)
     Output: Análisis guardado en DynamoDB
     """
+    if is_batch(event):
+        return consume(event['Records'], _process_record, _commit_observations)
+    if is_upload_notification(event):
+        response = {'statusCode': 200, 'body': json.dumps({'success': True})}
+        for upload in upload_events(event):
+            response = process_image(upload, save_observation)
+            if response['statusCode'] != 200:
+                raise RuntimeError(json.loads(response['body']).get('error'))
+        return response
+    return process_image(event, save_observation)
+
+
+def process_image(event, save):
+    """Procesa una imagen; save(item, deviceId, observationId, timestamp) la guarda"""
     try:
         print("📸 Procesando imagen espectral...")
         
@@ -26,44 +51,54 @@ def lambda_handler(event, context):
         device_id = event.get('deviceId')
         user_id = event.get('userId', 'unknown')
         
-        # Imagen puede venir en base64 o referencia S3
+        # Imagen puede venir como referencia claim check, en base64 o clave S3
         image_data = event.get('imageData')
-        image_s3_key = event.get('imageS3Key')
+        image_s3_key = (event.get('imageRef') or {}).get('s3Key') or event.get('imageS3Key')
         
         if not device_id:
             raise ValueError("deviceId es requerido")
+        set_property('deviceId', device_id)
+        
+        # Subidas prefirmadas: el id viene de la clave S3 (notificaciones repetidas)
+        requested_id = event.get('observationId')
+        if requested_id and 'Item' in dynamodb_client.get_item(
+                TableName=OBSERVATIONS_TABLE, Key={'observationId': {'S': requested_id}},
+                ProjectionExpression='observationId'):
+            print(f"Observación ya creada: {requested_id}")
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'success': True, 'duplicate': True, 'observationId': requested_id})
+            }
         
         # 1. Obtener la imagen
         if image_s3_key:
             # Ya está en S3
             print(f"Imagen ya en S3: {image_s3_key}")
         elif image_data:
-            # Decodificar base64 y subir a S3
-            image_bytes = base64.b64decode(image_data)
+            # Decodificar base64 (o bytes sin base64 de un mensaje MessagePack) y subir a S3
+            if isinstance(image_data, (bytes, bytearray)):
+                image_bytes = bytes(image_data)
+            else:
+                with stage('base64Decode'):
+                    image_bytes = base64.b64decode(image_data)
+            record_size('image', len(image_bytes))
             
-            timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-            image_s3_key = f"observations/{device_id}/{timestamp}_spectrum.jpg"
-            
-            s3_client.put_object(
-                Bucket=S3_BUCKET,
-                Key=image_s3_key,
-                Body=image_bytes,
-                ContentType='image/jpeg',
-                Metadata={
+            # Por contenido (images/sha256/...), como el claim check del IoT handler:
+            # bajo observations/ dispararía la notificación de subidas prefirmadas
+            with stage('s3Put'):
+                image_s3_key = put_image(s3_client, S3_BUCKET, image_bytes, metadata={
                     'deviceId': device_id,
-                    'timestamp': timestamp,
                     'type': 'spectral_image'
-                }
-            )
-            print(f"Imagen subida a S3: {image_s3_key}")
+                })['s3Key']
         else:
             raise ValueError("Se requiere imageData o imageS3Key")
         
         # 2. Análisis espectral (simplificado por ahora)
-        spectral_data = analyze_spectrum_simple()
+        with stage('analysis'):
+            spectral_data = analyze_spectrum_simple()
         
         # 3. Crear observación en DynamoDB
-        observation_id = f"obs_{device_id}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+        observation_id = requested_id or new_observation_id(device_id)
         timestamp = datetime.utcnow().isoformat()
         
         observation = {
@@ -78,21 +113,11 @@ def lambda_handler(event, context):
             'createdAt': timestamp
         }
         
-        observations_table.put_item(Item=convert_floats_to_decimals(observation))
-        print(f"Observación guardada: {observation_id}")
-        
-        # 4. Actualizar dispositivo
-        try:
-            devices_table.update_item(
-                Key={'deviceId': device_id},
-                UpdateExpression='SET lastUpdate = :timestamp, lastObservation = :obsId',
-                ExpressionAttributeValues={
-                    ':timestamp': timestamp,
-                    ':obsId': observation_id
-                }
-            )
-        except Exception as e:
-            print(f"No se pudo actualizar dispositivo: {e}")
+        with stage('serialize'):
+            item = serialize_item(observation)
+        record_size('item', serialized_size(item))
+        # 4. Guardar y actualizar dispositivo
+        save(item, device_id, observation_id, timestamp)
         
         return {
             'statusCode': 200,
@@ -114,6 +139,61 @@ def lambda_handler(event, context):
             'body': json.dumps({'error': str(e)})
         }
 
+def save_observation(item, device_id, observation_id, timestamp):
+    with stage('dynamodbPut'):
+        dynamodb_client.put_item(TableName=OBSERVATIONS_TABLE, Item=item)
+    print(f"Observación guardada: {observation_id}")
+    update_device(device_id, observation_id, timestamp)
+
+def update_device(device_id, observation_id, timestamp, writer=None):
+    pending = writer or DeviceWriter(devices_table)
+    pending.update(device_id, {'lastUpdate': timestamp, 'lastObservation': observation_id})
+    if writer is None:
+        try:
+            pending.flush()
+        except Exception as e:
+            print(f"No se pudo actualizar dispositivo: {e}")
+
+def _process_record(payload):
+    writes = []
+    events = upload_events(payload) if is_upload_notification(payload) else [payload]
+    for event in events:
+        response = process_image(event, lambda *write: writes.append(write))
+        if response['statusCode'] != 200:
+            raise ValueError(json.loads(response['body']).get('error'))
+    return writes
+
+def new_observation_id(device_id):
+    """Fecha y sufijo aleatorio: único aunque lleguen varias imágenes en el mismo segundo"""
+    return f"obs_{device_id}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:12]}"
+
+def _commit_observations(pending):
+    """BatchWriteItem de las observaciones del lote; retorna los messageIds fallidos"""
+    # Notificaciones repetidas comparten observationId: un item, varios messageIds
+    owners = {}
+    items = []
+    for message_id, writes in pending:
+        for item, _, observation_id, _ in writes:
+            if observation_id not in owners:
+                items.append(item)
+            owners.setdefault(observation_id, set()).add(message_id)
+    unwritten = batch_write(dynamodb_client, OBSERVATIONS_TABLE, items, 'observationId')
+    failed = {message_id for item in unwritten for message_id in owners[item['observationId']['S']]}
+    
+    writer = DeviceWriter(devices_table)
+    committed = sorted(
+        (timestamp, device_id, observation_id)
+        for message_id, writes in pending if message_id not in failed
+        for _, device_id, observation_id, timestamp in writes
+    )
+    for timestamp, device_id, observation_id in committed:
+        update_device(device_id, observation_id, timestamp, writer)
+    try:
+        writer.flush()
+    except Exception as e:
+        print(f"No se pudo actualizar dispositivo: {e}")
+    return sorted(failed)
+
 def analyze_spectrum_simple():
     """
     Análisis espectral simplificado
@@ -131,14 +211,3 @@ def analyze_spectrum_simple():
         'maxIntensity': 92.0,
         'quality': 'good'
     }
-
-def convert_floats_to_decimals(obj):
-    """Convierte floats a Decimals para DynamoDB"""
-    if isinstance(obj, list):
-        return [convert_floats_to_decimals(item) for item in obj]
-    elif isinstance(obj, dict):
-        return {key: convert_floats_to_decimals(value) for key, value in obj.items()}
-    elif isinstance(obj, float):
-        return Decimal(str(obj))
-    else:
-        return obj
\ No newline at end of file
@@ -82,8 +82,9 @@ def lambda_handler(event, context):
             'deviceId': device_id,
             'userId': user_id,
             'name': device_name,
-            'status': 'online',
-            'isOnline': True,
+            # Todavía no se conectó: pasa a en línea con su primer heartbeat (ver presence)
+            'status': 'offline',
+            'isOnline': False,
             'certificateArn': certificate_arn,
             'model': 'ESP32-CAM',
             'firmware': '1.0.0',
@@ -108,7 +109,8 @@ def lambda_handler(event, context):
                 'device': {
                     'deviceId': device_id,
                     'name': device_name,
-                    'status': 'online'
+                    'status': device_item['status'],
+                    'isOnline': device_item['isOnline']
                 },
                 'certificates': {
                     'certificatePem': certificate_pem,
@@ -2,11 +2,13 @@ import json
 import boto3
 import os
 from datetime import datetime
+from instrumentation import instrumented, stage, record_size, item_size
 
 iot_client = boto3.client('iot')
 dynamodb = boto3.resource('dynamodb')
 devices_table = dynamodb.Table(os.environ['DEVICES_TABLE'])
 
+@instrumented
 def lambda_handler(event, context):
     """
     POST /devices/register
@@ -28,23 +30,25 @@ def lambda_handler(event, context):
         
         # 1. Crear Thing en IoT Core
         try:
-            iot_client.create_thing(
-                thingName=device_id,
-                attributePayload={
-                    'attributes': {
-                        'deviceName': device_name,
-                        'userId': user_id,
-                        'deviceType': 'ESP32-CAM',
-                        'firmware': '1.0.0'
+            with stage('iotCreateThing'):
+                iot_client.create_thing(
+                    thingName=device_id,
+                    attributePayload={
+                        'attributes': {
+                            'deviceName': device_name,
+                            'userId': user_id,
+                            'deviceType': 'ESP32-CAM',
+                            'firmware': '1.0.0'
+                        }
                     }
-                }
-            )
+                )
             print(f"Thing creado: {device_id}")
         except iot_client.exceptions.ResourceAlreadyExistsException:
             print(f"Thing ya existe: {device_id}")
         
         # 2. Crear certificado y claves
-        cert_response = iot_client.create_keys_and_certificate(setAsActive=True)
+        with stage('iotCreateCertificate'):
+            cert_response = iot_client.create_keys_and_certificate(setAsActive=True)
         
         certificate_arn = cert_response['certificateArn']
         certificate_pem = cert_response['certificatePem']
@@ -54,19 +58,21 @@ def lambda_handler(event, context):
         print(f"Certificado creado: {certificate_arn}")
         
         # 3. Adjuntar certificado al Thing
-        iot_client.attach_thing_principal(
-            thingName=device_id,
-            principal=certificate_arn
-        )
+        with stage('iotAttach'):
+            iot_client.attach_thing_principal(
+                thingName=device_id,
+                principal=certificate_arn
+            )
         
         # 4. Adjuntar política al certificado
         policy_name = os.environ.get('IOT_POLICY_NAME', 'OrionsEyeDevicePolicy')
         
         try:
-            iot_client.attach_policy(
-                policyName=policy_name,
-                target=certificate_arn
-            )
+            with stage('iotAttach'):
+                iot_client.attach_policy(
+                    policyName=policy_name,
+                    target=certificate_arn
+                )
             print(f"Política adjuntada: {policy_name}")
         except Exception as e:
             print(f"⚠️ Error adjuntando política: {e}")
@@ -78,8 +84,9 @@ def lambda_handler(event, context):
             'deviceId': device_id,
             'userId': user_id,
             'name': device_name,
-            'status': 'online',
-            'isOnline': True,
+            # Todavía no se conectó: pasa a en línea con su primer heartbeat (ver presence)
+            'status': 'offline',
+            'isOnline': False,
             'certificateArn': certificate_arn,
             'model': 'ESP32-CAM',
             'firmware': '1.0.0',
@@ -87,11 +94,14 @@ def lambda_handler(event, context):
             'lastUpdate': timestamp
         }
         
-        devices_table.put_item(Item=device_item)
+        record_size('item', item_size(device_item))
+        with stage('dynamodbPut'):
+            devices_table.put_item(Item=device_item)
         print(f"✅ Dispositivo guardado en DynamoDB")
         
         # 6. Obtener IoT Endpoint
-        iot_endpoint = iot_client.describe_endpoint(endpointType='iot:Data-ATS')['endpointAddress']
+        with stage('iotDescribeEndpoint'):
+            iot_endpoint = iot_client.describe_endpoint(endpointType='iot:Data-ATS')['endpointAddress']
         
         # 7. Retornar certificados (SOLO ESTA VEZ)
         return response(201, {
@@ -100,7 +110,8 @@ def lambda_handler(event, context):
             'device': {
                 'deviceId': device_id,
                 'name': device_name,
-                'status': 'online'
+                'status': device_item['status'],
+                'isOnline': device_item['isOnline']
             },
             'certificates': {
                 'certificatePem': certificate_pem,
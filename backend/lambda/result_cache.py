@@ -0,0 +1,86 @@
+import hashlib
+import os
+import time
+import boto3
+from botocore.exceptions import ClientError
+from claim_check import put_image, put_once
+
+# Resultados del análisis por contenido: (hash de la imagen, versión de
+# calibración, versión del algoritmo) -> observación y spectralData empaquetado
+ANALYSIS_CACHE_TABLE = os.environ.get('ANALYSIS_CACHE_TABLE')
+cache_table = boto3.resource('dynamodb').Table(ANALYSIS_CACHE_TABLE) if ANALYSIS_CACHE_TABLE else None
+
+# Días que se recuerda un resultado (atributo TTL expiresAt)
+ANALYSIS_CACHE_TTL_DAYS = int(os.environ.get('ANALYSIS_CACHE_TTL_DAYS', '30'))
+
+# Espectros completos (.npy) por contenido: análisis iguales comparten objeto
+SPECTRUM_PREFIX = 'spectra/sha256'
+
+# Extensión y Content-Type por formato PIL
+IMAGE_TYPES = {
+    'JPEG': ('jpg', 'image/jpeg'),
+    'PNG': ('png', 'image/png'),
+    'BMP': ('bmp', 'image/bmp'),
+    'TIFF': ('tif', 'image/tiff'),
+}
+
+
+def content_hash(data):
+    """SHA-256 (hex) de los bytes de la imagen"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def cache_key(digest, calibration_version, algorithm_version):
+    """Clave del resultado: el mismo contenido con otra calibración o algoritmo se reanaliza"""
+    return f"{digest}#{calibration_version}#{algorithm_version}"
+
+
+def get_result(key):
+    """Resultado cacheado (lectura consistente) o None"""
+    if cache_table is None:
+        return None
+    try:
+        return cache_table.get_item(Key={'cacheKey': key}, ConsistentRead=True).get('Item')
+    except ClientError as e:
+        print(f"⚠️ No se pudo leer la caché de resultados: {e}")
+        return None
+
+
+def put_result(key, item):
+    """
+    Registra el resultado solo si la clave no existe (escritura condicional)
+    Retorna True si se escribió; False si otra invocación ya lo había hecho
+    """
+    if cache_table is None:
+        return True
+    item = dict(item, cacheKey=key)
+    item['expiresAt'] = int(time.time()) + ANALYSIS_CACHE_TTL_DAYS * 86400
+    try:
+        cache_table.put_item(Item=item, ConditionExpression='attribute_not_exists(cacheKey)')
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+
+def store_image(s3_client, bucket, digest, data, image_format=None, metadata=None):
+    """
+    Guarda la imagen en images/sha256/{hash}.{ext} (ver claim_check.put_image);
+    si ya existe no se vuelve a escribir, así los duplicados comparten objeto
+    Retorna la clave S3
+    """
+    _, content_type = IMAGE_TYPES.get(image_format, ('bin', 'application/octet-stream'))
+    return put_image(s3_client, bucket, data, content_type, metadata, digest)['s3Key']
+
+
+def store_spectrum(s3_client, bucket, npy_bytes):
+    """
+    Guarda el .npy de pack_spectral_data en spectra/sha256/{hash}.npy; si ya
+    existe no se vuelve a escribir (un reenvío o un resultado cacheado
+    apuntan al mismo objeto, nunca a uno de otra observación)
+    Retorna la clave S3
+    """
+    key = f"{SPECTRUM_PREFIX}/{content_hash(npy_bytes)}.npy"
+    put_once(s3_client, bucket, key, npy_bytes, 'application/octet-stream')
+    return key
@@ -0,0 +1,121 @@
+"""
+Claim check de imágenes entre funciones (capa SharedLayer)
+
+La imagen viaja una sola vez, como bytes crudos, a S3 por contenido
+(images/sha256/{hash}.{ext}); la invocación asíncrona del procesamiento
+lleva solo una referencia de tamaño fijo:
+
+    {"s3Key": "images/sha256/ab12....jpg", "sha256": "ab12...",
+     "size": 180344, "contentType": "image/jpeg"}
+
+Así el payload no depende del tamaño del frame (límite de 256 KB de la
+invocación asíncrona) y no hay un segundo base64 de ida y vuelta.
+
+read_image() descarga el objeto por bloques en un buffer del tamaño
+declarado, calculando el SHA-256 mientras llega; si el tamaño o el hash no
+coinciden con la referencia lanza ValueError.
+"""
+import hashlib
+from botocore.exceptions import ClientError
+
+# Prefijo de las imágenes guardadas por contenido
+CONTENT_PREFIX = 'images/sha256'
+
+EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/bmp': 'bmp',
+    'image/tiff': 'tif',
+}
+
+# Bytes por lectura del cuerpo de S3
+READ_BLOCK_BYTES = 64 * 1024
+
+
+def sniff_content_type(data):
+    """Content-Type por los primeros bytes (sin decodificar la imagen)"""
+    head = bytes(data[:4])
+    if head[:3] == b'\xff\xd8\xff':
+        return 'image/jpeg'
+    if head == b'\x89PNG':
+        return 'image/png'
+    if head[:2] == b'BM':
+        return 'image/bmp'
+    if head in (b'II*\x00', b'MM\x00*'):
+        return 'image/tiff'
+    return 'application/octet-stream'
+
+
+def image_key(digest, content_type):
+    return f"{CONTENT_PREFIX}/{digest}.{EXTENSIONS.get(content_type, 'bin')}"
+
+
+def put_image(s3_client, bucket, data, content_type=None, metadata=None, digest=None):
+    """
+    Guarda la imagen por contenido y retorna su referencia; si el objeto ya
+    existe no se vuelve a escribir (PUT condicional If-None-Match), así los
+    duplicados comparten objeto
+    """
+    digest = digest or hashlib.sha256(data).hexdigest()
+    content_type = content_type or sniff_content_type(data)
+    key = image_key(digest, content_type)
+    if put_once(s3_client, bucket, key, data, content_type, dict(metadata or {}, sha256=digest)):
+        print(f"✅ Imagen guardada en S3: {key}")
+    else:
+        print(f"♻️ Imagen ya almacenada: {key}")
+    return {'s3Key': key, 'sha256': digest, 'size': len(data), 'contentType': content_type}
+
+
+def put_once(s3_client, bucket, key, data, content_type, metadata=None):
+    """
+    PUT condicional (If-None-Match): escribe solo si la clave no existe
+    Retorna True si lo escribió esta llamada
+    """
+    try:
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=data,
+            ContentType=content_type,
+            Metadata=metadata or {},
+            IfNoneMatch='*'
+        )
+        return True
+    except ClientError as e:
+        # 412: el objeto ya existe; 409: otra escritura del mismo objeto en curso
+        if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+            raise
+        return False
+
+
+def read_image(s3_client, bucket, ref):
+    """
+    Descarga la imagen de una referencia verificando tamaño y SHA-256
+    Retorna (bytes o bytearray, sha256)
+    """
+    body = s3_client.get_object(Bucket=bucket, Key=ref['s3Key'])['Body']
+    size = ref.get('size')
+    digest = hashlib.sha256()
+    if size is None:
+        data = body.read()
+        digest.update(data)
+    else:
+        # Buffer del tamaño declarado: sin copias al crecer ni al unir bloques
+        buffer = bytearray(int(size))
+        view = memoryview(buffer)
+        filled = 0
+        while True:
+            block = body.read(READ_BLOCK_BYTES)
+            if not block:
+                break
+            if filled + len(block) > len(buffer):
+                raise ValueError(f"{ref['s3Key']}: más bytes que los {size} declarados")
+            view[filled:filled + len(block)] = block
+            digest.update(block)
+            filled += len(block)
+        if filled != len(buffer):
+            raise ValueError(f"{ref['s3Key']}: {filled} bytes, se esperaban {size}")
+        data = buffer
+    if ref.get('sha256') and digest.hexdigest() != ref['sha256']:
+        raise ValueError(f"{ref['s3Key']}: SHA-256 no coincide con la referencia")
+    return data, digest.hexdigest()
@@ -0,0 +1,109 @@
+"""
+Escrituras coalescidas al DevicesTable (capa SharedLayer)
+
+Los mensajes /status y cada imagen procesada actualizan el item del
+dispositivo, casi siempre con los mismos valores. DeviceWriter:
+
+- junta las actualizaciones de una invocación: una sola escritura por
+  dispositivo al hacer flush(), con los últimos valores de cada atributo
+- para las actualizaciones "de estado" (skippable=True) no escribe si los
+  valores no cambiaron y lastUpdate tiene menos de FRESHNESS_SECONDS:
+  primero contra la última escritura de este contenedor (sin llamar a
+  DynamoDB) y después con una escritura condicional, que decide entre
+  contenedores. Una condición fallida igual consume capacidad de escritura,
+  por eso el filtro local va primero.
+
+Métricas (instrumentation): deviceWrites, deviceWritesCoalesced (juntadas
+en otra de la misma invocación) y deviceWritesSuppressed (salteadas por
+frescura, locales o por condición).
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from botocore.exceptions import ClientError
+from instrumentation import stage, count
+
+# Ventana en la que un estado sin cambios no se vuelve a escribir
+FRESHNESS_SECONDS = int(os.environ.get('DEVICE_WRITE_FRESHNESS_SECONDS', '60'))
+
+# Última escritura de estado por dispositivo en este contenedor:
+# deviceId -> (valores escritos, time.monotonic() de la escritura)
+_recent = {}
+_recent_lock = threading.Lock()
+
+
+class DeviceWriter:
+    def __init__(self, table, freshness=FRESHNESS_SECONDS):
+        self.table = table
+        self.freshness = freshness
+        # deviceId -> [valores, skippable]
+        self._pending = {}
+
+    def update(self, device_id, values, skippable=False):
+        """
+        Agrega valores a SET en el dispositivo (lastUpdate se pone al escribir
+        si no viene en values). skippable: la escritura puede omitirse si
+        nada cambió dentro de la ventana de frescura
+        """
+        pending = self._pending.get(device_id)
+        if pending is None:
+            self._pending[device_id] = [dict(values), skippable]
+            return
+        count('deviceWritesCoalesced')
+        pending[0].update(values)
+        pending[1] = pending[1] and skippable
+
+    def flush(self):
+        """Escribe lo pendiente, un update_item por dispositivo"""
+        pending, self._pending = self._pending, {}
+        for device_id, (values, skippable) in pending.items():
+            if skippable and self._fresh_locally(device_id, values):
+                count('deviceWritesSuppressed')
+                continue
+            self._write(device_id, values, skippable)
+
+    def _fresh_locally(self, device_id, values):
+        with _recent_lock:
+            recent = _recent.get(device_id)
+        if recent is None:
+            return False
+        written, at = recent
+        return time.monotonic() - at < self.freshness and all(written.get(k) == v for k, v in values.items())
+
+    def _write(self, device_id, values, skippable):
+        now = datetime.utcnow()
+        values = dict(values)
+        values.setdefault('lastUpdate', now.isoformat())
+        names, expression_values, assignments = {}, {}, []
+        for i, (name, value) in enumerate(values.items()):
+            names[f'#a{i}'] = name
+            expression_values[f':v{i}'] = value
+            assignments.append(f'#a{i} = :v{i}')
+        kwargs = {
+            'Key': {'deviceId': device_id},
+            'UpdateExpression': 'SET ' + ', '.join(assignments),
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': expression_values,
+        }
+        if skippable:
+            # Escribe si algún valor cambió o si lastUpdate ya no es fresco (ISO: comparación de texto)
+            stale = (now - timedelta(seconds=self.freshness)).isoformat()
+            changed = [f'attribute_not_exists(#a{i}) OR #a{i} <> :v{i}'
+                       for i, name in enumerate(values) if name != 'lastUpdate']
+            names['#lastUpdate'] = 'lastUpdate'
+            expression_values[':stale'] = stale
+            kwargs['ConditionExpression'] = ' OR '.join(
+                ['attribute_not_exists(#lastUpdate)', '#lastUpdate < :stale'] + changed)
+        try:
+            with stage('dynamodbUpdate'):
+                self.table.update_item(**kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            count('deviceWritesSuppressed')
+            return
+        count('deviceWrites')
+        if skippable:
+            with _recent_lock:
+                _recent[device_id] = (values, time.monotonic())
@@ -0,0 +1,226 @@
+"""
+Formato AttributeValue de DynamoDB sin pasar por Decimal (capa SharedLayer)
+
+Escritura: serialize_item() convierte un item de Python (dicts, listas,
+floats, arrays de NumPy, bytes, Decimals de lecturas previas) directamente
+al formato del cliente de bajo nivel ({'N': '1.5'}, {'L': [...]}, ...) en
+una sola pasada.
+Reemplaza a convert_floats_to_decimals + TypeSerializer de boto3, que
+reconstruyen el item dos veces y crean un Decimal por cada float.
+
+Los números se formatean con repr (el decimal más corto que vuelve al mismo
+float, igual que Decimal(str(x))); las listas y arrays numéricos se
+formatean en bloque. NaN e infinito no existen en DynamoDB: ValueError.
+
+Lectura: item_json() escribe un item tal como lo entrega el cliente de bajo
+nivel (get_item/query) directamente como texto JSON, en una pasada y sin
+Decimals: los N ya vienen en la forma canónica de DynamoDB, que es un número
+JSON válido, y se copian tal cual. Los strings se escapan igual que
+json.dumps (ensure_ascii) y los binarios van en base64. El pseudo-tipo
+{'JSON': texto} inserta un fragmento ya codificado (p. ej. arrays
+decodificados en el handler).
+
+No importa numpy: los arrays se reconocen por sus atributos (los handlers
+de lectura no lo incluyen).
+"""
+import base64
+import math
+from collections.abc import Mapping
+from decimal import Decimal
+from json.encoder import encode_basestring_ascii as _string
+
+_NUMBER_TYPES = {int, float}
+
+
+def serialize_item(item):
+    """Item de Python -> {atributo: AttributeValue} para el cliente de bajo nivel"""
+    return {name: to_attribute_value(value) for name, value in item.items()}
+
+
+def to_attribute_value(value):
+    kind = type(value)
+    if kind is str:
+        return {'S': value}
+    if kind is float:
+        return {'N': _float(value)}
+    if kind is int:
+        return {'N': str(value)}
+    if kind is dict:
+        return {'M': {k: to_attribute_value(v) for k, v in value.items()}}
+    if kind is list or kind is tuple:
+        return {'L': _list(value)}
+    if kind is bool:
+        return {'BOOL': value}
+    if value is None:
+        return {'NULL': True}
+    if kind is Decimal:
+        return {'N': _decimal(value)}
+    if kind is bytes or kind is bytearray:
+        return {'B': bytes(value)}
+    if hasattr(value, 'dtype') and hasattr(value, 'tolist'):
+        return _array(value)
+    if isinstance(getattr(value, 'value', None), (bytes, bytearray)):
+        # boto3.dynamodb.types.Binary (items leídos con el recurso)
+        return {'B': bytes(value.value)}
+    if isinstance(value, (set, frozenset)):
+        return _set(value)
+    if isinstance(value, Mapping):
+        return {'M': {k: to_attribute_value(v) for k, v in value.items()}}
+    raise TypeError(f"Tipo no soportado por DynamoDB: {kind.__name__}")
+
+
+def item_json(item):
+    """Item en formato AttributeValue -> objeto JSON (texto)"""
+    out = []
+    _encode_map(item, out)
+    return ''.join(out)
+
+
+def items_json(items):
+    """Lista de items -> array JSON (texto)"""
+    return '[' + ', '.join(map(item_json, items)) + ']'
+
+
+def attribute_json(value):
+    out = []
+    _encode(value, out)
+    return ''.join(out)
+
+
+def serialized_size(item):
+    """Tamaño aproximado del item en DynamoDB a partir de su forma AttributeValue"""
+    return sum(len(name.encode('utf-8')) + _attribute_size(value) for name, value in item.items())
+
+
+def number_strings(values):
+    """
+    Lista de números (int/float) -> lista de strings N, en bloque
+    La verificación de NaN/infinito es una suma (en C) salvo que falle
+    """
+    strings = list(map(repr, values))
+    if not math.isfinite(sum(values)):
+        _check_finite(values)
+    return strings
+
+
+def _list(values):
+    if values and set(map(type, values)) <= _NUMBER_TYPES:
+        return [{'N': s} for s in number_strings(values)]
+    return [to_attribute_value(v) for v in values]
+
+
+def _array(array):
+    """Array de NumPy (o escalar): numéricos en bloque, el resto elemento a elemento"""
+    if array.ndim == 0:
+        return to_attribute_value(array.item())
+    if array.ndim > 1:
+        return {'L': [_array(row) for row in array]}
+    kind = array.dtype.kind
+    if kind in 'iu':
+        return {'L': [{'N': s} for s in map(str, array.tolist())]}
+    if kind == 'f':
+        if array.dtype.itemsize < 8:
+            # float16/32: el repr más corto de su propia precisión (como str(np.float32))
+            if not math.isfinite(float(array.sum(dtype='f8'))):
+                _check_finite(array.tolist())
+            return {'L': [{'N': s} for s in array.astype('U').tolist()]}
+        return {'L': [{'N': s} for s in number_strings(array.tolist())]}
+    return {'L': [to_attribute_value(v) for v in array.tolist()]}
+
+
+def _set(values):
+    if not values:
+        raise ValueError("DynamoDB no admite sets vacíos")
+    if all(isinstance(v, str) for v in values):
+        return {'SS': list(values)}
+    if all(isinstance(v, (bytes, bytearray)) for v in values):
+        return {'BS': [bytes(v) for v in values]}
+    if all(type(v) in _NUMBER_TYPES or isinstance(v, Decimal) for v in values):
+        return {'NS': [_decimal(v) if isinstance(v, Decimal) else to_attribute_value(v)['N'] for v in values]}
+    raise TypeError("Los sets de DynamoDB deben ser de un solo tipo (strings, números o binarios)")
+
+
+def _float(value):
+    if not math.isfinite(value):
+        raise ValueError(f"DynamoDB no admite {value}")
+    return repr(value)
+
+
+def _decimal(value):
+    if not value.is_finite():
+        raise ValueError(f"DynamoDB no admite {value}")
+    return str(value)
+
+
+def _check_finite(values):
+    for v in values:
+        if not math.isfinite(v):
+            raise ValueError(f"DynamoDB no admite {v}")
+
+
+def _encode(value, out):
+    (kind, data), = value.items()
+    if kind == 'S':
+        out.append(_string(data))
+    elif kind == 'N':
+        out.append(data)
+    elif kind == 'M':
+        _encode_map(data, out)
+    elif kind == 'L':
+        numbers = [v.get('N') for v in data]
+        if data and None not in numbers:
+            # Arrays espectrales: todos números, se unen de una vez
+            out.append('[' + ', '.join(numbers) + ']')
+            return
+        out.append('[')
+        for i, v in enumerate(data):
+            if i:
+                out.append(', ')
+            _encode(v, out)
+        out.append(']')
+    elif kind == 'BOOL':
+        out.append('true' if data else 'false')
+    elif kind == 'NULL':
+        out.append('null')
+    elif kind == 'B':
+        out.append('"' + base64.b64encode(data).decode('ascii') + '"')
+    elif kind == 'SS':
+        out.append('[' + ', '.join(map(_string, data)) + ']')
+    elif kind == 'NS':
+        out.append('[' + ', '.join(data) + ']')
+    elif kind == 'BS':
+        out.append('[' + ', '.join('"' + base64.b64encode(v).decode('ascii') + '"' for v in data) + ']')
+    elif kind == 'JSON':
+        out.append(data)
+    else:
+        raise TypeError(f"Tipo de AttributeValue desconocido: {kind}")
+
+
+def _encode_map(data, out):
+    out.append('{')
+    first = True
+    for name, v in data.items():
+        if not first:
+            out.append(', ')
+        first = False
+        out.append(_string(name))
+        out.append(': ')
+        _encode(v, out)
+    out.append('}')
+
+
+def _attribute_size(value):
+    (kind, data), = value.items()
+    if kind == 'S':
+        return len(data.encode('utf-8'))
+    if kind == 'N':
+        return len(data.lstrip('-').replace('.', '').lstrip('0')) // 2 + 2
+    if kind == 'B':
+        return len(data)
+    if kind == 'M':
+        return 3 + sum(len(k.encode('utf-8')) + _attribute_size(v) + 1 for k, v in data.items())
+    if kind == 'L':
+        return 3 + sum(_attribute_size(v) + 1 for v in data)
+    if kind in ('SS', 'NS', 'BS'):
+        return sum(_attribute_size({kind[0]: v}) for v in data)
+    return 1
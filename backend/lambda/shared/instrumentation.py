@@ -0,0 +1,239 @@
+"""
+Instrumentación compartida de los handlers (capa SharedLayer)
+
+Cada invocación acumula tiempos por etapa (reloj monotónico), tamaños en
+bytes (payload, items de DynamoDB, respuesta) y contadores, y al terminar
+escribe UN registro JSON en formato CloudWatch Embedded Metric Format (EMF):
+CloudWatch Logs lo convierte en métricas sin llamadas a PutMetricData.
+
+Uso en un handler:
+
+    from instrumentation import instrumented, stage, record_size
+
+    @instrumented
+    def lambda_handler(event, context):
+        with stage('dynamodb_get'):
+            item = table.get_item(...)
+        record_size('item', item_size(item))
+
+stage(), record_size(), count() y set_property() funcionan también desde
+módulos de librería: si no hay una invocación activa no hacen nada. Para
+medir desde hilos de un pool, envolver la función con propagate().
+"""
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'OrionsEye')
+FUNCTION_NAME = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+
+# Verdadero hasta la primera invocación del contenedor
+_cold_start = True
+_cold_lock = threading.Lock()
+
+# Invocación activa por hilo (las herramientas locales corren handlers en hilos)
+_local = threading.local()
+
+
+class Invocation:
+    """Métricas de una invocación; se emiten una sola vez con emit()"""
+
+    def __init__(self, function_name=FUNCTION_NAME, cold_start=False):
+        self.function_name = function_name
+        self.cold_start = cold_start
+        self.timings = {}
+        self.sizes = {}
+        self.counts = {}
+        self.properties = {}
+        self.started = time.perf_counter()
+        # Las etapas pueden venir de varios hilos de la misma invocación (propagate)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Mide una etapa; si se repite (p. ej. un frame por iteración) se suman los tiempos"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    def record_size(self, name, nbytes):
+        with self._lock:
+            self.sizes[name] = self.sizes.get(name, 0) + int(nbytes)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def set_property(self, name, value):
+        """Campo del registro que no es métrica (deviceId, statusCode...), consultable en Logs Insights"""
+        self.properties[name] = value
+
+    def record(self):
+        """Registro EMF de la invocación"""
+        metrics = [{'Name': 'coldStart', 'Unit': 'Count'},
+                   {'Name': 'durationMs', 'Unit': 'Milliseconds'}]
+        record = {
+            'FunctionName': self.function_name,
+            'coldStart': int(self.cold_start),
+            'durationMs': round((time.perf_counter() - self.started) * 1000, 3),
+        }
+        for name, value in self.timings.items():
+            metrics.append({'Name': f"{name}Ms", 'Unit': 'Milliseconds'})
+            record[f"{name}Ms"] = round(value, 3)
+        for name, value in self.sizes.items():
+            metrics.append({'Name': f"{name}Bytes", 'Unit': 'Bytes'})
+            record[f"{name}Bytes"] = value
+        for name, value in self.counts.items():
+            metrics.append({'Name': name, 'Unit': 'Count'})
+            record[name] = value
+        for name, value in self.properties.items():
+            record.setdefault(name, value)
+        record['_aws'] = {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [['FunctionName']],
+                'Metrics': metrics
+            }]
+        }
+        return record
+
+    def emit(self):
+        print(json.dumps(self.record(), default=str))
+
+
+def instrumented(handler):
+    """
+    Decorador de lambda_handler: abre la invocación, registra cold start,
+    tamaño del evento y de la respuesta, statusCode y duración total, y
+    emite el registro EMF aunque el handler lance una excepción
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global _cold_start
+        with _cold_lock:
+            cold, _cold_start = _cold_start, False
+        invocation = Invocation(getattr(context, 'function_name', None) or FUNCTION_NAME, cold)
+        request_id = getattr(context, 'aws_request_id', None)
+        if request_id:
+            invocation.set_property('requestId', request_id)
+        invocation.record_size('payload', payload_size(event))
+
+        previous = getattr(_local, 'invocation', None)
+        _local.invocation = invocation
+        try:
+            response = handler(event, context)
+            if isinstance(response, dict):
+                if 'statusCode' in response:
+                    invocation.set_property('statusCode', response['statusCode'])
+                if isinstance(response.get('body'), str):
+                    invocation.record_size('response', len(response['body'].encode('utf-8')))
+            return response
+        except Exception:
+            invocation.count('unhandledErrors')
+            raise
+        finally:
+            _local.invocation = previous
+            try:
+                invocation.emit()
+            except Exception as e:
+                print(f"⚠️ No se pudo emitir métricas: {e}")
+    return wrapper
+
+
+def current():
+    """Invocación activa del hilo, o None fuera de un handler instrumentado"""
+    return getattr(_local, 'invocation', None)
+
+
+def propagate(function):
+    """
+    Envuelve function para que, ejecutada en otro hilo (p. ej. un pool de
+    workers), registre sus etapas en la invocación activa al envolverla;
+    los tiempos de etapas concurrentes se suman
+    """
+    invocation = current()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, 'invocation', None)
+        _local.invocation = invocation
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.invocation = previous
+    return wrapper
+
+
+@contextmanager
+def stage(name):
+    invocation = current()
+    if invocation is None:
+        yield
+        return
+    with invocation.stage(name):
+        yield
+
+
+def record_size(name, nbytes):
+    invocation = current()
+    if invocation is not None:
+        invocation.record_size(name, nbytes)
+
+
+def count(name, value=1):
+    invocation = current()
+    if invocation is not None:
+        invocation.count(name, value)
+
+
+def set_property(name, value):
+    invocation = current()
+    if invocation is not None:
+        invocation.set_property(name, value)
+
+
+def payload_size(event):
+    """Bytes del evento: el body si viene de API Gateway, el JSON completo si no"""
+    if isinstance(event, dict) and isinstance(event.get('body'), str):
+        return len(event['body'].encode('utf-8'))
+    try:
+        return len(json.dumps(event, default=str).encode('utf-8'))
+    except (TypeError, ValueError):
+        return 0
+
+
+def item_size(item):
+    """
+    Tamaño aproximado de un item según las reglas de DynamoDB (límite 400 KB,
+    unidades de capacidad): nombres de atributo + valores; los números
+    ocupan ~1 byte por cada 2 dígitos significativos más 1
+    """
+    return sum(len(str(name).encode('utf-8')) + _value_size(value) for name, value in item.items())
+
+
+def _value_size(value):
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, (int, float, Decimal)):
+        digits = str(value).lstrip('-').replace('.', '').lstrip('0').split('E')[0].split('e')[0]
+        return len(digits) // 2 + 2
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if hasattr(value, 'value') and isinstance(value.value, (bytes, bytearray)):
+        return len(value.value)  # boto3 Binary
+    if isinstance(value, dict):
+        return 3 + sum(len(str(k).encode('utf-8')) + _value_size(v) + 1 for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return 3 + sum(_value_size(v) + 1 for v in value)
+    return len(str(value).encode('utf-8'))
@@ -0,0 +1,129 @@
+"""
+Presencia de dispositivos (capa SharedLayer)
+
+Cada mensaje MQTT de un dispositivo es un heartbeat. En vez de escribir
+isOnline en el DevicesTable, se guarda un registro compacto en el
+PresenceTable:
+
+    {deviceId, lastSeen (epoch s), expiresAt (TTL), presence: "online#<shard>"}
+
+El estado se deriva al leer: en línea si lastSeen tiene menos de
+PRESENCE_TIMEOUT_SECONDS (get_devices lo consulta con BatchGetItem).
+
+El atributo presence es la clave de un índice disperso (PresenceIndex,
+presence + lastSeen): solo tienen item en el índice los dispositivos
+marcados en línea. El barrido periódico (presence_sweep) consulta ahí los
+que dejaron de reportar, les quita el atributo y marca isOnline = false en
+el DevicesTable; nunca recorre toda la flota. El DevicesTable solo se
+escribe en las transiciones (al volver a estar en línea y en el barrido).
+"""
+import os
+import threading
+import time
+import zlib
+from botocore.exceptions import ClientError
+from instrumentation import stage, count
+
+PRESENCE_TABLE = os.environ.get('PRESENCE_TABLE')
+PRESENCE_INDEX = 'PresenceIndex'
+
+# Sin heartbeat en este tiempo, el dispositivo se considera fuera de línea
+PRESENCE_TIMEOUT_SECONDS = int(os.environ.get('PRESENCE_TIMEOUT_SECONDS', '120'))
+# Un contenedor no reescribe lastSeen de un dispositivo antes de este intervalo
+PRESENCE_WRITE_INTERVAL = int(os.environ.get('PRESENCE_WRITE_INTERVAL', '20'))
+# El registro expira tras una semana sin heartbeats (el barrido deja lastSeen en el DevicesTable)
+PRESENCE_TTL_SECONDS = 7 * 24 * 3600
+# Particiones del índice disperso, para no concentrar las escrituras en una clave
+PRESENCE_SHARDS = int(os.environ.get('PRESENCE_SHARDS', '4'))
+
+# Límite de BatchGetItem por llamada
+BATCH_GET_SIZE = 100
+
+# deviceId -> time.monotonic() del último lastSeen escrito por este contenedor
+_written = {}
+_written_lock = threading.Lock()
+
+
+def shard_key(device_id):
+    return f"online#{zlib.crc32(device_id.encode()) % PRESENCE_SHARDS}"
+
+
+def shard_keys():
+    return [f"online#{shard}" for shard in range(PRESENCE_SHARDS)]
+
+
+def heartbeat(table, device_id, now=None):
+    """
+    Registra que el dispositivo reportó
+    Retorna True si pasó de fuera de línea a en línea (el llamador lo refleja en el DevicesTable)
+    """
+    with _written_lock:
+        written = _written.get(device_id)
+    if written is not None and time.monotonic() - written < PRESENCE_WRITE_INTERVAL:
+        count('presenceWritesSuppressed')
+        return False
+
+    now = int(now if now is not None else time.time())
+    with stage('presenceUpdate'):
+        response = table.update_item(
+            Key={'deviceId': device_id},
+            UpdateExpression='SET lastSeen = :now, expiresAt = :expires, presence = :shard',
+            ExpressionAttributeValues={
+                ':now': now,
+                ':expires': now + PRESENCE_TTL_SECONDS,
+                ':shard': shard_key(device_id),
+            },
+            ReturnValues='UPDATED_OLD',
+        )
+    count('presenceWrites')
+    with _written_lock:
+        _written[device_id] = time.monotonic()
+    # Sin presence anterior: era nuevo o el barrido lo había marcado fuera de línea
+    return 'presence' not in response.get('Attributes', {})
+
+
+def is_online(last_seen, now=None):
+    if last_seen is None:
+        return False
+    now = now if now is not None else time.time()
+    return now - float(last_seen) < PRESENCE_TIMEOUT_SECONDS
+
+
+def last_seen(client, table_name, device_ids):
+    """deviceId -> lastSeen (epoch s) de los dispositivos con registro de presencia"""
+    seen = {}
+    device_ids = list(dict.fromkeys(device_ids))
+    for start in range(0, len(device_ids), BATCH_GET_SIZE):
+        request = {table_name: {
+            'Keys': [{'deviceId': {'S': device_id}} for device_id in device_ids[start:start + BATCH_GET_SIZE]],
+            'ProjectionExpression': 'deviceId, lastSeen',
+        }}
+        while request:
+            with stage('presenceGet'):
+                response = client.batch_get_item(RequestItems=request)
+            for item in response.get('Responses', {}).get(table_name, []):
+                seen[item['deviceId']['S']] = float(item['lastSeen']['N'])
+            request = response.get('UnprocessedKeys') or None
+    return seen
+
+
+def expire(table, device_id, cutoff):
+    """
+    Saca al dispositivo del índice disperso si sigue sin reportar desde cutoff
+    Retorna False si un heartbeat llegó mientras tanto
+    """
+    try:
+        with stage('presenceUpdate'):
+            table.update_item(
+                Key={'deviceId': device_id},
+                UpdateExpression='REMOVE presence',
+                ConditionExpression='attribute_exists(presence) AND lastSeen < :cutoff',
+                ExpressionAttributeValues={':cutoff': cutoff},
+            )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+    with _written_lock:
+        _written.pop(device_id, None)
+    return True
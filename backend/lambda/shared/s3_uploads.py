@@ -0,0 +1,83 @@
+"""
+Subidas directas a S3 con URL prefirmada (capa SharedLayer)
+
+presign_upload entrega URLs PUT (o de partes de una subida multiparte) para
+
+    observations/{userId}/{deviceId}/{YYYYmmdd_HHMMSS}_{observationId}.jpg
+    observations/{userId}/{deviceId}/burst_{burstId}/{YYYYmmdd_HHMMSS}_{observationId}.jpg
+
+la segunda para los frames de un burst pedidos en una sola llamada. La
+notificación ObjectCreated del bucket (por la cola de imágenes) lleva la
+clave al procesamiento: de ella salen usuario, dispositivo, burst e id de
+la observación, así las imágenes grandes no pasan por IoT Core.
+
+El id de la observación viene de la clave: una notificación repetida (S3
+entrega al menos una vez) encuentra la observación ya creada y no hace nada.
+"""
+import re
+from datetime import datetime, timezone
+from urllib.parse import unquote_plus
+
+UPLOAD_PREFIX = 'observations'
+
+_KEY_PATTERN = re.compile(
+    rf'^{UPLOAD_PREFIX}/(?P<userId>[^/]+)/(?P<deviceId>[^/]+)/(?:burst_(?P<burstId>[A-Za-z0-9-]+)/)?'
+    r'(?P<uploadedAt>\d{8}_\d{6})_(?P<observationId>[A-Za-z0-9-]+)\.jpg$'
+)
+
+
+def upload_key(user_id, device_id, observation_id, when=None, burst_id=None):
+    when = when or datetime.now(timezone.utc)
+    burst = f"burst_{burst_id}/" if burst_id else ''
+    return f"{UPLOAD_PREFIX}/{user_id}/{device_id}/{burst}{when.strftime('%Y%m%d_%H%M%S')}_{observation_id}.jpg"
+
+
+def parse_upload_key(key):
+    """Campos de una clave de upload_key(), o None si la clave no tiene ese formato"""
+    match = _KEY_PATTERN.match(key)
+    if not match:
+        return None
+    fields = {name: value for name, value in match.groupdict().items() if value is not None}
+    fields['uploadedAt'] = datetime.strptime(fields['uploadedAt'], '%Y%m%d_%H%M%S').isoformat()
+    return fields
+
+
+def is_device_upload(key, user_id, device_id):
+    """Verdadero si la clave es una subida de upload_key() de ese usuario y dispositivo"""
+    fields = parse_upload_key(str(key))
+    return fields is not None and fields['userId'] == user_id and fields['deviceId'] == device_id
+
+
+def is_upload_notification(event):
+    """Verdadero si el evento es una notificación de S3 (directa o cuerpo de un mensaje SQS)"""
+    records = event.get('Records') if isinstance(event, dict) else None
+    return bool(records) and records[0].get('eventSource') == 'aws:s3'
+
+
+def upload_events(notification):
+    """
+    Eventos de procesamiento (los mismos campos que envía el IoT handler) de
+    los objetos creados en la notificación; las claves ajenas se ignoran
+    """
+    events = []
+    for record in notification.get('Records', []):
+        if not record.get('eventName', '').startswith('ObjectCreated'):
+            continue
+        obj = record['s3']['object']
+        # Las claves llegan codificadas como en una URL (espacios como '+')
+        key = unquote_plus(obj['key'])
+        fields = parse_upload_key(key)
+        if fields is None:
+            print(f"⚠️ Clave fuera del formato de subida, se ignora: {key}")
+            continue
+        event = {
+            'deviceId': fields['deviceId'],
+            'userId': fields['userId'],
+            'observationId': fields['observationId'],
+            'timestamp': fields['uploadedAt'],
+            'imageRef': {'s3Key': key, 'size': obj.get('size')},
+        }
+        if 'burstId' in fields:
+            event['burstId'] = fields['burstId']
+        events.append(event)
+    return events
@@ -0,0 +1,105 @@
+"""
+Lectura de los arrays espectrales guardados (capa SharedLayer)
+
+Formato binario SPC1 (atributo Binary de DynamoDB):
+
+  cabecera  magic 'SPC1', códec, flags, n, offset (f64), scale (f64)
+  payload   zlib de los n valores de 16 bits, separados en dos planos
+            (bytes bajos y luego altos) para que zlib comprima mejor
+
+Códecs:
+  u16  valor = offset + q * scale, q entero de 16 bits (error <= rango / 131070)
+  f16  media precisión IEEE (error relativo <= 2^-11)
+Con FLAG_DELTA se guarda la diferencia entre valores consecutivos (módulo 2^16)
+
+Los espectros grandes van a S3 como .npy float32 (fila 0 longitudes de
+onda, fila 1 perfil). La escritura (con numpy) está en lambda/spectral_codec.py;
+este módulo solo usa la biblioteca estándar, así lo usan también los
+handlers de lectura.
+"""
+import ast
+import struct
+import zlib
+from itertools import accumulate
+
+ENCODING = 'spc1'
+MAGIC = b'SPC1'
+HEADER = struct.Struct('<4sBBxxIdd')
+
+CODEC_U16 = 0
+CODEC_F16 = 1
+CODECS = {'u16': CODEC_U16, 'f16': CODEC_F16}
+
+FLAG_DELTA = 1
+
+# Arrays del análisis que se codifican
+ENCODED_FIELDS = ('wavelengths', 'spectralProfile')
+
+
+def decode_array(blob):
+    """Decodifica un array SPC1 (bytes o Binary de boto3) a lista de floats"""
+    blob = bytes(binary_value(blob))
+    magic, codec, flags, n, offset, scale = HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise ValueError("Array espectral con formato desconocido")
+
+    raw = zlib.decompress(blob[HEADER.size:])
+    words = [lo | (hi << 8) for lo, hi in zip(raw[:n], raw[n:2 * n])]
+    if flags & FLAG_DELTA:
+        words = [w & 0xFFFF for w in accumulate(words)]
+
+    if codec == CODEC_F16:
+        return list(struct.unpack(f'<{n}e', struct.pack(f'<{n}H', *words)))
+    return [offset + w * scale for w in words]
+
+
+def read_npy(npy_bytes):
+    """
+    Lee un .npy 1D o 2D float32/float64 little-endian sin numpy
+    Retorna lista de filas (listas de floats)
+    """
+    if npy_bytes[:6] != b'\x93NUMPY':
+        raise ValueError("Archivo .npy inválido")
+    major = npy_bytes[6]
+    if major == 1:
+        (header_len,), start = struct.unpack_from('<H', npy_bytes, 8), 10
+    else:
+        (header_len,), start = struct.unpack_from('<I', npy_bytes, 8), 12
+    header = ast.literal_eval(npy_bytes[start:start + header_len].decode('latin1'))
+
+    kind = {'<f4': 'f', '<f8': 'd'}.get(header['descr'])
+    if kind is None or header['fortran_order']:
+        raise ValueError(f"Tipo .npy no soportado: {header['descr']}")
+
+    shape = header['shape'] if len(header['shape']) == 2 else (1,) + tuple(header['shape'])
+    rows, cols = shape
+    values = struct.unpack_from(f'<{rows * cols}{kind}', npy_bytes, start + header_len)
+    return [list(values[r * cols:(r + 1) * cols]) for r in range(rows)]
+
+
+def unpack_spectral_data(spectral_data, npy_bytes=None):
+    """
+    Inverso de spectral_codec.pack_spectral_data: restaura wavelengths,
+    spectralProfile y los niveles reducidos como listas
+    npy_bytes es el contenido del objeto spectrumS3Key si los arrays están en S3
+    """
+    data = dict(spectral_data)
+    if data.pop('encoding', None) == ENCODING:
+        for field in ENCODED_FIELDS:
+            if field in data:
+                data[field] = decode_array(data[field])
+    elif npy_bytes is not None:
+        rows = read_npy(npy_bytes)
+        data.update(zip(ENCODED_FIELDS, rows))
+
+    if data.get('profileLevels'):
+        data['profileLevels'] = {
+            size: {field: decode_array(blob) for field, blob in level.items()}
+            for size, level in data['profileLevels'].items()
+        }
+    return data
+
+
+def binary_value(value):
+    """bytes de un atributo Binary (boto3 lo entrega como Binary o bytes)"""
+    return value.value if hasattr(value, 'value') else value
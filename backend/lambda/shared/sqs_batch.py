@@ -0,0 +1,126 @@
+"""
+Consumo de lotes de SQS con respuesta parcial (capa SharedLayer)
+
+La función se suscribe a la cola con FunctionResponseTypes
+ReportBatchItemFailures: el handler retorna
+
+    {"batchItemFailures": [{"itemIdentifier": "<messageId>"}, ...]}
+
+y SQS vuelve a entregar solo esos mensajes (el resto se borra de la cola).
+
+consume() procesa los registros en un pool de hilos, así un lote paga una
+sola vez la inicialización del contenedor (boto3, NumPy, PIL) y el decode
+de JPEG y NumPy, que liberan el GIL, se solapan entre imágenes. Las
+escrituras se juntan y se confirman al final con commit(); batch_write()
+las agrupa en BatchWriteItem (25 items por llamada) y reintenta los
+UnprocessedItems.
+
+Uso:
+
+    def lambda_handler(event, context):
+        if is_batch(event):
+            return consume(event['Records'], process, commit)
+"""
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from instrumentation import stage, count, propagate
+
+# Registros del lote procesados a la vez
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', '4'))
+
+# Límite de BatchWriteItem por llamada
+BATCH_WRITE_SIZE = 25
+BATCH_WRITE_ATTEMPTS = 5
+THROTTLING_ERRORS = ('ProvisionedThroughputExceededException', 'ThrottlingException',
+                     'RequestLimitExceeded')
+
+
+def is_batch(event):
+    """Verdadero si el evento es un lote de SQS"""
+    records = event.get('Records') if isinstance(event, dict) else None
+    return bool(records) and records[0].get('eventSource') == 'aws:sqs'
+
+
+def consume(records, process, commit, workers=BATCH_WORKERS):
+    """
+    process(payload) -> escrituras pendientes del registro (o excepción)
+    commit([(messageId, escrituras), ...]) -> messageIds cuyas escrituras fallaron
+    Retorna la respuesta de fallos parciales para SQS
+    """
+    count('batchRecords', len(records))
+    failed, pending = [], []
+
+    def run(record):
+        return process(json.loads(record['body']))
+
+    with ThreadPoolExecutor(max(1, min(workers, len(records)))) as pool:
+        futures = [(record['messageId'], pool.submit(propagate(run), record)) for record in records]
+        for message_id, future in futures:
+            try:
+                pending.append((message_id, future.result()))
+            except Exception as e:
+                print(f"❌ Mensaje {message_id}: {e}")
+                failed.append(message_id)
+
+    if pending:
+        failed.extend(commit(pending))
+    if failed:
+        count('batchFailures', len(failed))
+        print(f"⚠️ {len(failed)} de {len(records)} mensajes vuelven a la cola")
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed]}
+
+
+def batch_write(client, table_name, items, key_name):
+    """
+    Escribe items (formato AttributeValue) con BatchWriteItem
+    Retorna los items que siguen sin escribirse tras los reintentos; un
+    error que no es de capacidad (ValidationException de un item inválido)
+    no lanza: la llamada se repite de a un item y solo el inválido queda
+    sin escribir, así vuelve a la cola solo su mensaje
+    """
+    # Una llamada no admite dos items con la misma clave: van en llamadas distintas
+    requests, current, keys = [], [], set()
+    for item in items:
+        key = item[key_name][next(iter(item[key_name]))]
+        if len(current) == BATCH_WRITE_SIZE or key in keys:
+            requests.append(current)
+            current, keys = [], set()
+        current.append(item)
+        keys.add(key)
+    if current:
+        requests.append(current)
+
+    unwritten = []
+    while requests:
+        batch = requests.pop()
+        writes = [{'PutRequest': {'Item': item}} for item in batch]
+        for attempt in range(BATCH_WRITE_ATTEMPTS):
+            with stage('dynamodbBatchWrite'):
+                try:
+                    response = client.batch_write_item(RequestItems={table_name: writes})
+                except ClientError as e:
+                    code = e.response['Error']['Code']
+                    if code in THROTTLING_ERRORS:
+                        response = {'UnprocessedItems': {table_name: writes}}
+                    elif len(writes) > 1:
+                        # Un item rechaza toda la llamada: se reintenta de a uno para aislarlo
+                        print(f"⚠️ BatchWriteItem rechazado ({code}): {len(writes)} items de a uno")
+                        requests.extend([write['PutRequest']['Item']] for write in writes)
+                        writes = []
+                        break
+                    else:
+                        print(f"❌ Item rechazado por {table_name} ({code}): {e}")
+                        count('batchWriteRejected')
+                        break
+            writes = response.get('UnprocessedItems', {}).get(table_name, [])
+            if not writes:
+                break
+            count('unprocessedItems', len(writes))
+            # Backoff exponencial con jitter, como recomienda DynamoDB
+            time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+        unwritten.extend(write['PutRequest']['Item'] for write in writes)
+    return unwritten
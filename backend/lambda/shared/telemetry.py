@@ -0,0 +1,232 @@
+"""
+Series de tiempo de sensores del topic /data (capa SharedLayer)
+
+Un item del TelemetryTable guarda una hora de un dispositivo:
+
+    {deviceId, hour (epoch s del inicio de la hora), blocks: [B, ...], samples, expiresAt}
+
+Cada escritura agrega un bloque binario con las muestras que trae
+(list_append en un UpdateItem por hora y dispositivo, no un item por
+muestra). Un bloque tiene una serie por métrica con tiempos y valores
+codificados como deltas (zigzag + varint):
+
+    varint métricas
+    por métrica: varint len(nombre), nombre, varint n,
+                 n x (delta de tiempo en ms, delta del valor en unidades de VALUE_QUANTUM)
+
+El primer tiempo es relativo al inicio de la hora y el primer valor a 0.
+Un timestamp del mensaje inválido o fuera de rango (reloj sin sincronizar)
+se reemplaza por la hora de recepción (receivedAt de la regla de IoT).
+En lotes de la cola, una muestra de temperatura y humedad cada 30 s ocupa
+~10 bytes. samples cuenta las muestras recibidas; al leer, las repetidas
+(mensajes reenviados por SQS) se descartan por tiempo.
+"""
+import math
+import os
+import time
+from datetime import datetime, timezone
+from instrumentation import stage, count
+
+TELEMETRY_TABLE = os.environ.get('TELEMETRY_TABLE')
+
+BUCKET_SECONDS = 3600
+# Resolución de los valores (se guardan como enteros de esta unidad)
+VALUE_QUANTUM = 0.001
+TELEMETRY_TTL_SECONDS = int(os.environ.get('TELEMETRY_TTL_DAYS', '90')) * 24 * 3600
+
+# Campos del mensaje que no son métricas
+RESERVED_FIELDS = ('topic', 'timestamp', 'deviceId', 'userId', 'receivedAt')
+
+# Timestamps aceptados: 2000-01-01 a 2100-01-01 (epoch s)
+MIN_TIME, MAX_TIME = 946684800, 4102444800
+# Un epoch numérico mayor está en milisegundos (en segundos sería el año 5138)
+MILLISECONDS_EPOCH = 1e11
+# Adelanto máximo del reloj del dispositivo respecto de la recepción
+MAX_CLOCK_SKEW_SECONDS = 24 * 3600
+# Valores representables en un bloque (deltas de 64 bits en unidades de VALUE_QUANTUM)
+MAX_VALUE = 2 ** 61 * VALUE_QUANTUM
+
+
+def bucket_of(t):
+    return int(t // BUCKET_SECONDS * BUCKET_SECONDS)
+
+
+def parse_time(value):
+    """
+    Epoch (s) de un timestamp ISO o numérico (s o ms) del mensaje; sin zona, UTC
+    ValueError si no es un tiempo o está fuera de MIN_TIME..MAX_TIME
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"timestamp inválido: {value!r}")
+    try:
+        t = float(value)
+        if abs(t) >= MILLISECONDS_EPOCH:
+            t /= 1000
+    except OverflowError:
+        raise ValueError(f"timestamp fuera de rango: {value!r}") from None
+    except ValueError:
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            if parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=timezone.utc)
+            t = parsed.timestamp()
+        except (ValueError, OverflowError):
+            raise ValueError(f"timestamp inválido: {value!r}") from None
+    if not (math.isfinite(t) and MIN_TIME <= t < MAX_TIME):
+        raise ValueError(f"timestamp fuera de rango: {value!r}")
+    return t
+
+
+def sample_from_message(message):
+    """
+    (epoch s, {métrica: valor}) de un mensaje /data, o None si no trae valores numéricos
+    Sin timestamp válido se usa la hora de recepción
+    """
+    values = {
+        name: float(value) for name, value in message.items()
+        if name not in RESERVED_FIELDS and isinstance(value, (int, float)) and not isinstance(value, bool)
+        and math.isfinite(value) and abs(value) < MAX_VALUE
+    }
+    if not values:
+        return None
+    try:
+        received = parse_time(message['receivedAt'])
+    except (KeyError, ValueError):
+        received = time.time()
+    try:
+        t = parse_time(message['timestamp'])
+    except (KeyError, ValueError):
+        t = received
+    if t > received + MAX_CLOCK_SKEW_SECONDS:
+        t = received
+    return t, values
+
+
+def encode_block(hour, samples):
+    """Bloque binario de [(epoch s, {métrica: valor}), ...] de una misma hora"""
+    series = {}
+    for t, values in sorted(samples, key=lambda sample: sample[0]):
+        offset = int(round((t - hour) * 1000))
+        for name, value in values.items():
+            series.setdefault(name, []).append((offset, int(round(value / VALUE_QUANTUM))))
+
+    out = bytearray()
+    _varint(out, len(series))
+    for name, points in series.items():
+        encoded = name.encode()
+        _varint(out, len(encoded))
+        out += encoded
+        _varint(out, len(points))
+        last_t, last_v = 0, 0
+        for offset, value in points:
+            _varint(out, _zigzag(offset - last_t))
+            _varint(out, _zigzag(value - last_v))
+            last_t, last_v = offset, value
+    return bytes(out)
+
+
+def decode_blocks(hour, blocks):
+    """{métrica: [(epoch s, valor), ...]} ordenado por tiempo y sin tiempos repetidos"""
+    series = {}
+    for block in blocks:
+        data = bytes(block.value if hasattr(block, 'value') else block)
+        pos = 0
+        metrics, pos = _read_varint(data, pos)
+        for _ in range(metrics):
+            length, pos = _read_varint(data, pos)
+            name = data[pos:pos + length].decode()
+            pos += length
+            n, pos = _read_varint(data, pos)
+            points = series.setdefault(name, {})
+            offset, value = 0, 0
+            for _ in range(n):
+                dt, pos = _read_varint(data, pos)
+                dv, pos = _read_varint(data, pos)
+                offset += _unzigzag(dt)
+                value += _unzigzag(dv)
+                points[offset] = value
+    return {
+        name: [(hour + offset / 1000, value * VALUE_QUANTUM) for offset, value in sorted(points.items())]
+        for name, points in series.items()
+    }
+
+
+def append_samples(table, samples):
+    """
+    Agrega [(deviceId, epoch s, {métrica: valor}), ...]: un UpdateItem por
+    dispositivo y hora con un bloque de todas sus muestras
+    Retorna las claves (deviceId, hour) que no se pudieron escribir
+    """
+    buckets = {}
+    for device_id, t, values in samples:
+        buckets.setdefault((device_id, bucket_of(t)), []).append((t, values))
+
+    failed = []
+    for (device_id, hour), bucket in buckets.items():
+        try:
+            block = encode_block(hour, bucket)
+            with stage('telemetryAppend'):
+                table.update_item(
+                    Key={'deviceId': device_id, 'hour': hour},
+                    UpdateExpression='SET blocks = list_append(if_not_exists(blocks, :empty), :block), '
+                                     'expiresAt = :expires ADD samples :n',
+                    ExpressionAttributeValues={
+                        ':empty': [],
+                        ':block': [block],
+                        ':expires': hour + BUCKET_SECONDS + TELEMETRY_TTL_SECONDS,
+                        ':n': len(bucket),
+                    },
+                )
+        except Exception as e:
+            # Solo vuelven a la cola los mensajes de este bloque
+            print(f"❌ Telemetría {device_id} {hour}: {e}")
+            failed.append((device_id, hour))
+            continue
+        count('telemetrySamples', len(bucket))
+        count('telemetryBlockBytes', len(block))
+    count('telemetryWrites', len(buckets) - len(failed))
+    return failed
+
+
+def downsample(points, start, end, step):
+    """Promedio, mínimo y máximo por intervalo de step segundos (solo intervalos con muestras)"""
+    bins = {}
+    for t, value in points:
+        if start <= t < end:
+            bins.setdefault(int((t - start) // step), []).append(value)
+    return [
+        {
+            't': start + index * step,
+            'avg': round(sum(values) / len(values), 3),
+            'min': round(min(values), 3),
+            'max': round(max(values), 3),
+            'count': len(values),
+        }
+        for index, values in sorted(bins.items())
+    ]
+
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def _unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def _varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varint(data, pos):
+    result, shift = 0, 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
@@ -0,0 +1,70 @@
+import io
+import os
+import zlib
+from spectral_format import (ENCODING, MAGIC, HEADER, CODEC_U16, CODECS, FLAG_DELTA, ENCODED_FIELDS,
+                             decode_array, read_npy, unpack_spectral_data)
+
+# Escritura de los arrays espectrales en el formato SPC1 (ver shared/spectral_format.py,
+# que también los lee en los handlers sin numpy)
+
+# Tamaño máximo de los arrays codificados dentro del item; por encima van a S3 como .npy
+SPECTRAL_INLINE_MAX_BYTES = int(os.environ.get('SPECTRAL_INLINE_MAX_BYTES', str(64 * 1024)))
+
+
+def encode_array(values, codec='u16', level=6):
+    """Codifica un array 1D de floats en el formato SPC1"""
+    import numpy as np
+
+    data = np.asarray(values, dtype=np.float64).ravel()
+    offset, scale, flags = 0.0, 1.0, 0
+
+    if CODECS[codec] == CODEC_U16:
+        low, high = (float(data.min()), float(data.max())) if data.size else (0.0, 0.0)
+        offset = low
+        scale = (high - low) / 65535.0 or 1.0
+        words = np.rint((data - offset) / scale).astype(np.uint16)
+        # Perfiles y longitudes de onda varían suave: las diferencias son chicas
+        words = np.diff(words, prepend=np.uint16(0)).astype(np.uint16)
+        flags |= FLAG_DELTA
+    else:
+        words = data.astype(np.float16).view(np.uint16)
+
+    planes = words.astype('<u2').view(np.uint8).reshape(-1, 2).T.tobytes()
+    header = HEADER.pack(MAGIC, CODECS[codec], flags, data.size, offset, scale)
+    return header + zlib.compress(planes, level)
+
+
+def pack_spectral_data(spectral_data, codec='u16'):
+    """
+    Prepara el resultado del análisis para DynamoDB
+
+    Los arrays (y cada nivel de profileLevels) se reemplazan por blobs SPC1
+    (encoding = 'spc1'). Si los arrays completos juntos superan
+    SPECTRAL_INLINE_MAX_BYTES se omiten del item y se retornan como .npy
+    (float32, fila 0 longitudes de onda, fila 1 perfil) para guardar en S3;
+    los niveles reducidos quedan siempre en el item.
+
+    Retorna (dict para el item, bytes .npy o None)
+    """
+    arrays = [spectral_data.get(field) for field in ENCODED_FIELDS]
+    if any(a is None for a in arrays):
+        return dict(spectral_data), None
+
+    packed = {k: v for k, v in spectral_data.items() if k not in ENCODED_FIELDS}
+    # Los niveles reducidos son chicos: siempre quedan en el item
+    if spectral_data.get('profileLevels'):
+        packed['profileLevels'] = {
+            size: {field: encode_array(level[field], codec) for field in ENCODED_FIELDS}
+            for size, level in spectral_data['profileLevels'].items()
+        }
+
+    blobs = [encode_array(a, codec) for a in arrays]
+    if sum(len(b) for b in blobs) <= SPECTRAL_INLINE_MAX_BYTES:
+        packed.update(zip(ENCODED_FIELDS, blobs))
+        packed['encoding'] = ENCODING
+        return packed, None
+
+    import numpy as np
+    buffer = io.BytesIO()
+    np.save(buffer, np.vstack([np.asarray(a, dtype='<f4') for a in arrays]))
+    return packed, buffer.getvalue()
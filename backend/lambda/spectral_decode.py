@@ -0,0 +1,168 @@
+import io
+import os
+import time
+import tracemalloc
+import numpy as np
+from PIL import Image
+
+# Resolución espectral deseada (columnas del perfil). 0 = resolución completa
+SPECTRAL_COLUMNS = int(os.environ.get('SPECTRAL_COLUMNS', '0'))
+
+# Conversión a gris: 'mean' (promedio RGB, igual peso por canal) o 'luma'
+# ('luma' decodifica solo la luminancia del JPEG; más rápido pero atenúa el azul)
+GRAYSCALE_MODE = os.environ.get('SPECTRAL_GRAYSCALE', 'mean')
+
+# Límite de pixeles contra bombas de descompresión (OV5640 = 5 MP)
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', str(10_000_000)))
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Tamaño de cada banda de filas al sumar columnas
+BAND_BYTES = 1 << 20
+
+
+def open_image(image_bytes, max_pixels=MAX_IMAGE_PIXELS):
+    """
+    Abre la imagen sin decodificarla y valida su tamaño
+    PIL solo lee la cabecera aquí; los pixeles se decodifican en extract_profile
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    check_pixel_count(image, max_pixels)
+    return image
+
+
+def check_pixel_count(image, max_pixels=MAX_IMAGE_PIXELS):
+    """Rechaza imágenes con más pixeles de los permitidos antes de decodificar"""
+    width, height = image.size
+    if width * height > max_pixels:
+        raise ValueError(
+            f"Imagen demasiado grande: {width}x{height} "
+            f"({width * height} pixeles, máximo {max_pixels})"
+        )
+
+
+def extract_profile(image, columns=SPECTRAL_COLUMNS, grayscale=GRAYSCALE_MODE, rows=None):
+    """
+    Decodifica la imagen y la reduce a un perfil horizontal (promedio vertical)
+
+    - JPEG: usa draft() para decodificar directamente a escala 1/2, 1/4 o 1/8
+      cuando la resolución espectral pedida lo permite
+    - El gris y la suma por columnas se hacen con acumuladores enteros;
+      nunca se crea una copia float64 del frame
+    - rows=(top, bottom) limita el promedio a esa banda de filas
+      (coordenadas de la imagen decodificada)
+
+    Retorna (perfil float64 de longitud = ancho decodificado, info del decode)
+    """
+    start = time.perf_counter()
+    image, info = decode_image(image, columns, grayscale)
+    profile = column_profile(image, rows)
+    info['decodeMs'] = round((time.perf_counter() - start) * 1000, 2)
+    if tracemalloc.is_tracing():
+        info['tracedPeakBytes'] = tracemalloc.get_traced_memory()[1]
+    return profile, info
+
+
+def decode_image(image, columns=SPECTRAL_COLUMNS, grayscale=GRAYSCALE_MODE):
+    """
+    Decodifica la imagen al modo y escala usados para el análisis
+    Retorna (imagen PIL decodificada, info del decode)
+    """
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+    check_pixel_count(image)
+    original_size = image.size
+    if image.mode in ('L', 'I;16', 'I', 'F'):
+        mode = image.mode
+    else:
+        mode = 'L' if grayscale == 'luma' else 'RGB'
+
+    if image.format == 'JPEG':
+        # draft elige la mayor reducción que mantiene al menos el tamaño pedido
+        target = original_size
+        if columns and original_size[0] >= 2 * columns:
+            scale = original_size[0] / columns
+            target = (columns, max(1, int(original_size[1] / scale)))
+        image.draft(mode, target)
+
+    if image.mode != mode:
+        image = image.convert(mode)
+
+    # Reducción adicional (formatos sin draft o escala residual)
+    if columns and image.size[0] >= 2 * columns and image.mode in ('L', 'RGB', 'I', 'F'):
+        factor = image.size[0] // columns
+        image = image.reduce(factor)
+    image.load()
+
+    width, height = image.size
+    channels = len(image.getbands())
+    info = {
+        'originalSize': list(original_size),
+        'decodedSize': list(image.size),
+        'mode': image.mode,
+        'frameBytes': width * height * channels * np.dtype(_band_dtype(image)).itemsize
+    }
+    return image, info
+
+
+def column_profile(image, rows=None):
+    """Promedio por columna de la imagen decodificada, opcionalmente solo en rows=(top, bottom)"""
+    width, height = image.size
+    top, bottom = rows if rows else (0, height)
+    column_sum = sum_columns(image, rows=(top, bottom))
+    channels = column_sum.shape[1] if column_sum.ndim == 2 else 1
+    if channels > 1:
+        column_sum = column_sum.sum(axis=1)
+    return column_sum / float(max(1, bottom - top) * channels)
+
+
+def sum_rows(image, band_bytes=BAND_BYTES):
+    """
+    Suma por fila (todas las columnas y canales) recorriendo la imagen en bandas
+    Retorna (alto,) en float64
+    """
+    width, height = image.size
+    band_rows = _band_rows(image, band_bytes)
+    integer = np.dtype(_band_dtype(image)).itemsize == 1
+
+    total = np.empty(height, dtype=np.float64)
+    for top in range(0, height, band_rows):
+        bottom = min(top + band_rows, height)
+        chunk = np.asarray(image.crop((0, top, width, bottom)))
+        chunk = chunk.reshape(bottom - top, -1)
+        total[top:bottom] = chunk.sum(axis=1, dtype=np.uint32 if integer else np.float64)
+    return total
+
+
+def sum_columns(image, band_bytes=BAND_BYTES, rows=None):
+    """
+    Suma por columnas recorriendo la imagen en bandas de filas, para no
+    materializar una copia numpy del frame completo
+    rows=(top, bottom) limita la suma a esas filas
+    Retorna (ancho,) o (ancho, canales) en uint64 (float64 si no es 8 bits)
+    """
+    width, height = image.size
+    bands = len(image.getbands())
+    band_rows = _band_rows(image, band_bytes)
+    first, last = rows if rows else (0, height)
+
+    integer = np.dtype(_band_dtype(image)).itemsize == 1
+    shape = (width, bands) if bands > 1 else (width,)
+    total = np.zeros(shape, dtype=np.uint64 if integer else np.float64)
+
+    for top in range(first, last, band_rows):
+        chunk = np.asarray(image.crop((0, top, width, min(top + band_rows, last))))
+        # uint32 alcanza para 255 * 16M filas por banda
+        total += chunk.sum(axis=0, dtype=np.uint32 if integer else np.float64)
+    return total
+
+
+def _band_rows(image, band_bytes):
+    """Filas por banda para que cada recorte ocupe a lo sumo band_bytes"""
+    row_bytes = image.size[0] * len(image.getbands()) * np.dtype(_band_dtype(image)).itemsize
+    return max(1, band_bytes // max(1, row_bytes))
+
+
+def _band_dtype(image):
+    """Tipo numpy de un pixel por canal"""
+    return {'L': np.uint8, 'RGB': np.uint8, 'I;16': np.uint16, 'I': np.int32, 'F': np.float32}.get(image.mode, np.uint8)
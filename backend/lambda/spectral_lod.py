@@ -0,0 +1,49 @@
+import numpy as np
+
+# Tamaños (puntos) de los perfiles reducidos para gráficos
+LOD_LEVELS = (128, 256, 512, 1024)
+
+
+def minmax_downsample(x, y, points):
+    """
+    Reduce (x, y) a `points` muestras conservando mínimos y máximos
+
+    El perfil se divide en points/2 tramos y de cada uno se toman el mínimo
+    y el máximo en su orden original: ningún pico ni valle desaparece del
+    gráfico, a diferencia de un promedio o un muestreo regular.
+    Retorna (x, y) reducidos; si el perfil ya es chico se retorna igual.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = y.size
+    bins = points // 2
+    if bins < 1 or n <= points:
+        return x, y
+
+    # Tramos de ancho casi igual; los más cortos repiten su último índice
+    edges = np.arange(bins + 1) * n // bins
+    width = int(np.diff(edges).max())
+    cols = np.minimum(edges[:-1, None] + np.arange(width), edges[1:, None] - 1)
+    blocks = y[cols]
+    rows = np.arange(bins)
+    lo = cols[rows, blocks.argmin(axis=1)]
+    hi = cols[rows, blocks.argmax(axis=1)]
+
+    idx = np.empty(bins * 2, dtype=np.intp)
+    idx[0::2] = np.minimum(lo, hi)
+    idx[1::2] = np.maximum(lo, hi)
+    return x[idx], y[idx]
+
+
+def build_levels(wavelengths, profile, sizes=LOD_LEVELS):
+    """
+    Pirámide de perfiles reducidos, solo para tamaños menores al perfil completo
+    Retorna {'<puntos>': {'wavelengths': [...], 'spectralProfile': [...]}}
+    """
+    levels = {}
+    for size in sizes:
+        if size >= len(profile):
+            break
+        x, y = minmax_downsample(wavelengths, profile, size)
+        levels[str(size)] = {'wavelengths': x.tolist(), 'spectralProfile': y.tolist()}
+    return levels
@@ -0,0 +1,246 @@
+import numpy as np
+
+# Factor para convertir MAD a desviación estándar de una gaussiana
+MAD_TO_SIGMA = 1.4826
+
+# Pixeles revisados a cada lado del pico al buscar el cruce de media altura
+WIDTH_WINDOW = 32
+
+# Vecinos revisados antes de comparar un pico contra los más altos lejanos
+NEIGHBOR_WINDOW = 8
+
+
+def estimate_noise(data):
+    """
+    Estima el nivel de fondo y el ruido del perfil de forma robusta
+    - floor: mediana del perfil (fondo/continuo)
+    - sigma: MAD de las primeras diferencias, insensible a las líneas
+      y a variaciones lentas del continuo
+    """
+    data = np.asarray(data, dtype=np.float64)
+    if data.size < 3:
+        return 0.0, 0.0
+    return _noise_from_diff(data, np.diff(data))
+
+
+def local_maxima(data):
+    """
+    Encuentra máximos locales de forma vectorizada
+    Las mesetas (valores repetidos) se reportan en su punto medio
+    """
+    return _maxima_from_diff(np.diff(data))
+
+
+def find_peaks(data, min_snr=5.0, min_prominence=None, min_width_ratio=None):
+    """
+    Detector de picos vectorizado con umbral adaptativo por frame
+
+    Un pico se acepta si su prominencia y su altura sobre el fondo
+    superan min_snr * sigma (ruido estimado por MAD). Si se indica
+    min_prominence se usa como cota inferior adicional. Con min_width_ratio
+    se descartan los picos de FWHM menor que esa fracción de la mediana de
+    los FWHM del perfil: las líneas comparten el perfil instrumental y los
+    pixeles calientes o rayos cósmicos son más angostos (con 3 picos o más).
+
+    Retorna dict de arrays numpy:
+      indices      índice entero del máximo
+      positions    posición sub-pixel (interpolación parabólica)
+      heights      altura del pico
+      prominences  prominencia (altura sobre la base más alta)
+      widths       FWHM en pixeles (a media prominencia)
+      snr          prominencia / sigma
+    y los escalares noise, floor y threshold usados
+    """
+    data = np.asarray(data, dtype=np.float64)
+    n = data.size
+
+    result = {
+        'indices': np.empty(0, dtype=np.intp),
+        'positions': np.empty(0),
+        'heights': np.empty(0),
+        'prominences': np.empty(0),
+        'widths': np.empty(0),
+        'snr': np.empty(0),
+        'noise': 0.0,
+        'floor': 0.0,
+        'threshold': 0.0,
+    }
+    if n < 3:
+        return result
+
+    diff = np.diff(data)
+    floor, sigma = _noise_from_diff(data, diff)
+
+    # Evitar umbral cero en perfiles sin ruido
+    eps = max(abs(floor), 1.0) * 1e-9
+    threshold = max(min_snr * sigma, eps)
+    if min_prominence is not None:
+        threshold = max(threshold, float(min_prominence))
+    result.update({'noise': sigma, 'floor': floor, 'threshold': threshold})
+
+    maxima = _maxima_from_diff(diff)
+    heights = data[maxima]
+
+    # Pre-filtro exacto: la prominencia nunca supera altura - mínimo global
+    keep = heights >= max(float(data.min()), floor) + threshold
+    peaks = maxima[keep]
+    heights = heights[keep]
+    if peaks.size == 0:
+        return result
+
+    # El máximo más alto más cercano a un candidato también es candidato,
+    # así que basta comparar los candidatos entre sí
+    left_near, right_near = _nearest_higher(heights)
+    left_bound = np.where(left_near >= 0, peaks[left_near], 0)
+    right_bound = np.where(right_near >= 0, peaks[right_near], n - 1)
+
+    # Mínimos en [left_bound, peak] y [peak, right_bound] en una sola pasada
+    padded = np.append(data, np.inf)
+    bounds = np.empty(peaks.size * 4, dtype=np.intp)
+    bounds[0::4] = left_bound
+    bounds[1::4] = peaks + 1
+    bounds[2::4] = peaks
+    bounds[3::4] = right_bound + 1
+    bases = np.minimum.reduceat(padded, bounds)
+    prominences = heights - np.maximum(bases[0::4], bases[2::4])
+
+    ok = prominences >= threshold
+    if not ok.all():
+        peaks, heights, prominences = peaks[ok], heights[ok], prominences[ok]
+        left_bound, right_bound = left_bound[ok], right_bound[ok]
+        if peaks.size == 0:
+            return result
+
+    half = heights - prominences / 2.0
+    widths = (_half_crossing(data, peaks, half, right_bound, 1) -
+              _half_crossing(data, peaks, half, left_bound, -1))
+    if min_width_ratio is not None and peaks.size >= 3:
+        wide = widths >= min_width_ratio * float(np.median(widths))
+        peaks, heights, prominences, widths = peaks[wide], heights[wide], prominences[wide], widths[wide]
+
+    result.update({
+        'indices': peaks,
+        'positions': _parabolic_centroid(data, peaks),
+        'heights': heights,
+        'prominences': prominences,
+        'widths': widths,
+        'snr': prominences / max(sigma, eps),
+    })
+    return result
+
+
+def detect_peaks(data, min_snr=5.0):
+    """
+    Detecta picos en el perfil espectral
+    Mantiene la interfaz anterior: retorna lista de índices
+    """
+    return find_peaks(data, min_snr=min_snr)['indices'].tolist()
+
+
+def _noise_from_diff(data, diff):
+    """Mediana del perfil y sigma por MAD de las diferencias"""
+    n = data.size
+    floor = float(np.partition(data, n // 2)[n // 2])
+
+    abs_diff = np.abs(diff)
+    m = abs_diff.size // 2
+    abs_diff.partition(m)
+
+    # diff de ruido blanco tiene varianza 2*sigma^2
+    return floor, float(MAD_TO_SIGMA * abs_diff[m] / np.sqrt(2.0))
+
+
+def _maxima_from_diff(diff):
+    """Máximos locales a partir de las primeras diferencias"""
+    changes = np.flatnonzero(diff)
+    if changes.size < 2:
+        return np.empty(0, dtype=np.intp)
+
+    rising = diff[changes] > 0
+    # Subida seguida de bajada (ignorando tramos planos)
+    k = np.flatnonzero(rising[:-1] & ~rising[1:])
+    return (changes[k] + 1 + changes[k + 1]) // 2
+
+
+def _nearest_higher(heights):
+    """
+    Índice del vecino estrictamente más alto más cercano a la izquierda y a la
+    derecha de cada elemento (-1 si no existe)
+
+    Se revisa una ventana de vecinos (matriz k x ventana). Si el más alto a la
+    izquierda de p queda fuera de la ventana, todos los elementos entre ambos son
+    más bajos, así que ese vecino no tiene a nadie más alto en su propia ventana
+    derecha: el fallback solo compara contra esos, que son pocos.
+    """
+    k = heights.size
+    w = min(NEIGHBOR_WINDOW, k)
+    rows = np.arange(k)
+    pad = np.full(w, -np.inf)
+    padded = np.concatenate([pad, heights, pad])
+    steps = np.arange(1, w + 1)
+
+    left = padded[(rows + w)[:, None] - steps] > heights[:, None]
+    right = padded[(rows + w)[:, None] + steps] > heights[:, None]
+    left_found = left.any(axis=1)
+    right_found = right.any(axis=1)
+    left_near = np.where(left_found, rows - 1 - left.argmax(axis=1), -1)
+    right_near = np.where(right_found, rows + 1 + right.argmax(axis=1), -1)
+
+    pending = np.flatnonzero(~left_found & (rows > w))
+    if pending.size:
+        cand = np.flatnonzero(~right_found)
+        higher = (cand < pending[:, None]) & (heights[cand] > heights[pending][:, None])
+        left_near[pending] = np.where(higher, cand, -1).max(axis=1)
+
+    pending = np.flatnonzero(~right_found & (rows < k - 1 - w))
+    if pending.size:
+        cand = np.flatnonzero(~left_found)
+        higher = (cand > pending[:, None]) & (heights[cand] > heights[pending][:, None])
+        nearest = np.where(higher, cand, k).min(axis=1)
+        right_near[pending] = np.where(nearest < k, nearest, -1)
+
+    return left_near, right_near
+
+
+def _half_crossing(data, peaks, ref, bound, direction):
+    """
+    Posición sub-pixel del primer cruce por debajo de ref desde el pico hacia
+    bound (direction -1 izquierda, 1 derecha). Se revisa una ventana fija
+    alrededor de cada pico; solo las líneas más anchas se recorren aparte.
+    """
+    rows = np.arange(peaks.size)
+    idx = peaks[:, None] + np.arange(1, WIDTH_WINDOW + 1) * direction
+    if direction < 0:
+        idx = np.maximum(idx, bound[:, None])
+    else:
+        idx = np.minimum(idx, bound[:, None])
+
+    below = data[idx] <= ref[:, None]
+    first = below.argmax(axis=1)
+    cross = idx[rows, first]
+
+    # Sin cruce en la ventana: se llegó al borde o la línea es muy ancha
+    for i in np.flatnonzero(~below[rows, first]):
+        if direction < 0:
+            hits = np.flatnonzero(data[bound[i]:peaks[i]] <= ref[i])
+            cross[i] = bound[i] + hits[-1] if hits.size else bound[i]
+        else:
+            hits = np.flatnonzero(data[peaks[i] + 1:bound[i] + 1] <= ref[i])
+            cross[i] = peaks[i] + 1 + hits[0] if hits.size else bound[i]
+
+    # Interpolación lineal hacia el vecino del lado del pico
+    y0 = data[cross]
+    span = data[cross - direction] - y0
+    span[span == 0] = 1.0
+    return cross - ((ref - y0) / span).clip(0.0, 1.0) * direction
+
+
+def _parabolic_centroid(data, peaks):
+    """Centroide sub-pixel por ajuste parabólico de 3 puntos"""
+    # local_maxima nunca retorna los extremos del perfil
+    left = data[peaks - 1]
+    center = data[peaks]
+    right = data[peaks + 1]
+    denom = left - 2.0 * center + right
+    denom[denom == 0] = -1.0
+    return peaks + (0.5 * (left - right) / denom).clip(-0.5, 0.5)
@@ -0,0 +1,154 @@
+import os
+import time
+from collections import OrderedDict
+import numpy as np
+from spectral_decode import sum_rows
+
+# Factor para convertir MAD a desviación estándar de una gaussiana
+MAD_TO_SIGMA = 1.4826
+
+# Histéresis: una fila semilla debe superar el fondo en BAND_HIGH_SNR sigmas;
+# la banda crece mientras la energía supere el umbral bajo
+BAND_HIGH_SNR = float(os.environ.get('BAND_HIGH_SNR', '8.0'))
+BAND_LOW_SNR = float(os.environ.get('BAND_LOW_SNR', '3.0'))
+
+# El umbral bajo nunca es menor que esta fracción del contraste de la banda
+BAND_LOW_FRACTION = float(os.environ.get('BAND_LOW_FRACTION', '0.2'))
+
+# Margen agregado a cada lado de la banda (fracción de su alto)
+BAND_MARGIN = 0.1
+
+# Cada cuántos frames se vuelve a detectar la banda de un dispositivo (0 = nunca)
+BAND_REFRESH_FRAMES = int(os.environ.get('BAND_REFRESH_FRAMES', '50'))
+
+# Segundos que una banda cacheada sigue vigente (0 = sin vencimiento)
+BAND_CACHE_TTL = int(os.environ.get('BAND_CACHE_TTL', '3600'))
+
+# Columnas a las que se reduce el frame antes de medir la energía por fila
+ROW_ENERGY_COLUMNS = 128
+
+# Dispositivos recordados por contenedor
+BAND_CACHE_SIZE = 1024
+
+# Banda detectada por dispositivo, reutilizada en contenedores calientes
+# device_id -> {'size', 'band', 'frames', 'detectedAt'}
+_band_cache = OrderedDict()
+
+
+def row_energy(image):
+    """Energía media por fila (promedio de todas las columnas y canales)"""
+    # Promediar bloques de columnas en PIL conserva todas las filas y
+    # reduce el recorrido en numpy
+    factor = image.size[0] // ROW_ENERGY_COLUMNS
+    if factor >= 2 and image.mode in ('L', 'RGB', 'I', 'F'):
+        image = image.reduce((factor, 1))
+    width = image.size[0]
+    channels = len(image.getbands())
+    return sum_rows(image) / float(width * channels)
+
+
+def detect_band(energy):
+    """
+    Ubica las filas del espectro disperso en el perfil vertical de energía
+
+    - Suaviza el perfil con una media móvil para no cortar la banda por ruido
+    - Fondo y ruido por mediana y MAD (la banda ocupa menos de la mitad del frame)
+    - Histéresis: la fila más brillante debe superar el umbral alto; la banda
+      es el tramo contiguo alrededor de ella sobre el umbral bajo
+
+    Retorna (top, bottom) con bottom exclusivo, o None si no hay banda clara
+    """
+    energy = np.asarray(energy, dtype=np.float64)
+    height = energy.size
+    if height < 8:
+        return None
+
+    window = max(3, (height // 100) | 1)
+    kernel = np.ones(window)
+    # Promedio normalizado: en los bordes se promedian solo las filas existentes
+    smooth = (np.convolve(energy, kernel, mode='same') /
+              np.convolve(np.ones(height), kernel, mode='same'))
+
+    background = float(np.median(smooth))
+    sigma = MAD_TO_SIGMA * float(np.median(np.abs(smooth - background)))
+    sigma = max(sigma, abs(background) * 1e-6, 1e-9)
+
+    peak = int(np.argmax(smooth))
+    contrast = smooth[peak] - background
+    if contrast < BAND_HIGH_SNR * sigma:
+        return None
+
+    low = background + max(BAND_LOW_SNR * sigma, BAND_LOW_FRACTION * contrast)
+    outside = np.flatnonzero(smooth <= low)
+    pos = np.searchsorted(outside, peak)
+    top = int(outside[pos - 1]) + 1 if pos > 0 else 0
+    bottom = int(outside[pos]) if pos < outside.size else height
+
+    # Una banda más angosta que la ventana de suavizado es un artefacto
+    if bottom - top < window:
+        return None
+
+    # Margen para no recortar las alas de un espectro inclinado o desenfocado
+    margin = max(1, int((bottom - top) * BAND_MARGIN))
+    return max(0, top - margin), min(height, bottom + margin)
+
+
+def get_band(image, device_id=None):
+    """
+    Banda de filas del espectro para la imagen decodificada
+
+    Si el dispositivo tiene una banda cacheada para el mismo tamaño de imagen
+    se reutiliza sin recorrer el frame. Cada BAND_REFRESH_FRAMES frames (o al
+    vencer BAND_CACHE_TTL) se vuelve a detectar.
+
+    Retorna (band o None, info)
+    """
+    size = tuple(image.size)
+    now = time.time()
+    entry = _band_cache.get(device_id) if device_id else None
+
+    if entry and entry['size'] == size and not _stale(entry, now):
+        entry['frames'] += 1
+        _band_cache.move_to_end(device_id)
+        return entry['band'], _band_info(entry['band'], size, cached=True)
+
+    start = time.perf_counter()
+    band = detect_band(row_energy(image))
+    elapsed = round((time.perf_counter() - start) * 1000, 2)
+
+    if device_id:
+        _band_cache[device_id] = {'size': size, 'band': band, 'frames': 1, 'detectedAt': now}
+        _band_cache.move_to_end(device_id)
+        while len(_band_cache) > BAND_CACHE_SIZE:
+            _band_cache.popitem(last=False)
+
+    info = _band_info(band, size, cached=False)
+    info['detectMs'] = elapsed
+    return band, info
+
+
+def clear_band_cache(device_id=None):
+    """Olvida la banda de un dispositivo (o de todos), p. ej. tras mover la cámara"""
+    if device_id is None:
+        _band_cache.clear()
+    else:
+        _band_cache.pop(device_id, None)
+
+
+def _stale(entry, now):
+    """La banda cacheada debe volver a detectarse"""
+    if BAND_REFRESH_FRAMES and entry['frames'] >= BAND_REFRESH_FRAMES:
+        return True
+    return bool(BAND_CACHE_TTL) and now - entry['detectedAt'] > BAND_CACHE_TTL
+
+
+def _band_info(band, size, cached):
+    """Resumen de la banda para el resultado del análisis"""
+    top, bottom = band if band else (0, size[1])
+    return {
+        'top': top,
+        'bottom': bottom,
+        'rows': bottom - top,
+        'detected': band is not None,
+        'cached': cached
+    }
@@ -0,0 +1,279 @@
+import os
+import tempfile
+import numpy as np
+
+# Factor para convertir MAD a desviación estándar de una gaussiana
+MAD_TO_SIGMA = 1.4826
+
+# Fracción de frames (los de mejor puntaje) que entran al apilado
+STACK_KEEP_FRACTION = float(os.environ.get('STACK_KEEP_FRACTION', '0.7'))
+
+# Sigma clipping: rechazo a k sigmas (MAD) de la mediana y pasadas de recorte
+STACK_CLIP_SIGMA = float(os.environ.get('STACK_CLIP_SIGMA', '3.0'))
+STACK_CLIP_ITERATIONS = 2
+
+# Desplazamiento máximo (pixeles) buscado al registrar frames
+STACK_MAX_SHIFT = int(os.environ.get('STACK_MAX_SHIFT', '20'))
+
+# Ventana de la media móvil restada antes de correlacionar (deja solo las líneas)
+HIGHPASS_WINDOW = 15
+
+# Banda de frecuencias (ciclos/pixel) que mide la nitidez de las líneas y
+# frecuencia desde la que solo queda ruido
+SHARP_BAND = (0.05, 0.2)
+NOISE_FREQ = 0.3
+
+# Por debajo de esta frecuencia la potencia es del continuo, no de las líneas
+CONTINUUM_FREQ = 0.005
+
+# Perfiles procesados por bloque vectorizado
+STACK_BLOCK = 64
+
+# Bytes (n frames x columnas float64) de cada bloque de la mediana con sigma clipping
+STACK_CHUNK_BYTES = int(os.environ.get('STACK_CHUNK_BYTES', str(16 << 20)))
+
+# Directorio de los perfiles del burst (en Lambda, /tmp)
+STACK_SPOOL_DIR = os.environ.get('STACK_SPOOL_DIR', tempfile.gettempdir())
+
+METHODS = ('mean', 'sigma_clip')
+
+
+class ProfileStack:
+    """
+    Apilado de un burst de frames reducidos a perfiles horizontales
+
+    Cada perfil se escribe a un archivo temporal a medida que llega; la
+    memoria queda en O(un frame) sin importar el largo del burst.
+    combine() puntúa los frames, descarta los peores ("lucky imaging"),
+    los registra contra el mejor y los combina: media con acumuladores por
+    columna, o mediana con sigma clipping por bloques de columnas leídos de
+    un segundo archivo con los frames alineados.
+    """
+
+    def __init__(self, spool_dir=STACK_SPOOL_DIR):
+        self.width = None
+        self.count = 0
+        self._spool_dir = spool_dir
+        self._file = tempfile.TemporaryFile(dir=spool_dir)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, profile):
+        """Agrega el perfil de un frame; todos deben tener el mismo ancho"""
+        profile = np.asarray(profile, dtype=np.float32)
+        if self.width is None:
+            self.width = profile.size
+        elif profile.size != self.width:
+            raise ValueError(f"Frame de ancho {profile.size}, el burst es de {self.width}")
+        self._file.write(profile.tobytes())
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+    def scores(self):
+        """
+        Nitidez y SNR de cada frame, calculadas por bloques de perfiles
+
+        - snr: (máximo sin pixeles aislados - fondo) / ruido, con fondo y
+          ruido por mediana y MAD
+        - sharpness: fracción de la potencia de las líneas en frecuencias
+          altas (ver _sharpness); baja si las líneas se ensanchan
+        - score: producto de ambas relativo a la mediana del burst
+        """
+        snr = np.empty(self.count)
+        sharpness = np.empty(self.count)
+        for start, block in self._blocks():
+            rows = slice(start, start + block.shape[0])
+            floor = np.median(block, axis=1)
+            sigma = MAD_TO_SIGMA * np.median(np.abs(np.diff(block, axis=1)), axis=1) / np.sqrt(2.0)
+            sigma = np.maximum(sigma, 1e-6)
+            # Máximo sin pixeles aislados (rayos cósmicos, pixeles calientes)
+            snr[rows] = (_despike(block).max(axis=1) - floor) / sigma
+
+            sharpness[rows] = _sharpness(block)
+
+        score = _relative(snr) * _relative(sharpness)
+        return {'snr': snr, 'sharpness': sharpness, 'score': score}
+
+    def combine(self, method='sigma_clip', keep_fraction=STACK_KEEP_FRACTION):
+        """
+        Combina el burst en un perfil
+
+        1. Selección: entran los ceil(keep_fraction * n) frames de mejor puntaje
+        2. Registro: desplazamiento sub-pixel de cada frame respecto del mejor,
+           por correlación cruzada (FFT) de los perfiles sin continuo
+        3. Combinación: media (una pasada con acumuladores), o mediana con
+           sigma clipping por columna: STACK_CLIP_ITERATIONS pasadas que
+           descartan los valores a más de STACK_CLIP_SIGMA sigmas (MAD) de
+           la mediana, sobre bloques de columnas de los frames alineados
+
+        Retorna (perfil float64, info del apilado)
+        """
+        if self.count == 0:
+            raise ValueError("El burst no tiene frames")
+        if method not in METHODS:
+            raise ValueError(f"Método de apilado desconocido: {method}")
+
+        self._file.flush()
+        metrics = self.scores()
+        keep_count = max(1, int(np.ceil(keep_fraction * self.count)))
+        kept = np.sort(np.argsort(-metrics['score'], kind='stable')[:keep_count])
+        reference = int(kept[np.argmax(metrics['score'][kept])])
+
+        shifts = self._register(kept, reference)
+        clipped = 0
+        if method == 'sigma_clip' and kept.size > 2:
+            profile, clipped = self._clipped_median(kept, shifts)
+        else:
+            profile = self._mean(kept, shifts)
+
+        info = {
+            'frames': self.count,
+            'kept': kept.size,
+            'method': method,
+            'reference': reference,
+            'rejected': np.setdiff1d(np.arange(self.count), kept).tolist(),
+            'shifts': [round(float(s), 3) for s in shifts],
+            'clippedSamples': clipped,
+            'snr': [round(float(v), 1) for v in metrics['snr']],
+            'sharpness': [round(float(v), 4) for v in metrics['sharpness']],
+        }
+        return profile, info
+
+    def _rows(self):
+        """Perfiles del burst mapeados desde el archivo (sin cargarlos en memoria)"""
+        return np.memmap(self._file, dtype=np.float32, mode='r', shape=(self.count, self.width))
+
+    def _blocks(self, indices=None):
+        """Recorre los perfiles (o solo indices) en bloques de STACK_BLOCK filas"""
+        rows = self._rows()
+        if indices is None:
+            indices = np.arange(self.count)
+        for start in range(0, len(indices), STACK_BLOCK):
+            yield start, np.asarray(rows[indices[start:start + STACK_BLOCK]], dtype=np.float64)
+
+    def _register(self, kept, reference):
+        """Desplazamiento de cada frame elegido respecto del de referencia"""
+        ref = _highpass(_despike(np.asarray(self._rows()[reference:reference + 1], dtype=np.float64)))
+        size = 2 * self.width
+        ref_fft = np.conj(np.fft.rfft(ref, size))
+        max_shift = min(STACK_MAX_SHIFT, self.width // 4)
+        lags = np.arange(-max_shift, max_shift + 1)
+
+        shifts = np.empty(kept.size)
+        for start, block in self._blocks(kept):
+            corr = np.fft.irfft(np.fft.rfft(_highpass(_despike(block)), size) * ref_fft, size)
+            window = corr[:, lags % size]
+            best = np.clip(window.argmax(axis=1), 1, lags.size - 2)
+            rows = np.arange(block.shape[0])
+            left, center, right = (window[rows, best - 1], window[rows, best], window[rows, best + 1])
+            # Líneas gaussianas dan un pico de correlación gaussiano: ajuste
+            # parabólico sobre el logaritmo cuando los tres valores son positivos
+            positive = (left > 0) & (center > 0) & (right > 0)
+            left, center, right = (np.where(positive, np.log(np.where(positive, v, 1.0)), v)
+                                   for v in (left, center, right))
+            denom = left - 2.0 * center + right
+            denom[denom == 0] = -1.0
+            shifts[start:start + block.shape[0]] = lags[best] + (0.5 * (left - right) / denom).clip(-0.5, 0.5)
+        return shifts
+
+    def _aligned(self, kept, shifts):
+        """Frames elegidos desplazados según shifts, uno por vez"""
+        x = np.arange(self.width, dtype=np.float64)
+        for start, block in self._blocks(kept):
+            for i, row in enumerate(block):
+                yield np.interp(x + shifts[start + i], x, row)
+
+    def _mean(self, kept, shifts):
+        """Media por columna de los frames alineados, en una pasada"""
+        total = np.zeros(self.width)
+        for aligned in self._aligned(kept, shifts):
+            total += aligned
+        return total / kept.size
+
+    def _clipped_median(self, kept, shifts):
+        """
+        Mediana con sigma clipping por columna: los frames alineados se
+        escriben a un archivo y se leen por bloques de columnas
+        Retorna (perfil, valores descartados)
+        """
+        with tempfile.TemporaryFile(dir=self._spool_dir) as spool:
+            for aligned in self._aligned(kept, shifts):
+                spool.write(aligned.astype(np.float32).tobytes())
+            spool.flush()
+            frames = np.memmap(spool, dtype=np.float32, mode='r', shape=(kept.size, self.width))
+            profile = np.empty(self.width)
+            clipped = chunked_median(frames, profile, STACK_CHUNK_BYTES,
+                                     STACK_CLIP_SIGMA, STACK_CLIP_ITERATIONS)
+            del frames
+        return profile, clipped
+
+
+def chunked_median(frames, out, chunk_bytes, clip_sigma=None, iterations=0):
+    """
+    Mediana sobre el primer eje de frames (n x filas[ x ancho], p. ej. un
+    memmap) escrita en out, por bloques de filas de hasta chunk_bytes
+    Con clip_sigma, antes de la mediana final se descartan en iterations
+    pasadas los valores a más de clip_sigma sigmas (MAD) de la mediana
+    Retorna la cantidad de valores descartados
+    """
+    # El sigma clipping trabaja sobre una copia float64 del bloque
+    itemsize = 8 if clip_sigma is not None else frames.dtype.itemsize
+    slice_bytes = frames.shape[0] * int(np.prod(frames.shape[2:], dtype=np.int64)) * itemsize
+    chunk_rows = max(1, chunk_bytes // slice_bytes)
+    clipped = 0
+    for top in range(0, frames.shape[1], chunk_rows):
+        bottom = min(top + chunk_rows, frames.shape[1])
+        if clip_sigma is None:
+            np.median(frames[:, top:bottom], axis=0, out=out[top:bottom])
+            continue
+        block = np.array(frames[:, top:bottom], dtype=np.float64)
+        for _ in range(iterations):
+            center = np.nanmedian(block, axis=0)
+            deviation = np.abs(block - center)
+            sigma = MAD_TO_SIGMA * np.nanmedian(deviation, axis=0)
+            # Con clip_sigma >= 1 queda al menos la mitad de los valores de cada columna
+            block[deviation > clip_sigma * np.maximum(sigma, 1e-6)] = np.nan
+        clipped += int(np.isnan(block).sum())
+        out[top:bottom] = np.nanmedian(block, axis=0)
+    return clipped
+
+
+def _relative(values):
+    """Valores relativos a la mediana del burst (1 = frame típico)"""
+    median = float(np.median(values))
+    return values / median if median > 0 else np.ones_like(values)
+
+
+def _sharpness(block):
+    """
+    Fracción de la potencia espectral del perfil en la banda SHARP_BAND
+    respecto de toda la potencia entre CONTINUUM_FREQ y su límite superior.
+    Las líneas desenfocadas concentran su potencia en frecuencias bajas. El
+    ruido blanco se estima en las frecuencias más altas y se descuenta.
+    """
+    power = np.abs(np.fft.rfft(block - block.mean(axis=1, keepdims=True), axis=1)) ** 2
+    freq = np.fft.rfftfreq(block.shape[1])
+    noise = np.median(power[:, freq >= NOISE_FREQ], axis=1, keepdims=True)
+    signal = np.maximum(power - noise, 0.0)
+    high = signal[:, (freq >= SHARP_BAND[0]) & (freq < SHARP_BAND[1])].sum(axis=1)
+    total = signal[:, (freq >= CONTINUUM_FREQ) & (freq < SHARP_BAND[1])].sum(axis=1)
+    return high / np.maximum(total, 1e-12)
+
+
+def _despike(block):
+    """Mediana de 3 pixeles por fila: elimina picos de un solo pixel"""
+    padded = np.pad(block, ((0, 0), (1, 1)), mode='edge')
+    return np.median(np.stack([padded[:, :-2], padded[:, 1:-1], padded[:, 2:]]), axis=0)
+
+
+def _highpass(block):
+    """Resta la media móvil de cada perfil para correlacionar solo las líneas"""
+    window = min(HIGHPASS_WINDOW, block.shape[1])
+    padded = np.pad(block, ((0, 0), (window // 2, window - 1 - window // 2)), mode='edge')
+    cumsum = np.cumsum(padded, axis=1)
+    cumsum = np.pad(cumsum, ((0, 0), (1, 0)))
+    smooth = (cumsum[:, window:] - cumsum[:, :-window]) / window
+    return block - smooth
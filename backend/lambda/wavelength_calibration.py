@@ -0,0 +1,378 @@
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+import boto3
+import numpy as np
+from numpy.polynomial import polynomial as P
+from line_catalog import get_catalog
+
+# Tabla de modelos de calibración (deviceId -> polinomio pixel -> nm)
+CALIBRATIONS_TABLE = os.environ.get('CALIBRATIONS_TABLE')
+calibrations_table = boto3.resource('dynamodb').Table(CALIBRATIONS_TABLE) if CALIBRATIONS_TABLE else None
+
+# Rango asumido para dispositivos sin calibrar (espectro visible)
+DEFAULT_RANGE_NM = (400.0, 700.0)
+
+# Grado del polinomio de dispersión
+CALIBRATION_DEGREE = int(os.environ.get('CALIBRATION_DEGREE', '3'))
+
+# Lámparas de referencia por defecto (fluorescente de Hg, Ne, Ar)
+DEFAULT_LAMP = ('Hg', 'Ne', 'Ar')
+
+# Longitudes de onda que puede cubrir el sensor
+LAMP_SEARCH_RANGE_NM = (380.0, 760.0)
+
+# RANSAC: hipótesis lineales evaluadas y distancia (nm) para contar un inlier
+RANSAC_ITERATIONS = int(os.environ.get('RANSAC_ITERATIONS', '200000'))
+RANSAC_TOLERANCE_NM = float(os.environ.get('RANSAC_TOLERANCE_NM', '1.5'))
+
+# Hipótesis lineales que pasan al refinamiento polinomial
+RANSAC_CANDIDATES = 20
+
+# Hipótesis evaluadas por bloque (memoria acotada)
+RANSAC_BLOCK = 8192
+
+# Separación mínima (fracción del ancho) entre los 2 picos de una hipótesis
+MIN_PEAK_SPAN = 0.1
+
+# La dispersión ajustada puede diferir del rango por defecto hasta este factor
+DISPERSION_SLACK = 2.0
+
+# Picos más prominentes del frame de lámpara usados en el ajuste
+MAX_LAMP_PEAKS = 20
+MIN_MATCHES = 4
+
+# Residuo (nm) por debajo del cual un par nunca se descarta como atípico
+OUTLIER_FLOOR_NM = 0.2
+MAD_TO_SIGMA = 1.4826
+
+# Segundos que un modelo leído de DynamoDB se reutiliza antes de volver a leerlo
+CALIBRATION_CACHE_TTL = int(os.environ.get('CALIBRATION_CACHE_TTL', '300'))
+
+# Arrays de longitudes de onda precalculados por (dispositivo, versión, ancho)
+WAVELENGTH_CACHE_SIZE = 256
+
+# Cachés del contenedor caliente
+_models = {}
+_wavelength_cache = OrderedDict()
+
+
+def lamp_lines(elements=DEFAULT_LAMP, wavelength_range=LAMP_SEARCH_RANGE_NM):
+    """Longitudes de onda de referencia (ordenadas) de los elementos de la lámpara"""
+    catalog = get_catalog()
+    mask = np.isin(catalog.elements, list(elements))
+    mask &= (catalog.wavelengths >= wavelength_range[0]) & (catalog.wavelengths <= wavelength_range[1])
+    return np.unique(catalog.wavelengths[mask])
+
+
+def fit_calibration(positions, prominences, width, reference, degree=CALIBRATION_DEGREE, seed=0):
+    """
+    Ajusta el polinomio pixel -> longitud de onda a partir de los picos de una lámpara
+
+    1. RANSAC: cada hipótesis empareja 2 picos con 2 líneas de referencia
+       (modelo lineal); se evalúan todas a la vez
+    2. Refinamiento de las RANSAC_CANDIDATES mejores: se ajusta el polinomio a
+       los pares emparejados y se vuelve a emparejar hasta que no cambien.
+       Gana el modelo con más líneas emparejadas (y menor rms)
+
+    El polinomio se expresa en x = pixel / (ancho - 1), así sirve para
+    cualquier ancho decodificado del mismo sensor.
+
+    Retorna dict con coefficients, degree, rmsNm, matches
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    prominences = np.asarray(prominences, dtype=np.float64)
+    reference = np.sort(np.asarray(reference, dtype=np.float64))
+    if positions.size < MIN_MATCHES or reference.size < MIN_MATCHES:
+        raise ValueError(
+            f"Calibración insuficiente: {positions.size} picos y {reference.size} líneas de referencia"
+        )
+
+    # RANSAC solo con los picos más prominentes; el refinamiento usa todos
+    order = np.argsort(positions, kind='stable')
+    positions, prominences = positions[order], prominences[order]
+    x = positions / float(max(width - 1, 1))
+    strongest = np.sort(np.argsort(-prominences, kind='stable')[:MAX_LAMP_PEAKS])
+
+    # Las mejores hipótesis lineales se refinan todas: con dispersión curva
+    # la correcta no siempre es la de más inliers en el modelo lineal
+    best = None
+    for coefficients in _ransac_linear(x[strongest], reference, seed):
+        refined = _refine(x, reference, coefficients, degree)
+        if refined and (best is None or _better(refined, best)):
+            best = refined
+
+    if best is None:
+        raise ValueError(f"Calibración insuficiente: menos de {MIN_MATCHES} líneas emparejadas")
+
+    coefficients, matched, rms = best
+    peak_idx, ref_idx = matched
+    fitted = P.polyval(x[peak_idx], coefficients)
+    return {
+        'coefficients': [float(c) for c in coefficients],
+        'degree': len(coefficients) - 1,
+        'rmsNm': round(rms, 4),
+        'matches': [
+            {
+                'pixel': round(float(positions[i]), 2),
+                'wavelength': round(float(w), 3),
+                'reference': round(float(reference[r]), 3)
+            }
+            for i, r, w in zip(peak_idx.tolist(), ref_idx.tolist(), fitted.tolist())
+        ]
+    }
+
+
+def wavelength_array(coefficients, n):
+    """Longitud de onda de cada columna de un perfil de n pixeles"""
+    return P.polyval(np.linspace(0.0, 1.0, n), np.asarray(coefficients, dtype=np.float64))
+
+
+def get_wavelengths(device_id, n):
+    """
+    Longitudes de onda para un perfil de n columnas del dispositivo
+
+    El modelo se lee de DynamoDB una vez por contenedor (se relee tras
+    CALIBRATION_CACHE_TTL) y el array se calcula una vez por ancho.
+    Sin modelo se usa el rango lineal por defecto.
+
+    Retorna (array de solo lectura, info de calibración)
+    """
+    model = get_calibration(device_id) if device_id else None
+    if model:
+        key = (device_id, model['version'], n)
+        info = {'calibrated': True, 'version': model['version'],
+                'degree': model['degree'], 'rmsNm': model['rmsNm']}
+    else:
+        key = (None, 0, n)
+        info = {'calibrated': False, 'version': 0}
+
+    wavelengths = _wavelength_cache.get(key)
+    if wavelengths is None:
+        if model:
+            wavelengths = wavelength_array(model['coefficients'], n)
+        else:
+            wavelengths = np.linspace(DEFAULT_RANGE_NM[0], DEFAULT_RANGE_NM[1], n)
+        wavelengths.flags.writeable = False
+        _wavelength_cache[key] = wavelengths
+        while len(_wavelength_cache) > WAVELENGTH_CACHE_SIZE:
+            _wavelength_cache.popitem(last=False)
+    else:
+        _wavelength_cache.move_to_end(key)
+    return wavelengths, info
+
+
+def get_calibration(device_id):
+    """Modelo vigente del dispositivo (None si no tiene), cacheado por contenedor"""
+    cached = _models.get(device_id)
+    if cached and time.time() - cached[1] < CALIBRATION_CACHE_TTL:
+        return cached[0]
+
+    model = load_calibration(device_id)
+    _models[device_id] = (model, time.time())
+    return model
+
+
+def load_calibration(device_id):
+    """Lee el modelo del dispositivo desde DynamoDB"""
+    if calibrations_table is None:
+        return None
+    try:
+        item = calibrations_table.get_item(Key={'deviceId': device_id}).get('Item')
+    except Exception as e:
+        print(f"⚠️ No se pudo leer la calibración de {device_id}: {e}")
+        return None
+    if not item:
+        return None
+    return {
+        'deviceId': item['deviceId'],
+        'version': int(item['version']),
+        'coefficients': [float(c) for c in item['coefficients']],
+        'degree': int(item['degree']),
+        'rmsNm': float(item['rmsNm'])
+    }
+
+
+def save_calibration(device_id, model, lamp=DEFAULT_LAMP, width=None):
+    """Guarda el modelo del dispositivo (reemplaza al anterior) y actualiza la caché local"""
+    if calibrations_table is None:
+        raise ValueError("CALIBRATIONS_TABLE no está configurada")
+
+    version = int(time.time() * 1000)
+    item = {
+        'deviceId': device_id,
+        'version': version,
+        'coefficients': [Decimal(repr(c)) for c in model['coefficients']],
+        'degree': model['degree'],
+        'rmsNm': Decimal(str(model['rmsNm'])),
+        'lamp': list(lamp),
+        'matches': [{k: Decimal(str(v)) for k, v in m.items()} for m in model['matches']],
+        'createdAt': datetime.utcnow().isoformat()
+    }
+    if width:
+        item['width'] = width
+    calibrations_table.put_item(Item=item)
+
+    _models[device_id] = ({
+        'deviceId': device_id,
+        'version': version,
+        'coefficients': list(model['coefficients']),
+        'degree': model['degree'],
+        'rmsNm': model['rmsNm']
+    }, time.time())
+    return version
+
+
+def _ransac_linear(x, reference, seed):
+    """
+    Mejores modelos lineales (coeficientes en x normalizado) de hipótesis
+    de 2 picos y 2 líneas, evaluadas en bloques
+
+    Solo se generan pares de líneas cuya separación da una dispersión
+    plausible para el par de picos; si hay más de RANSAC_ITERATIONS se
+    muestrean al azar
+    """
+    slope, intercept = _hypotheses(x, reference)
+    if slope.size > RANSAC_ITERATIONS:
+        pick = np.random.default_rng(seed).choice(slope.size, RANSAC_ITERATIONS, replace=False)
+        slope, intercept = slope[pick], intercept[pick]
+
+    count = np.empty(slope.size, dtype=np.intp)
+    cost = np.empty(slope.size)
+    for start in range(0, slope.size, RANSAC_BLOCK):
+        block = slice(start, start + RANSAC_BLOCK)
+        predicted = intercept[block, None] + slope[block, None] * x[None, :]
+        distance = _nearest_distance(predicted, reference)
+        inliers = distance < RANSAC_TOLERANCE_NM
+        count[block] = inliers.sum(axis=1)
+        cost[block] = np.where(inliers, distance, 0.0).sum(axis=1)
+
+    # Más inliers primero; a igualdad, menor error acumulado
+    ranked = np.lexsort((cost, -count))
+    ranked = ranked[count[ranked] >= MIN_MATCHES][:RANSAC_CANDIDATES]
+    return [np.array([intercept[i], slope[i]]) for i in ranked]
+
+
+def _hypotheses(x, reference):
+    """
+    Todas las hipótesis lineales (pendiente, ordenada) de 2 picos y 2 líneas
+    con dispersión dentro de DISPERSION_SLACK del rango por defecto, en
+    ambos sentidos de dispersión
+    """
+    i, j = np.triu_indices(x.size, 1)
+    span = x[j] - x[i]
+    wide = span >= MIN_PEAK_SPAN
+    i, j, span = i[wide], j[wide], span[wide]
+
+    a, b = np.triu_indices(reference.size, 1)
+    gap = reference[b] - reference[a]
+    order = np.argsort(gap, kind='stable')
+    a, b, gap = a[order], b[order], gap[order]
+
+    # Pares de líneas con separación compatible con cada par de picos
+    nominal = DEFAULT_RANGE_NM[1] - DEFAULT_RANGE_NM[0]
+    lo = np.searchsorted(gap, span * nominal / DISPERSION_SLACK, side='left')
+    hi = np.searchsorted(gap, span * nominal * DISPERSION_SLACK, side='right')
+    counts = hi - lo
+    peak_pair = np.repeat(np.arange(i.size), counts)
+    line_pair = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+
+    pi, pj = i[peak_pair], j[peak_pair]
+    la, lb = a[line_pair], b[line_pair]
+    slope = gap[line_pair] / span[peak_pair]
+
+    # Dispersión creciente (a->i, b->j) y decreciente (b->i, a->j)
+    intercept = np.concatenate([reference[la] - slope * x[pi], reference[lb] + slope * x[pi]])
+    return np.concatenate([slope, -slope]), intercept
+
+
+def _nearest_distance(predicted, reference):
+    """Distancia de cada predicción a la línea de referencia más cercana"""
+    pos = np.searchsorted(reference, predicted)
+    left = reference[np.clip(pos - 1, 0, reference.size - 1)]
+    right = reference[np.clip(pos, 0, reference.size - 1)]
+    return np.minimum(np.abs(predicted - left), np.abs(right - predicted))
+
+
+def _match(predicted, reference):
+    """
+    Empareja cada pico con la línea más cercana dentro de la tolerancia
+    Cada línea se asigna a un solo pico (el más cercano)
+    Retorna (índices de pico, índices de línea)
+    """
+    pos = np.searchsorted(reference, predicted)
+    left = np.clip(pos - 1, 0, reference.size - 1)
+    right = np.clip(pos, 0, reference.size - 1)
+    use_right = np.abs(reference[right] - predicted) < np.abs(predicted - reference[left])
+    nearest = np.where(use_right, right, left)
+    distance = np.abs(reference[nearest] - predicted)
+
+    peaks = np.flatnonzero(distance < RANSAC_TOLERANCE_NM)
+    lines = nearest[peaks]
+    # Línea repetida: queda el pico más cercano
+    order = np.lexsort((distance[peaks], lines))
+    first = np.r_[True, lines[order][1:] != lines[order][:-1]]
+    keep = np.sort(order[first])
+    return peaks[keep], lines[keep]
+
+
+def _refine(x, reference, coefficients, degree):
+    """
+    Refina una hipótesis lineal hasta el grado pedido
+    El grado sube de a uno por iteración: un polinomio alto desde el
+    principio absorbe los emparejamientos erróneos de los extremos
+    Retorna (coeficientes, (picos, líneas), rms) o None
+    """
+    matched, fitted = None, 0
+    for iteration in range(10):
+        deg = min(degree, iteration + 1)
+        pairs = _match(P.polyval(x, coefficients), reference)
+        if pairs[0].size < MIN_MATCHES:
+            break
+        # Convergió: mismo emparejamiento con el polinomio del grado final
+        if fitted == degree and _same_pairs(pairs, matched):
+            break
+        coefficients = _fit_monotonic(x[pairs[0]], reference[pairs[1]], deg)
+        pairs = _reject_outliers(x, reference, pairs, coefficients)
+        if pairs[0].size < MIN_MATCHES:
+            break
+        matched = pairs
+        coefficients = _fit_monotonic(x[pairs[0]], reference[pairs[1]], deg)
+        fitted = deg
+
+    if matched is None:
+        return None
+    residuals = reference[matched[1]] - P.polyval(x[matched[0]], coefficients)
+    return coefficients, matched, float(np.sqrt(np.mean(residuals ** 2)))
+
+
+def _better(a, b):
+    """Más líneas emparejadas gana; a igualdad, menor rms"""
+    return (a[1][0].size, -a[2]) > (b[1][0].size, -b[2])
+
+
+def _same_pairs(a, b):
+    """Los dos emparejamientos son idénticos"""
+    return np.array_equal(a[0], b[0]) and np.array_equal(a[1], b[1])
+
+
+def _reject_outliers(x, reference, pairs, coefficients):
+    """Descarta pares con residuo mayor a 3 sigmas robustas (emparejamientos ambiguos)"""
+    peaks, lines = pairs
+    residuals = np.abs(reference[lines] - P.polyval(x[peaks], coefficients))
+    limit = max(3.0 * MAD_TO_SIGMA * float(np.median(residuals)), OUTLIER_FLOOR_NM)
+    keep = residuals <= limit
+    return peaks[keep], lines[keep]
+
+
+def _fit_monotonic(x, y, degree):
+    """Ajuste polinomial del mayor grado posible que sea monótono en [0, 1]"""
+    grid = np.linspace(0.0, 1.0, 256)
+    for deg in range(min(degree, x.size - 2), 0, -1):
+        coefficients = P.polyfit(x, y, deg)
+        slope = P.polyval(grid, P.polyder(coefficients))
+        if np.all(slope > 0) or np.all(slope < 0):
+            return coefficients
+    return P.polyfit(x, y, 1)
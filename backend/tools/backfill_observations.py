@@ -0,0 +1,306 @@
+"""
+Reprocesa observaciones analizadas con una versión anterior del algoritmo
+
+Recorre ObservationsTable con scans segmentados en paralelo (un hilo por
+segmento), reanaliza cada imagen (imageS3Key o burstS3Keys) en un pool de
+procesos y actualiza spectralData solo si la versión guardada sigue siendo
+menor que ALGORITHM_VERSION (escritura condicional: nunca pisa un resultado
+más nuevo del procesamiento en vivo). Las escrituras pasan por un
+presupuesto de escrituras por segundo. El avance de cada segmento se guarda
+tras cada página en un checkpoint JSON; al relanzar se retoma desde ahí.
+
+Uso:
+  python backfill_observations.py --table orions-eye-observations-dev \\
+      --bucket orions-eye-images-dev --segments 8 --workers 4 --write-budget 25
+
+  # Contra el sustituto local (tools/local_aws.py), con 200 observaciones sintéticas
+  python backfill_observations.py --local /tmp/orions-local --seed 200
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda', 'shared'))
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+from local_aws import LocalS3, LocalTable
+
+# Items leídos por página de scan (y por checkpoint)
+PAGE_SIZE = 100
+
+# Atributos que necesita el reanálisis
+PROJECTION = 'observationId, deviceId, imageS3Key, burstS3Keys, exposure, algorithmVersion'
+
+LOCAL_BUCKET = 'local-images'
+
+
+class WriteBudget:
+    """Token bucket compartido entre hilos: a lo sumo `rate` escrituras por segundo"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.waited += wait
+        if wait:
+            time.sleep(wait)
+
+
+class Checkpoint:
+    """
+    Avance por segmento ({lastKey, done}) guardado en un archivo JSON
+    Un checkpoint de otra versión del algoritmo o de otra cantidad de
+    segmentos no se reutiliza
+    """
+
+    def __init__(self, path, segments, algorithm_version, reset=False):
+        self.path = path
+        self._lock = threading.Lock()
+        state = None
+        if path and os.path.exists(path) and not reset:
+            with open(path) as f:
+                state = json.load(f)
+            if state.get('algorithmVersion') != algorithm_version or state.get('segments') != segments:
+                print(f"⚠️ Checkpoint de otra corrida ({path}): se empieza de cero")
+                state = None
+        self.state = state or {
+            'algorithmVersion': algorithm_version,
+            'segments': segments,
+            'progress': {str(i): {'lastKey': None, 'done': False} for i in range(segments)}
+        }
+
+    def segment(self, index):
+        return self.state['progress'][str(index)]
+
+    def update(self, index, last_key, done):
+        with self._lock:
+            self.state['progress'][str(index)] = {'lastKey': last_key, 'done': done}
+            if not self.path:
+                return
+            partial = f"{self.path}.part"
+            with open(partial, 'w') as f:
+                json.dump(self.state, f, default=str)
+            os.replace(partial, self.path)
+
+
+# ==================== PROCESO DE TRABAJO ====================
+
+_worker = {}
+
+
+def _init_worker(local_root, bucket):
+    """Importa el análisis una vez por proceso y apunta S3 al sustituto local si corresponde"""
+    os.environ.setdefault('S3_BUCKET', bucket)
+    os.environ.setdefault('OBSERVATIONS_TABLE', 'unused')
+    os.environ.setdefault('DEVICES_TABLE', 'unused')
+    # Los clientes de boto3 se crean al importar y necesitan región
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+    import process_spectral_image as psi
+    import detector_calibration
+
+    if local_root:
+        psi.s3_client = detector_calibration.s3_client = LocalS3(local_root)
+    psi.S3_BUCKET = detector_calibration.S3_BUCKET = bucket
+    _worker['psi'] = psi
+
+
+def reprocess(task):
+    """
+    Reanaliza una observación
+    Retorna (observationId, spectralData empaquetado o None, error o None)
+    """
+    psi = _worker['psi']
+    observation_id = task['observationId']
+    device_id = task.get('deviceId')
+    try:
+        if task.get('burstS3Keys'):
+            spectral_data = psi.analyze_burst(task['burstS3Keys'], device_id, exposure=task.get('exposure'))
+        else:
+            response = psi.s3_client.get_object(Bucket=psi.S3_BUCKET, Key=task['imageS3Key'])
+            image = psi.open_image(response['Body'].read())
+            spectral_data = psi.analyze_spectrum(image, device_id, task.get('exposure'))
+        if spectral_data.get('error'):
+            return observation_id, None, spectral_data['error']
+
+        stored_data, spectrum_npy = psi.pack_spectral_data(spectral_data)
+        if spectrum_npy:
+            stored_data['spectrumS3Key'] = psi.store_spectrum(psi.s3_client, psi.S3_BUCKET, spectrum_npy)
+        return observation_id, psi.convert_floats_to_decimals(stored_data), None
+    except Exception as e:
+        return observation_id, None, str(e)
+
+
+# ==================== COORDINADOR ====================
+
+def run_backfill(table, bucket, algorithm_version, segments=4, workers=None, write_budget=0,
+                 checkpoint_path=None, local_root=None, reset=False, persist=None):
+    """
+    Ejecuta el backfill y retorna las estadísticas
+    persist: función llamada antes de cada checkpoint (el sustituto local
+    guarda la tabla ahí para que tabla y checkpoint queden consistentes)
+    """
+    checkpoint = Checkpoint(checkpoint_path, segments, algorithm_version, reset)
+    budget = WriteBudget(write_budget)
+    stale = Attr('algorithmVersion').not_exists() | Attr('algorithmVersion').lt(algorithm_version)
+    stats = {'scanned': 0, 'candidates': 0, 'updated': 0, 'skipped': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def count(**values):
+        with lock:
+            for name, value in values.items():
+                stats[name] += value
+
+    def scan_segment(index, pool):
+        progress = checkpoint.segment(index)
+        last_key = progress['lastKey']
+        while not progress['done']:
+            kwargs = {'Segment': index, 'TotalSegments': segments, 'Limit': PAGE_SIZE,
+                      'FilterExpression': stale, 'ProjectionExpression': PROJECTION}
+            if last_key:
+                kwargs['ExclusiveStartKey'] = last_key
+            page = table.scan(**kwargs)
+            tasks = [item for item in page['Items'] if item.get('imageS3Key') or item.get('burstS3Keys')]
+            count(scanned=page['ScannedCount'], candidates=len(tasks))
+
+            for future in [pool.submit(reprocess, task) for task in tasks]:
+                observation_id, stored_data, error = future.result()
+                if error:
+                    print(f"❌ {observation_id}: {error}")
+                    count(errors=1)
+                    continue
+                budget.acquire()
+                try:
+                    table.update_item(
+                        Key={'observationId': observation_id},
+                        UpdateExpression='SET spectralData = :data, algorithmVersion = :version, reprocessedAt = :at',
+                        ConditionExpression=stale,
+                        ExpressionAttributeValues={
+                            ':data': stored_data,
+                            ':version': algorithm_version,
+                            ':at': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime())
+                        }
+                    )
+                    count(updated=1)
+                except ClientError as e:
+                    if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                        raise
+                    # El procesamiento en vivo ya lo actualizó
+                    count(skipped=1)
+
+            last_key = page.get('LastEvaluatedKey')
+            progress = {'lastKey': last_key, 'done': last_key is None}
+            if persist:
+                persist()
+            checkpoint.update(index, last_key, progress['done'])
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(local_root, bucket)) as pool, \
+            ThreadPoolExecutor(segments) as threads:
+        futures = [threads.submit(scan_segment, i, pool) for i in range(segments)]
+        for future in futures:
+            future.result()
+
+    elapsed = time.perf_counter() - start
+    stats.update({
+        'seconds': round(elapsed, 2),
+        'observationsPerSecond': round(stats['updated'] / elapsed, 2) if elapsed else 0.0,
+        'scannedPerSecond': round(stats['scanned'] / elapsed, 2) if elapsed else 0.0,
+        'throttledSeconds': round(budget.waited, 2),
+        'algorithmVersion': algorithm_version
+    })
+    return stats
+
+
+def seed_local(table, s3, bucket, count, devices=4, size=(640, 480)):
+    """Observaciones sintéticas (algorithmVersion 0) con frames JPEG de un espectro"""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    width, height = size
+    x = np.arange(width)
+    rows = np.zeros(height)
+    rows[height // 3:height // 3 + height // 8] = 1.0
+    for i in range(count):
+        device_id = f"local-{i % devices}"
+        profile = 10.0 + sum(amp * np.exp(-0.5 * ((x - center) / 2.0) ** 2)
+                             for center, amp in ((0.3 * width, 120), (0.55 * width, 80), (0.8 * width, 40)))
+        frame = np.clip(5 + profile[None, :] * rows[:, None] + rng.normal(0, 6, (height, width)), 0, 255)
+        buffer = io.BytesIO()
+        Image.fromarray(frame.astype(np.uint8)).save(buffer, 'JPEG', quality=85)
+
+        observation_id = f"obs_{device_id}_seed{i:06d}"
+        key = f"observations/{device_id}/{observation_id}.jpg"
+        s3.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+        table.put_item(Item={
+            'observationId': observation_id,
+            'deviceId': device_id,
+            'userId': 'local',
+            'imageS3Key': key,
+            'spectralData': {},
+            'algorithmVersion': 0,
+            'status': 'processed'
+        })
+    print(f"🌱 {count} observaciones sintéticas en {table.path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reprocesa observaciones con una versión anterior del algoritmo')
+    parser.add_argument('--table', default=os.environ.get('OBSERVATIONS_TABLE'))
+    parser.add_argument('--bucket', default=os.environ.get('S3_BUCKET'))
+    parser.add_argument('--segments', type=int, default=4, help='segmentos de scan en paralelo')
+    parser.add_argument('--workers', type=int, default=None, help='procesos de análisis (por defecto, CPUs)')
+    parser.add_argument('--write-budget', type=float, default=0, help='escrituras por segundo (0 = sin límite)')
+    parser.add_argument('--checkpoint', default='backfill_checkpoint.json')
+    parser.add_argument('--reset', action='store_true', help='ignora el checkpoint existente')
+    parser.add_argument('--local', metavar='DIR', help='usa el sustituto local de DynamoDB/S3 en DIR')
+    parser.add_argument('--seed', type=int, default=0, help='(con --local) crea N observaciones sintéticas')
+    args = parser.parse_args()
+
+    persist = None
+    if args.local:
+        bucket = args.bucket or LOCAL_BUCKET
+        table = LocalTable(os.path.join(args.local, 'observations.pickle'), 'observationId')
+        if args.seed:
+            seed_local(table, LocalS3(args.local), bucket, args.seed)
+            table.save()
+        persist = table.save
+    else:
+        if not args.table or not args.bucket:
+            parser.error('se requieren --table y --bucket (o --local)')
+        import boto3
+        bucket = args.bucket
+        table = boto3.resource('dynamodb').Table(args.table)
+
+    _init_worker(args.local, bucket)
+    version = _worker['psi'].ALGORITHM_VERSION
+    print(f"🔁 Backfill a algorithmVersion {version}: {args.segments} segmentos, "
+          f"{args.workers or os.cpu_count()} procesos, presupuesto {args.write_budget or 'ilimitado'} escrituras/s")
+
+    stats = run_backfill(table, bucket, version, segments=args.segments, workers=args.workers,
+                         write_budget=args.write_budget, checkpoint_path=args.checkpoint,
+                         local_root=args.local, reset=args.reset, persist=persist)
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Benchmark de los mensajes MQTT de los dispositivos: JSON + base64 contra MessagePack
+
+Para cada mensaje (una imagen completa por tamaño de frame, una parte de
+64 KB del topic chunk, un status y un data) compara:
+
+  bytes       tamaño del mensaje MQTT (lo que sube el ESP32 y cobra IoT Core)
+  encodeMs    codificarlo (json.dumps + base64 contra msgpack.packb; en el
+              dispositivo lo hace ArduinoJson, aquí es solo una referencia)
+  parseMs     leerlo hasta tener los bytes de la imagen: json.loads + base64
+              contra msgpack.unpackb (bin sin base64)
+  handlerMs   lo que hace el IoT handler con el evento de la regla:
+              json   el evento ya leído (SELECT *) + base64 de imageData
+              json+rule / msgpack+rule   device_payload.decode_event sobre
+                     el payload crudo que entrega SELECT encode(*, 'base64')
+              (incluye json.loads del evento, que en Lambda hace el runtime)
+
+y cuántas partes necesita cada imagen con el límite de 128 KB por mensaje.
+
+Uso:
+  python benchmark_payload.py
+  python benchmark_payload.py --sizes QVGA,SVGA,UXGA --repeat 50 --output payload.json
+"""
+import argparse
+import base64
+import json
+import math
+import os
+import statistics
+import sys
+import time
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda')
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'shared'))
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'iot_rule_handler'))
+
+import msgpack
+
+from device_payload import decode_event, binary_field
+from frame_simulator import FRAME_SIZES, device_profile, render_frame
+
+# Límite de un mensaje MQTT en IoT Core y margen para los demás campos de la parte
+MQTT_MAX_BYTES = 128 * 1024
+CHUNK_OVERHEAD = 256
+CHUNK_BYTES = 64 * 1024
+
+
+def messages(sizes):
+    """Mensajes de prueba (campos binarios como bytes)"""
+    result = {}
+    for size in sizes:
+        data, _ = render_frame(device_profile('bench', FRAME_SIZES[size], 'hg', seed=0), 'jpeg', seed=0)
+        result[f'image-{size}'] = {'imageData': data, 'contentType': 'image/jpeg', 'exposure': 100,
+                                   'userId': 'user-bench', 'timestamp': '2026-01-01T00:00:00'}
+    result['chunk-64KB'] = {'transferId': 'a1b2c3d4', 'seq': 0, 'total': 4, 'crc': 3735928559,
+                            'data': os.urandom(CHUNK_BYTES)}
+    result['status'] = {'status': 'online', 'rssi': -61, 'battery': 3.92, 'timestamp': '2026-01-01T00:00:00'}
+    result['data'] = {'temperature': 22.41, 'humidity': 48.5, 'timestamp': '2026-01-01T00:00:00'}
+    return result
+
+
+def as_json(message):
+    return json.dumps({
+        name: base64.b64encode(value).decode() if isinstance(value, bytes) else value
+        for name, value in message.items()
+    }).encode()
+
+
+def as_msgpack(message):
+    return msgpack.packb(message)
+
+
+def _median_ms(run, repeat):
+    run()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(times), 4)
+
+
+def _binary(message):
+    return [binary_field(message[field]) for field in ('imageData', 'data') if field in message]
+
+
+def run_benchmark(sizes, repeat):
+    results = []
+    for name, message in messages(sizes).items():
+        raw_json, raw_msgpack = as_json(message), as_msgpack(message)
+        topic = f"orionseye/bench/{name.split('-')[0]}"
+        # Eventos que recibe el handler: el JSON ya leído y el payload crudo en base64
+        event_json = json.dumps(dict(json.loads(raw_json), topic=topic))
+        event_rule_json = json.dumps({'payload': base64.b64encode(raw_json).decode(), 'topic': topic})
+        event_rule_msgpack = json.dumps({'payload': base64.b64encode(raw_msgpack).decode(), 'topic': topic})
+        assert _binary(decode_event(json.loads(event_rule_msgpack))) == _binary(json.loads(event_json))
+
+        row = {
+            'message': name,
+            'jsonBytes': len(raw_json),
+            'msgpackBytes': len(raw_msgpack),
+            'saved': round(1 - len(raw_msgpack) / len(raw_json), 3),
+            'jsonEncodeMs': _median_ms(lambda: as_json(message), repeat),
+            'msgpackEncodeMs': _median_ms(lambda: as_msgpack(message), repeat),
+            'jsonParseMs': _median_ms(lambda: _binary(json.loads(raw_json)), repeat),
+            'msgpackParseMs': _median_ms(lambda: _binary(msgpack.unpackb(raw_msgpack)), repeat),
+            'handlerMs': {
+                'json': _median_ms(lambda: _binary(decode_event(json.loads(event_json))), repeat),
+                'json+rule': _median_ms(lambda: _binary(decode_event(json.loads(event_rule_json))), repeat),
+                'msgpack+rule': _median_ms(lambda: _binary(decode_event(json.loads(event_rule_msgpack))), repeat),
+            },
+        }
+        binary = sum(len(b) for b in _binary(message))
+        if name.startswith('image'):
+            # Partes por imagen: bytes crudos por mensaje con cada formato
+            per_json = (MQTT_MAX_BYTES - CHUNK_OVERHEAD) * 3 // 4
+            per_msgpack = MQTT_MAX_BYTES - CHUNK_OVERHEAD
+            row['chunksJson'] = math.ceil(binary / per_json)
+            row['chunksMsgpack'] = math.ceil(binary / per_msgpack)
+        results.append(row)
+        print(f"{name:<12} {row['jsonBytes']:>9} B -> {row['msgpackBytes']:>9} B ({row['saved']:.0%})  "
+              f"parse {row['jsonParseMs']:8.3f} -> {row['msgpackParseMs']:8.3f} ms  "
+              f"handler {row['handlerMs']['json']:8.3f} / {row['handlerMs']['json+rule']:8.3f} / "
+              f"{row['handlerMs']['msgpack+rule']:8.3f} ms"
+              + (f"  partes {row['chunksJson']} -> {row['chunksMsgpack']}" if 'chunksJson' in row else ''))
+    return {'repeat': repeat, 'messages': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mensajes MQTT: JSON + base64 contra MessagePack')
+    parser.add_argument('--sizes', default='VGA,SVGA,UXGA', help='tamaños de frame de las imágenes')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help='guarda los resultados en este JSON')
+    args = parser.parse_args()
+
+    report = run_benchmark(args.sizes.split(','), args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Resultados en {args.output}")
+
+
+if __name__ == '__main__':
+    main()
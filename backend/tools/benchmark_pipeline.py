@@ -0,0 +1,309 @@
+"""
+Benchmark del análisis espectral en todos los tamaños de frame del ESP32-CAM
+
+Genera frames sintéticos de un espectro (QQVGA a UXGA) en JPEG color y en
+gris de 8 bits (PIXFORMAT_GRAYSCALE, enviado como PNG sin pérdida) y mide
+cada etapa del pipeline de process_spectral_image:
+
+  open, decode, band, profile, find_peaks, identify_element,
+  analyze_profile, pack_spectral_data, convert_floats_to_decimals,
+  serialize_item, analyze_spectrum (la suma de punta a punta)
+
+Por etapa se reporta la mediana de tiempo de reloj y de CPU (en ms), el pico de
+tracemalloc y el pico de RSS con su crecimiento sobre el RSS previo a la etapa
+(en Linux el pico se reinicia por etapa con /proc/self/clear_refs; en otros
+sistemas es el máximo del proceso).
+La memoria se mide en una corrida aparte para no afectar los tiempos.
+
+Uso:
+  python benchmark_pipeline.py --output bench.json
+  python benchmark_pipeline.py --sizes QVGA,UXGA --save-baseline baseline.json
+  python benchmark_pipeline.py --baseline baseline.json --threshold 15
+    (sale con código 1 si alguna etapa es más de 15% más lenta que la línea base)
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda', 'shared'))
+for _name in ('OBSERVATIONS_TABLE', 'DEVICES_TABLE', 'S3_BUCKET'):
+    os.environ.setdefault(_name, 'benchmark')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+
+import numpy as np
+from PIL import Image
+
+import process_spectral_image as psi
+from spectral_decode import open_image, decode_image, column_profile
+from spectral_roi import get_band
+from spectral_peaks import find_peaks
+from spectral_codec import pack_spectral_data
+from dynamodb_json import serialize_item
+from frame_simulator import FRAME_SIZES
+
+FORMATS = ('jpeg', 'gray')
+
+# Diferencias menores a esto (ms) se consideran ruido al comparar con la línea base
+MIN_REGRESSION_MS = 0.25
+
+# Calidad PIL equivalente al jpeg_quality=12 que usa el firmware
+JPEG_QUALITY = 85
+
+# Líneas del espectro sintético: (posición relativa al ancho, amplitud)
+SYNTHETIC_LINES = ((0.18, 90), (0.34, 140), (0.52, 60), (0.61, 110), (0.83, 45))
+
+
+def synthetic_frame(size, fmt, seed=0):
+    """Frame de un espectro de emisión en una banda horizontal, con ruido de lectura"""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    x = np.arange(width)
+    sigma = max(1.0, width / 640.0)
+    profile = 8.0 + sum(amp * np.exp(-0.5 * ((x - pos * width) / sigma) ** 2) for pos, amp in SYNTHETIC_LINES)
+    rows = np.zeros(height)
+    rows[int(0.4 * height):int(0.55 * height)] = 1.0
+    frame = np.clip(4 + profile[None, :] * rows[:, None] + rng.normal(0, 4, (height, width)), 0, 255).astype(np.uint8)
+
+    buffer = io.BytesIO()
+    if fmt == 'jpeg':
+        # Color: el sensor registra cada zona del espectro en un canal distinto
+        tint = np.stack([np.clip((x / width - 0.3) * 3, 0.2, 1),
+                         np.clip(1 - abs(x / width - 0.5) * 2.5, 0.2, 1),
+                         np.clip((0.7 - x / width) * 3, 0.2, 1)], axis=1)
+        rgb = (frame[:, :, None] * tint[None, :, :]).astype(np.uint8)
+        Image.fromarray(rgb, 'RGB').save(buffer, 'JPEG', quality=JPEG_QUALITY)
+    else:
+        Image.fromarray(frame, 'L').save(buffer, 'PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+def pipeline_stages(frame_bytes):
+    """
+    Etapas en orden; cada una es (nombre, preparar, ejecutar). preparar()
+    construye la entrada fuera del tiempo medido a partir de las salidas previas
+    """
+    state = {}
+
+    def run_open():
+        return open_image(frame_bytes)
+
+    def run_decode(image):
+        state['decoded'] = decode_image(image)[0]
+
+    def run_band(decoded):
+        state['band'] = get_band(decoded)[0]
+
+    def run_profile(decoded):
+        profile = column_profile(decoded, state['band'])
+        state['profile'] = (profile - profile.min()) / max(float(np.ptp(profile)), 1e-12) * 100
+
+    def run_peaks(profile):
+        state['peaks'] = find_peaks(profile)
+
+    def run_identify(wavelengths):
+        return [psi.identify_element(w) for w in wavelengths]
+
+    def run_analyze_profile(profile):
+        state['spectral_data'] = psi.analyze_profile(profile)
+
+    def run_pack(spectral_data):
+        state['packed'] = pack_spectral_data(spectral_data)[0]
+
+    def run_decimals(observation):
+        return psi.convert_floats_to_decimals(observation)
+
+    def run_serialize(observation):
+        return serialize_item(observation)
+
+    def run_analyze_spectrum(image):
+        return psi.analyze_spectrum(image)
+
+    def peak_wavelengths():
+        width = state['profile'].size
+        return list(np.interp(state['peaks']['positions'], [0, width - 1], [400.0, 700.0]))
+
+    return [
+        ('open', lambda: (), run_open),
+        ('decode', lambda: (open_image(frame_bytes),), run_decode),
+        ('band', lambda: (state['decoded'],), run_band),
+        ('profile', lambda: (state['decoded'],), run_profile),
+        ('find_peaks', lambda: (state['profile'],), run_peaks),
+        ('identify_element', lambda: (peak_wavelengths(),), run_identify),
+        ('analyze_profile', lambda: (state['profile'],), run_analyze_profile),
+        ('pack_spectral_data', lambda: (state['spectral_data'],), run_pack),
+        ('convert_floats_to_decimals',
+         lambda: ({'observationId': 'bench', 'spectralData': state['packed']},), run_decimals),
+        ('serialize_item',
+         lambda: ({'observationId': 'bench', 'spectralData': state['packed']},), run_serialize),
+        ('analyze_spectrum', lambda: (open_image(frame_bytes),), run_analyze_spectrum),
+    ]
+
+
+def benchmark_frame(frame_bytes, repeat):
+    """
+    Mide cada etapa: una corrida de calentamiento (cachés, imports perezosos),
+    `repeat` corridas de tiempo y una corrida de memoria
+    """
+    stages = pipeline_stages(frame_bytes)
+    for name, prepare, run in stages:
+        run(*prepare())
+
+    timings = {name: ([], []) for name, _, _ in stages}
+    for _ in range(repeat):
+        for name, prepare, run in stages:
+            args = prepare()
+            wall, cpu = time.perf_counter(), time.process_time()
+            run(*args)
+            timings[name][0].append((time.perf_counter() - wall) * 1000)
+            timings[name][1].append((time.process_time() - cpu) * 1000)
+
+    results = {}
+    tracemalloc.start()
+    try:
+        for name, prepare, run in stages:
+            args = prepare()
+            _reset_peak_rss()
+            rss = _current_rss()
+            tracemalloc.reset_peak()
+            run(*args)
+            peak = _peak_rss()
+            results[name] = {
+                'wallMs': round(statistics.median(timings[name][0]), 4),
+                'cpuMs': round(statistics.median(timings[name][1]), 4),
+                'tracedPeakBytes': tracemalloc.get_traced_memory()[1],
+                'peakRssBytes': peak,
+                'rssGrowthBytes': max(0, peak - rss) if rss else None,
+            }
+    finally:
+        tracemalloc.stop()
+    return results
+
+
+def run_benchmark(sizes, formats, repeat):
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'createdAt': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        'results': []
+    }
+    for name in sizes:
+        for fmt in formats:
+            frame_bytes = synthetic_frame(FRAME_SIZES[name], fmt)
+            stages = benchmark_frame(frame_bytes, repeat)
+            report['results'].append({
+                'frame': name, 'format': fmt, 'size': list(FRAME_SIZES[name]),
+                'bytes': len(frame_bytes), 'stages': stages
+            })
+            total = stages['analyze_spectrum']
+            print(f"{name:>6} {fmt:<5} {total['wallMs']:9.2f} ms  "
+                  f"{total['tracedPeakBytes'] / 1e6:7.2f} MB traced  {total['peakRssBytes'] / 1e6:8.1f} MB RSS")
+    return report
+
+
+def compare(report, baseline, threshold):
+    """
+    Etapas más lentas que la línea base en más de threshold % (y más de
+    MIN_REGRESSION_MS). Retorna lista de regresiones
+    """
+    previous = {(r['frame'], r['format']): r['stages'] for r in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        old_stages = previous.get((result['frame'], result['format']))
+        if not old_stages:
+            continue
+        for stage, values in result['stages'].items():
+            old = old_stages.get(stage)
+            if not old or old['wallMs'] <= 0:
+                continue
+            change = (values['wallMs'] - old['wallMs']) / old['wallMs'] * 100
+            if change > threshold and values['wallMs'] - old['wallMs'] > MIN_REGRESSION_MS:
+                regressions.append({
+                    'frame': result['frame'], 'format': result['format'], 'stage': stage,
+                    'baselineMs': old['wallMs'], 'wallMs': values['wallMs'], 'changePercent': round(change, 1)
+                })
+    return regressions
+
+
+def _reset_peak_rss():
+    """Reinicia el pico de RSS del proceso (VmHWM), solo en Linux"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _current_rss():
+    """RSS actual en bytes (VmRSS); None fuera de Linux"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _peak_rss():
+    """Pico de RSS en bytes: VmHWM en Linux, ru_maxrss en otros sistemas"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reporta bytes, Linux KB
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del pipeline espectral por tamaño de frame')
+    parser.add_argument('--sizes', default=','.join(FRAME_SIZES), help='tamaños separados por coma')
+    parser.add_argument('--formats', default=','.join(FORMATS))
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--output', help='guarda los resultados en este JSON')
+    parser.add_argument('--save-baseline', metavar='PATH', help='guarda los resultados como línea base')
+    parser.add_argument('--baseline', metavar='PATH', help='compara contra esta línea base')
+    parser.add_argument('--threshold', type=float, default=10.0, help='regresión máxima tolerada (%%)')
+    args = parser.parse_args()
+
+    sizes = [s.strip().upper() for s in args.sizes.split(',') if s.strip()]
+    unknown = [s for s in sizes if s not in FRAME_SIZES]
+    if unknown:
+        parser.error(f"tamaños desconocidos: {', '.join(unknown)}")
+    formats = [f.strip() for f in args.formats.split(',') if f.strip()]
+
+    report = run_benchmark(sizes, formats, args.repeat)
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Resultados en {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for r in regressions:
+            print(f"⚠️ {r['frame']} {r['format']} {r['stage']}: "
+                  f"{r['baselineMs']} -> {r['wallMs']} ms (+{r['changePercent']}%)")
+        if regressions:
+            sys.exit(1)
+        print(f"✅ Sin regresiones mayores a {args.threshold}%")
+
+
+if __name__ == '__main__':
+    main()
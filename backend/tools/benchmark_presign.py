@@ -0,0 +1,126 @@
+"""
+Benchmark de la firma de URLs de subida de presign_upload
+
+Firmar es solo CPU (no llama a AWS), así que corre sin cuenta: usa
+credenciales ficticias, y el dueño del dispositivo se lee de una tabla
+local (local_aws). Para N frames de un burst compara:
+
+  per-call     N llamadas al handler de una URL cada una (el camino anterior;
+               en producción además cada una es un viaje por API Gateway)
+  cold-client  N firmas creando un cliente de S3 por firma (lo que cuesta
+               no reutilizar el cliente del contenedor)
+  burst        una llamada con count=N (cliente caliente, una respuesta)
+
+y la firma de las URLs de partes de una subida multiparte (upload_part).
+
+Uso:
+  python benchmark_presign.py
+  python benchmark_presign.py --counts 1,20,50 --parts 10,100 --repeat 20 --output presign.json
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda')
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'shared'))
+os.environ.setdefault('S3_BUCKET', 'orions-eye-images-benchmark')
+os.environ.setdefault('DEVICES_TABLE', 'orions-eye-devices-benchmark')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+import boto3
+from botocore.config import Config
+
+from local_aws import LocalDynamoDB
+
+
+def load_presign():
+    spec = importlib.util.spec_from_file_location(
+        'presign_upload_handler', os.path.join(LAMBDA_DIR, 'presign_upload', 'handler.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    dynamodb = LocalDynamoDB({module.DEVICES_TABLE: 'deviceId'})
+    dynamodb.Table(module.DEVICES_TABLE).put_item(Item={'deviceId': 'bench', 'userId': 'user-bench'})
+    module.dynamodb_client = dynamodb.meta.client
+    return module
+
+
+def api_event(body):
+    return {'requestContext': {'authorizer': {'claims': {'sub': 'user-bench'}}}, 'body': json.dumps(body)}
+
+
+def _median_ms(run, repeat):
+    run()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(times), 3)
+
+
+def run_benchmark(counts, parts, repeat):
+    presign = load_presign()
+    quiet = lambda: contextlib.redirect_stdout(io.StringIO())
+
+    def per_call(n):
+        with quiet():
+            for _ in range(n):
+                presign.lambda_handler(api_event({'deviceId': 'bench'}), None)
+
+    def cold_client(n):
+        for i in range(n):
+            client = boto3.client('s3', config=Config(signature_version='s3v4'))
+            client.generate_presigned_url('put_object', Params={
+                'Bucket': presign.BUCKET, 'Key': f'observations/user-bench/bench/{i}.jpg'}, ExpiresIn=300)
+
+    def burst(n):
+        with quiet():
+            response = presign.lambda_handler(api_event({'deviceId': 'bench', 'count': n}), None)
+        assert len(json.loads(response['body'])['uploads']) == n
+
+    results = []
+    for n in counts:
+        row = {'urls': n}
+        for name, run in (('perCall', per_call), ('coldClient', cold_client), ('burst', burst)):
+            row[f'{name}Ms'] = _median_ms(lambda: run(n), repeat)
+        row['burstUrlsPerSecond'] = round(n / row['burstMs'] * 1000) if row['burstMs'] else None
+        results.append(row)
+        print(f"{n:>4} URLs  por llamada {row['perCallMs']:8.2f} ms  cliente nuevo {row['coldClientMs']:9.2f} ms  "
+              f"burst {row['burstMs']:7.2f} ms  ({row['burstUrlsPerSecond']} URLs/s)")
+
+    multipart = []
+    for p in parts:
+        key = 'observations/user-bench/bench/20260101_000000_bench.jpg'
+        ms = _median_ms(lambda: [presign._presign('upload_part', {'Key': key, 'UploadId': 'bench', 'PartNumber': i},
+                                                  presign.MULTIPART_EXPIRES_IN) for i in range(1, p + 1)], repeat)
+        multipart.append({'parts': p, 'signMs': ms})
+        print(f"{p:>4} partes firmadas en {ms:8.2f} ms")
+    return {'repeat': repeat, 'burst': results, 'multipart': multipart}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Firma de URLs de subida (presign_upload)')
+    parser.add_argument('--counts', default='1,5,20,50', help='URLs por burst')
+    parser.add_argument('--parts', default='10,100', help='partes de una subida multiparte')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', help='guarda los resultados en este JSON')
+    args = parser.parse_args()
+
+    report = run_benchmark([int(n) for n in args.counts.split(',')],
+                           [int(p) for p in args.parts.split(',')], args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Resultados en {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""
+Benchmark de la serialización de items de observación para DynamoDB
+
+Escritura: compara el camino anterior (convert_floats_to_decimals + TypeSerializer de
+boto3, lo que hace Table.put_item) con dynamodb_json.serialize_item (una
+pasada, números en bloque) sobre tres items:
+
+  packed   observación real: análisis de un frame sintético con los arrays
+           en blobs SPC1 (lo que se guarda hoy)
+  lists    los mismos datos con wavelengths, spectralProfile y niveles
+           reducidos como listas de floats (arrays sin comprimir)
+  numpy    lo mismo con arrays de NumPy (el camino anterior necesita .tolist())
+
+Lectura: compara la respuesta de los handlers de lectura con el recurso
+(TypeDeserializer, json.loads(json.dumps(default=float)) y otro json.dumps
+del body) contra dynamodb_json.item_json sobre la respuesta del cliente de
+bajo nivel:
+
+  list-lists   página de get_observations con arrays completos en listas
+  list-packed  página de get_observations con arrays SPC1 (se omiten)
+  detail       get_observation_detail de un item SPC1 a resolución completa
+
+Antes de medir verifica que ambos caminos producen el mismo item (escritura)
+o el mismo JSON (lectura).
+
+Uso:
+  python benchmark_serialization.py
+  python benchmark_serialization.py --size UXGA --repeat 50 --page 50 --output serialization.json
+"""
+import argparse
+import copy
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda')
+sys.path.insert(0, LAMBDA_DIR)
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'shared'))
+for _name in ('OBSERVATIONS_TABLE', 'DEVICES_TABLE', 'S3_BUCKET'):
+    os.environ.setdefault(_name, 'benchmark')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+
+import numpy as np
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+import process_spectral_image as psi
+from dynamodb_json import serialize_item, item_json, items_json
+from instrumentation import item_size
+from frame_simulator import FRAME_SIZES, device_profile, render_frame
+from spectral_codec import pack_spectral_data
+from spectral_format import decode_array
+
+
+def observation_items(size):
+    """Los tres items del benchmark, a partir del análisis de un frame sintético"""
+    data, _ = render_frame(device_profile('bench', FRAME_SIZES[size], 'hg', seed=0), 'jpeg', seed=0)
+    spectral_data = psi.analyze_spectrum(psi.open_image(data))
+    base = {
+        'observationId': 'obs_bench_20260101000000',
+        'deviceId': 'bench',
+        'userId': 'user-bench',
+        'timestamp': '2026-01-01T00:00:00',
+        'imageS3Key': 'images/sha256/00/bench.jpg',
+        'algorithmVersion': psi.ALGORITHM_VERSION,
+        'status': 'processed',
+    }
+    packed, _ = pack_spectral_data(spectral_data)
+    as_arrays = dict(spectral_data)
+    for field in ('wavelengths', 'spectralProfile'):
+        as_arrays[field] = np.asarray(spectral_data[field])
+    as_arrays['profileLevels'] = {
+        size: {field: np.asarray(values) for field, values in level.items()}
+        for size, level in spectral_data['profileLevels'].items()
+    }
+    return {
+        'packed': dict(base, spectralData=packed),
+        'lists': dict(base, spectralData=spectral_data),
+        'numpy': dict(base, spectralData=as_arrays),
+    }
+
+
+def previous_path(item, serializer):
+    """Lo que hacía process_spectral_image: Decimals y luego TypeSerializer"""
+    item = psi.convert_floats_to_decimals(_tolist(item))
+    return {name: serializer.serialize(value) for name, value in item.items()}
+
+
+def _tolist(value):
+    if isinstance(value, dict):
+        return {k: _tolist(v) for k, v in value.items()}
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return value
+
+
+def _median_ms(run, repeat, setup=None):
+    """Mediana en ms; setup() prepara la entrada de cada corrida fuera del tiempo medido"""
+    setup = setup or (lambda: ())
+    run(*setup())
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        run(*args)
+        times.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(times), 4)
+
+
+def _load_handler(name):
+    spec = importlib.util.spec_from_file_location(f'{name}_handler', os.path.join(LAMBDA_DIR, name, 'handler.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _strip_list_view(spectral):
+    """Lo que get_observations quita de cada observación (los arrays van en el detalle)"""
+    spectral.pop('profileLevels', None)
+    if spectral.pop('encoding', None):
+        spectral.pop('wavelengths', None)
+        spectral.pop('spectralProfile', None)
+
+
+def _previous_list(items, deserializer):
+    """get_observations con el recurso: deserializar, quitar arrays, doble json"""
+    observations = [{k: deserializer.deserialize(v) for k, v in item.items()} for item in items]
+    for obs in observations:
+        if isinstance(obs.get('spectralData'), dict):
+            _strip_list_view(obs['spectralData'])
+    observations = json.loads(json.dumps(observations, default=float))
+    return json.dumps({'observations': observations, 'count': len(observations)})
+
+
+def _single_pass_list(items):
+    for item in items:
+        spectral = item.get('spectralData', {}).get('M')
+        if spectral is not None:
+            _strip_list_view(spectral)
+    return f'{{"observations": {items_json(items)}, "count": {len(items)}}}'
+
+
+def _previous_detail(item, deserializer):
+    """get_observation_detail con el recurso: decodificar a listas y doble json"""
+    item = {k: deserializer.deserialize(v) for k, v in item.items()}
+    data = item['spectralData']
+    data.pop('profileLevels', None)
+    data.pop('encoding', None)
+    for field in ('wavelengths', 'spectralProfile'):
+        data[field] = decode_array(data[field])
+    item = json.loads(json.dumps(item, default=float))
+    return json.dumps({'observation': item})
+
+
+def _single_pass_detail(item, detail):
+    item['spectralData'] = {'M': detail._decode_spectral(item['spectralData']['M'])}
+    return f'{{"observation": {item_json(item)}}}'
+
+
+def run_read_benchmark(size, repeat, page):
+    deserializer = TypeDeserializer()
+    detail = _load_handler('get_observation_detail')
+    items = observation_items(size)
+    lists_item, packed_item = serialize_item(items['lists']), serialize_item(items['packed'])
+    packed_item['spectralData']['M'].pop('profileLevels')
+
+    scenarios = {
+        'list-lists': ([lists_item] * page, _previous_list, _single_pass_list),
+        'list-packed': ([packed_item] * page, _previous_list, _single_pass_list),
+        'detail': (packed_item, _previous_detail,
+                   lambda item: _single_pass_detail(item, detail)),
+    }
+    results = []
+    for name, (source, previous, single) in scenarios.items():
+        setup = lambda: (copy.deepcopy(source),)
+        old_body = previous(*setup(), deserializer)
+        new_body = single(*setup())
+        same = json.loads(old_body) == json.loads(new_body)
+        previous_ms = _median_ms(lambda items: previous(items, deserializer), repeat, setup)
+        single_ms = _median_ms(single, repeat, setup)
+        results.append({
+            'response': name,
+            'bodyBytes': len(new_body),
+            'previousMs': previous_ms,
+            'singlePassMs': single_ms,
+            'speedup': round(previous_ms / single_ms, 2) if single_ms else None,
+            'identical': same,
+        })
+        print(f"{name:<12} {previous_ms:9.3f} ms -> {single_ms:8.3f} ms  "
+              f"x{results[-1]['speedup']}  {len(new_body) / 1e6:6.2f} MB  {'iguales' if same else '⚠️ DISTINTOS'}")
+    return {'frame': size, 'repeat': repeat, 'page': page, 'results': results}
+
+
+def run_benchmark(size, repeat):
+    serializer, deserializer = TypeSerializer(), TypeDeserializer()
+    results = []
+    for name, item in observation_items(size).items():
+        old = previous_path(item, serializer)
+        new = serialize_item(item)
+        same = ({k: deserializer.deserialize(v) for k, v in old.items()}
+                == {k: deserializer.deserialize(v) for k, v in new.items()})
+        previous_ms = _median_ms(lambda: previous_path(item, serializer), repeat)
+        single_ms = _median_ms(lambda: serialize_item(item), repeat)
+        results.append({
+            'item': name,
+            'itemBytes': item_size(_tolist(item)),
+            'previousMs': previous_ms,
+            'serializeItemMs': single_ms,
+            'speedup': round(previous_ms / single_ms, 2) if single_ms else None,
+            'identical': same,
+        })
+        print(f"{name:<7} {previous_ms:9.3f} ms -> {single_ms:8.3f} ms  "
+              f"x{results[-1]['speedup']}  {'iguales' if same else '⚠️ DISTINTOS'}")
+    return {'frame': size, 'repeat': repeat, 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serialización de observaciones para DynamoDB')
+    parser.add_argument('--size', default='UXGA', choices=list(FRAME_SIZES))
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--page', type=int, default=50, help='items por página de get_observations')
+    parser.add_argument('--only', choices=('write', 'read'), help='solo escritura o solo lectura')
+    parser.add_argument('--output', help='guarda los resultados en este JSON')
+    args = parser.parse_args()
+
+    report = {}
+    if args.only != 'read':
+        print("✍️ Escritura (put_item)")
+        report['write'] = run_benchmark(args.size, args.repeat)
+    if args.only != 'write':
+        print(f"📖 Lectura (páginas de {args.page} items)")
+        report['read'] = run_read_benchmark(args.size, args.repeat, args.page)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Resultados en {args.output}")
+    if not all(r['identical'] for section in report.values() for r in section['results']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,565 @@
+"""
+Flota virtual de ESP32 contra el camino de ingesta completo, en una máquina
+
+N dispositivos publican eventos orionseye/{deviceId}/image|status|data al
+handler de iot_rule_handler a una tasa total fija. El handler invoca a
+process_spectral_image a través de un sustituto local de Lambda (hilos con
+la concurrencia indicada); DynamoDB y S3 son los sustitutos de local_aws.
+Los frames vienen de frame_simulator, así cada observación se compara con
+su verdad de referencia.
+
+Con --chunk-size las imágenes se envían por partes al topic chunk (ver
+iot_rule_handler/image_transfer.py). --chunk-loss descarta partes en el
+primer envío; los dispositivos simulados reenvían lo que pide cada NACK
+y, si no reciben transferComplete en DEVICE_RESEND_SECONDS, reenvían la
+última parte (timeout).
+
+Con --batch-size las imágenes pasan por la cola de imágenes (LocalSQS, el
+mapeo de eventos SQS -> Lambda) y process_spectral_image las procesa en
+lotes; --unprocessed simula UnprocessedItems en BatchWriteItem. En este
+modo no hay cuerpo de respuesta por imagen, así que no se mide precisión.
+
+Con --upload las imágenes no pasan por IoT Core: se suben a la clave de
+presign_upload en el S3 local, cuya notificación dispara el procesamiento
+(por la cola si hay --batch-size). --redeliver vuelve a subir el mismo
+objeto (nueva notificación para la misma clave); el resumen cuenta las
+observaciones creadas por subida, que debe ser una.
+
+Con --payload json|msgpack los mensajes llegan como los entrega la regla
+de IoT (payload crudo en base64, ver iot_rule_handler/device_payload.py);
+en msgpack los campos binarios van sin base64. El resumen suma los bytes
+de los mensajes MQTT. Sin la opción, el evento es el JSON ya leído.
+
+La latencia se mide desde el instante programado de cada mensaje (carga en
+lazo abierto): si la ingesta se atrasa, la espera cuenta como latencia.
+
+Uso:
+  python fleet_simulator.py --devices 20 --rate 10 --duration 30
+  python fleet_simulator.py --devices 50 --rate 40 --duration 60 --mix image=0.1,status=0.6,data=0.3 \\
+      --size QVGA --concurrency 8 --redeliver 0.05 --output fleet.json
+  python fleet_simulator.py --size UXGA --mix image=1 --chunk-size 32768 --chunk-loss 0.1
+  python fleet_simulator.py --mix image=1 --rate 40 --batch-size 10 --batch-window 0.2 --unprocessed 0.1
+  python fleet_simulator.py --mix image=1 --size UXGA --upload --redeliver 0.2
+  python fleet_simulator.py --size UXGA --mix image=0.5,data=0.5 --chunk-size 65536 --payload msgpack
+"""
+import argparse
+import base64
+import contextlib
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda')
+sys.path.insert(0, LAMBDA_DIR)
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'shared'))
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'iot_rule_handler'))
+
+TABLES = {
+    'OBSERVATIONS_TABLE': ('orions-eye-observations-sim', 'observationId'),
+    'DEVICES_TABLE': ('orions-eye-devices-sim', 'deviceId'),
+    'ANALYSIS_CACHE_TABLE': ('orions-eye-analysis-cache-sim', 'cacheKey'),
+    'TRANSFERS_TABLE': ('orions-eye-transfers-sim', ('transferKey', 'seq')),
+    'PRESENCE_TABLE': ('orions-eye-presence-sim', 'deviceId'),
+    'TELEMETRY_TABLE': ('orions-eye-telemetry-sim', ('deviceId', 'hour')),
+}
+for _name, (_table, _) in TABLES.items():
+    os.environ.setdefault(_name, _table)
+os.environ.setdefault('S3_BUCKET', 'orions-eye-images-sim')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+
+import msgpack
+import numpy as np
+
+from frame_simulator import FRAME_SIZES, PRESETS, device_profile, render_frame, evaluate
+from local_aws import LocalDynamoDB, LocalIoTData, LocalLambda, LocalS3, LocalSQS
+from s3_uploads import UPLOAD_PREFIX, upload_key, is_upload_notification, upload_events
+from presence import is_online
+from image_transfer import DEVICE_RESEND_SECONDS
+
+# Nombre con el que iot_rule_handler invoca el procesamiento
+PROCESS_FUNCTION = 'orions-eye-process-image-dev'
+
+PERCENTILES = (50, 90, 99)
+
+# Separación entre partes consecutivas de una imagen (s)
+CHUNK_INTERVAL = 0.002
+# Veces que un dispositivo reenvía la última parte si no recibe transferComplete
+DEVICE_RETRIES = 3
+
+
+def load_handlers(workers, storage_dir, batch_size=0, batch_window=0.5):
+    """
+    Importa iot_rule_handler y process_spectral_image y reemplaza sus
+    clientes de AWS por los sustitutos locales
+    Con batch_size > 0 las imágenes van por la cola local en lotes
+    Retorna (iot handler, procesamiento (LocalLambda o LocalSQS), dynamodb local, iot-data local)
+    """
+    import process_spectral_image as psi
+    import result_cache
+    import detector_calibration
+    import image_transfer
+
+    dynamodb = LocalDynamoDB({table: key for table, key in TABLES.values()})
+    s3 = LocalS3(storage_dir)
+    psi.s3_client = detector_calibration.s3_client = s3
+    psi.observations_table = dynamodb.Table(os.environ['OBSERVATIONS_TABLE'])
+    psi.dynamodb_client = dynamodb.meta.client
+    psi.devices_table = dynamodb.Table(os.environ['DEVICES_TABLE'])
+    result_cache.cache_table = dynamodb.Table(os.environ['ANALYSIS_CACHE_TABLE'])
+    iot_data = LocalIoTData()
+    image_transfer.transfers_table = dynamodb.Table(os.environ['TRANSFERS_TABLE'])
+    image_transfer.s3_client = s3
+    image_transfer.iot_data_client = iot_data
+
+    spec = importlib.util.spec_from_file_location(
+        'iot_rule_handler_handler', os.path.join(LAMBDA_DIR, 'iot_rule_handler', 'handler.py'))
+    iot = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(iot)
+
+    lambda_client = LocalLambda(max_workers=workers)
+    lambda_client.register(PROCESS_FUNCTION, psi.lambda_handler)
+    iot.lambda_client = lambda_client
+    iot.s3_client = s3
+    iot.dynamodb = dynamodb
+    iot.devices_table = dynamodb.Table(os.environ['DEVICES_TABLE'])
+    iot.presence_table = dynamodb.Table(os.environ['PRESENCE_TABLE'])
+    iot.telemetry_table = dynamodb.Table(os.environ['TELEMETRY_TABLE'])
+    if batch_size:
+        queue = LocalSQS(psi.lambda_handler, batch_size, batch_window, max_workers=workers)
+        iot.sqs_client = queue
+        iot.IMAGE_QUEUE_URL = 'local://images'
+        s3.add_notification(lambda event: queue.send_message(QueueUrl=iot.IMAGE_QUEUE_URL,
+                                                             MessageBody=json.dumps(event)),
+                            prefix=f'{UPLOAD_PREFIX}/', suffix='.jpg')
+        return iot, queue, dynamodb, iot_data
+    s3.add_notification(lambda event: lambda_client.invoke(FunctionName=PROCESS_FUNCTION, InvocationType='Event',
+                                                           Payload=json.dumps(event)),
+                        prefix=f'{UPLOAD_PREFIX}/', suffix='.jpg')
+    return iot, lambda_client, dynamodb, iot_data
+
+
+def chunk_events(event, data, chunk_size):
+    """Eventos del topic chunk para una imagen (metadata en todas las partes)"""
+    device_id = event['topic'].split('/')[1]
+    transfer_id = f"{zlib.crc32(event['timestamp'].encode()):08x}"
+    total = -(-len(data) // chunk_size)
+    events = []
+    for seq in range(total):
+        part = data[seq * chunk_size:(seq + 1) * chunk_size]
+        events.append({
+            'topic': f"orionseye/{device_id}/chunk",
+            'userId': event['userId'],
+            'timestamp': event['timestamp'],
+            'transferId': transfer_id,
+            'seq': seq,
+            'total': total,
+            'crc': zlib.crc32(part),
+            'data': base64.b64encode(part).decode(),
+            'size': len(data),
+            'imageCrc': zlib.crc32(data),
+            'contentType': 'image/jpeg',
+        })
+    return events
+
+
+def build_schedule(devices, rate, duration, mix, size, fmt, redeliver, poisson, seed,
+                   chunk_size=0, chunk_loss=0.0, upload=False):
+    """
+    Lista de mensajes (instante, evento, verdad) con los frames ya renderizados,
+    para que generar imágenes no compita con la carga medida
+    redeliver: fracción de imágenes que se vuelven a entregar (QoS1)
+    chunk_size: bytes por parte (0 = imagen en un solo mensaje); chunk_loss:
+    fracción de partes que se pierden en el primer envío
+    upload: las imágenes se suben directo a S3 (la reentrega vuelve a subir el objeto)
+    Retorna (schedule, transferencias {(deviceId, transferId): (instante, partes, verdad)})
+    """
+    rng = np.random.default_rng(seed)
+    count = int(rate * duration)
+    if poisson:
+        offsets = np.cumsum(rng.exponential(1.0 / rate, count))
+    else:
+        offsets = np.arange(count) / rate
+
+    presets = sorted(PRESETS)
+    profiles = [device_profile(f"sim-{i:03d}", size, preset=presets[i % len(presets)], seed=seed + i)
+                for i in range(devices)]
+    topics, weights = zip(*mix.items())
+    weights = np.asarray(weights, dtype=np.float64) / sum(weights)
+
+    start = datetime.utcnow()
+    schedule, sent_images, transfers = [], [], {}
+    for seq, offset in enumerate(offsets):
+        profile = profiles[rng.integers(devices)]
+        device_id = profile['deviceId']
+        topic = topics[rng.choice(len(topics), p=weights)]
+        event = {
+            'topic': f"orionseye/{device_id}/{topic}",
+            'userId': 'fleet-sim',
+            # Único por mensaje: correlaciona la invocación de procesamiento
+            'timestamp': (start + timedelta(microseconds=seq)).isoformat(),
+        }
+        truth = None
+        if topic == 'image':
+            redelivered = bool(sent_images) and rng.random() < redeliver
+            if redelivered:
+                previous = sent_images[rng.integers(len(sent_images))]
+                event.update({k: previous[0][k] for k in ('topic', 'imageData')})
+                truth = previous[1]
+                if upload:
+                    event.update({k: previous[0][k] for k in ('uploadKey', 'observationId')})
+                    truth = None
+            else:
+                data, truth = render_frame(profile, fmt, seed=seed * 100003 + seq)
+                event['imageData'] = base64.b64encode(data).decode()
+                sent_images.append((event, truth))
+                if upload:
+                    # La clave que entregaría presign_upload; el id se deriva del mensaje
+                    event['observationId'] = str(uuid.uuid5(uuid.NAMESPACE_URL, event['timestamp']))
+                    event['uploadKey'] = upload_key('fleet-sim', device_id, event['observationId'],
+                                                    start + timedelta(seconds=float(offset)))
+                    event['topic'] = f"orionseye/{device_id}/upload"
+            if chunk_size:
+                chunks = chunk_events(event, base64.b64decode(event['imageData']), chunk_size)
+                sender = chunks[0]['topic'].split('/')[1]
+                transfers[(sender, chunks[0]['transferId'])] = (float(offset), chunks, truth)
+                for chunk in chunks:
+                    if rng.random() >= chunk_loss:
+                        schedule.append((float(offset) + chunk['seq'] * CHUNK_INTERVAL, chunk,
+                                         truth if chunk['seq'] == 0 else None))
+                continue
+        elif topic == 'status':
+            event.update({'status': 'online', 'rssi': int(rng.integers(-90, -40)),
+                          'battery': round(float(rng.uniform(3.3, 4.2)), 2)})
+        else:
+            event.update({'temperature': round(float(rng.normal(22, 3)), 2),
+                          'humidity': round(float(rng.uniform(20, 80)), 1)})
+        schedule.append((float(offset), event, truth))
+    schedule.sort(key=lambda entry: entry[0])
+    return schedule, transfers
+
+
+def rule_event(event, payload_format=None):
+    """
+    (evento de la regla de IoT, bytes del mensaje MQTT) para un mensaje simulado
+    payload_format None: el JSON ya leído (SELECT *); json / msgpack: payload crudo en base64
+    """
+    message = {name: value for name, value in event.items() if name != 'topic'}
+    if payload_format == 'msgpack':
+        for field in ('imageData', 'data'):
+            if isinstance(message.get(field), str):
+                message[field] = base64.b64decode(message[field])
+        raw = msgpack.packb(message)
+    else:
+        raw = json.dumps(message).encode()
+    if payload_format is None:
+        return event, len(raw)
+    return {'payload': base64.b64encode(raw).decode(), 'topic': event['topic']}, len(raw)
+
+
+def run_fleet(schedule, iot, lambda_client, concurrency, verbose=False, transfers=None, iot_data=None,
+              payload_format=None):
+    """
+    Entrega los mensajes en su instante programado y mide cada uno
+    Con transferencias por partes, los dispositivos atienden los NACK y
+    reenvían la última parte de las transferencias sin confirmar
+    """
+    records = []
+    lock = threading.Lock()
+    start = time.monotonic()
+    transfers = transfers or {}
+    acked, futures = set(), []
+
+    def deliver(scheduled, event, truth):
+        # Codificar es trabajo del dispositivo: queda fuera de la medición
+        delivered, size = rule_event(event, payload_format)
+        began = time.monotonic()
+        try:
+            if 'uploadKey' in event:
+                # PUT a la URL prefirmada: la notificación del bucket dispara el procesamiento
+                iot.s3_client.put_object(Bucket=iot.S3_BUCKET, Key=event['uploadKey'],
+                                         Body=base64.b64decode(event['imageData']), ContentType='image/jpeg')
+                status = 200
+            else:
+                response = iot.lambda_handler(delivered, None)
+                status = response.get('statusCode')
+        except Exception as e:
+            status = str(e)
+        done = time.monotonic()
+        topic = event['topic'].rsplit('/', 1)[-1]
+        with lock:
+            records.append({'topic': topic, 'timestamp': event.get('observationId', event['timestamp']),
+                            'status': status, 'bytes': 0 if 'uploadKey' in event else size,
+                            'scheduled': scheduled, 'began': began, 'done': done, 'truth': truth})
+
+    def resend(device_id, transfer_id, seqs, pool):
+        offset, chunks, truth = transfers[(device_id, transfer_id)]
+        for seq in seqs:
+            with lock:
+                futures.append(pool.submit(deliver, start + offset, chunks[seq], truth if seq == 0 else None))
+
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    with output, ThreadPoolExecutor(concurrency) as pool:
+        def on_command(topic, message):
+            device_id = topic.split('/')[1]
+            key = (device_id, message.get('transferId'))
+            if key not in transfers:
+                return
+            if message.get('command') == 'transferComplete':
+                with lock:
+                    acked.add(key)
+            elif message.get('command') == 'resend':
+                resend(device_id, message['transferId'], message.get('missing', []), pool)
+
+        if iot_data is not None:
+            iot_data.subscribe(on_command)
+        for offset, event, truth in schedule:
+            scheduled = start + offset
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with lock:
+                futures.append(pool.submit(deliver, scheduled, event, truth))
+
+        for _ in range(DEVICE_RETRIES + 1):
+            _drain(futures, lock)
+            pending = [key for key in transfers if key not in acked]
+            if not pending:
+                break
+            # Timeout del dispositivo: reenvía la última parte; llega tras la pausa
+            # y provoca un NACK de las que faltan
+            time.sleep(DEVICE_RESEND_SECONDS)
+            for device_id, transfer_id in pending:
+                resend(device_id, transfer_id, [len(transfers[(device_id, transfer_id)][1]) - 1], pool)
+        _drain(futures, lock)
+        lambda_client.wait()
+    return records, time.monotonic() - start
+
+
+def _drain(futures, lock):
+    """Espera las entregas pendientes, incluidas las que agreguen los NACK"""
+    while True:
+        with lock:
+            pending = [f for f in futures if not f.done()]
+        if not pending:
+            return
+        wait(pending)
+
+
+def summarize(records, invocations, elapsed, transfers=None, queue=None):
+    """Tasa lograda, percentiles de latencia, errores, duplicados y precisión"""
+    processing = {}
+    for inv in invocations:
+        # Con notificaciones repetidas gana la invocación que creó la observación
+        key = _event_key(inv['event'])
+        if key not in processing or not _is_duplicate(inv):
+            processing[key] = inv
+
+    ingest = {}
+    end_to_end, queue_wait, service = [], [], []
+    errors, duplicates, scores = 0, 0, []
+    measured = set()
+    for record in records:
+        ingest.setdefault(record['topic'], []).append((record['done'] - record['scheduled']) * 1000)
+        if record['status'] != 200:
+            errors += 1
+        inv = processing.get(record['timestamp'])
+        # Por imagen: el mensaje image o la parte 0 de su transferencia
+        # (una sola vez aunque la parte 0 se haya reenviado)
+        if record['topic'] not in ('image', 'chunk', 'upload') or record['truth'] is None or inv is None:
+            continue
+        if record['topic'] == 'chunk':
+            if record['timestamp'] in measured:
+                continue
+            measured.add(record['timestamp'])
+        end_to_end.append((inv['finishedAt'] - record['scheduled']) * 1000)
+        queue_wait.append((inv['startedAt'] - inv['queuedAt']) * 1000)
+        service.append((inv['finishedAt'] - inv['startedAt']) * 1000)
+        result = inv['result'] or {}
+        if inv['error'] or result.get('statusCode') != 200:
+            errors += 1
+            continue
+        body = json.loads(result['body'])
+        if body.get('duplicate'):
+            duplicates += 1
+        elif record['truth'] and 'spectralData' in body:
+            scores.append(evaluate(record['truth'], body.get('spectralData', {})))
+
+    def mean(name):
+        values = [s[name] for s in scores if s[name] is not None]
+        return round(float(np.mean(values)), 3) if values else None
+
+    chunks = [r for r in records if r['topic'] == 'chunk']
+    processed = {inv['event'].get('timestamp') for inv in invocations}
+    summary = {
+        'messages': len(records),
+        'seconds': round(elapsed, 2),
+        'messagesPerSecond': round(len(records) / elapsed, 2) if elapsed else 0.0,
+        'errors': errors,
+        'duplicatesSuppressed': duplicates,
+        'ingestLatencyMs': {topic: _percentiles(values) for topic, values in sorted(ingest.items())},
+        'imageEndToEndMs': _percentiles(end_to_end),
+        'processingQueueMs': _percentiles(queue_wait),
+        'processingServiceMs': _percentiles(service),
+        'accuracy': {
+            'frames': len(scores),
+            'recall': mean('recall'),
+            'precision': mean('precision'),
+            'meanErrorNm': mean('meanErrorNm'),
+        },
+    }
+    if queue is not None:
+        sizes = [batch['size'] for batch in queue.batches]
+        summary['batches'] = {
+            'count': len(sizes),
+            'meanSize': round(float(np.mean(sizes)), 2) if sizes else None,
+            'maxSize': max(sizes, default=None),
+            'recordsRetried': sum(batch['failures'] for batch in queue.batches),
+            'deadLetters': len(queue.dead_letters),
+        }
+    if transfers:
+        submissions = [inv['event'].get('timestamp') for inv in invocations]
+        summary['transfers'] = {
+            'images': len(transfers),
+            'chunksDelivered': len(chunks),
+            'chunksExpected': sum(len(c) for _, c, _ in transfers.values()),
+            'completed': sum(1 for _, c, _ in transfers.values() if c[0]['timestamp'] in processed),
+            'submittedTwice': len(submissions) - len(set(submissions)),
+        }
+    return summary
+
+
+def _event_key(event):
+    """Correlación mensaje -> invocación: timestamp del mensaje o id de la subida"""
+    if is_upload_notification(event):
+        return upload_events(event)[0]['observationId']
+    return event.get('timestamp')
+
+
+def _is_duplicate(inv):
+    try:
+        return bool(json.loads(inv['result']['body']).get('duplicate'))
+    except (TypeError, KeyError, ValueError):
+        return False
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    values = np.asarray(values)
+    summary = {f"p{p}": round(float(np.percentile(values, p)), 2) for p in PERCENTILES}
+    summary['max'] = round(float(values.max()), 2)
+    summary['count'] = int(values.size)
+    return summary
+
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        topic, _, weight = part.partition('=')
+        if topic.strip() not in ('image', 'status', 'data'):
+            raise argparse.ArgumentTypeError(f"tópico desconocido: {topic}")
+        mix[topic.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Flota virtual de ESP32 contra la ingesta local')
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=5.0, help='mensajes por segundo (toda la flota)')
+    parser.add_argument('--duration', type=float, default=20.0, help='segundos de carga')
+    parser.add_argument('--mix', type=_parse_mix, default='image=0.2,status=0.5,data=0.3')
+    parser.add_argument('--size', default='VGA', choices=list(FRAME_SIZES))
+    parser.add_argument('--format', default='jpeg', choices=('jpeg', 'gray'))
+    parser.add_argument('--concurrency', type=int, default=4, help='invocaciones simultáneas de Lambda')
+    parser.add_argument('--redeliver', type=float, default=0.0, help='fracción de imágenes reenviadas')
+    parser.add_argument('--poisson', action='store_true', help='llegadas de Poisson en vez de regulares')
+    parser.add_argument('--chunk-size', type=int, default=0, help='envía las imágenes en partes de estos bytes')
+    parser.add_argument('--chunk-loss', type=float, default=0.0, help='fracción de partes perdidas en el primer envío')
+    parser.add_argument('--upload', action='store_true',
+                        help='las imágenes se suben directo a S3 (URL prefirmada) en vez de MQTT')
+    parser.add_argument('--batch-size', type=int, default=0,
+                        help='procesa las imágenes desde la cola en lotes de hasta N (0: una invocación por imagen)')
+    parser.add_argument('--batch-window', type=float, default=0.5, help='segundos que se espera a llenar un lote')
+    parser.add_argument('--unprocessed', type=float, default=0.0,
+                        help='fracción de escrituras que BatchWriteItem devuelve sin procesar')
+    parser.add_argument('--payload', choices=('json', 'msgpack'),
+                        help='formato del mensaje MQTT, entregado como payload crudo por la regla')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='guarda el resumen en este JSON')
+    parser.add_argument('--verbose', action='store_true', help='muestra los logs de los handlers')
+    args = parser.parse_args()
+
+    if args.upload and args.chunk_size:
+        parser.error('--upload y --chunk-size son caminos distintos de la imagen')
+    mix = args.mix if isinstance(args.mix, dict) else _parse_mix(args.mix)
+    print(f"🛰️ Renderizando {int(args.rate * args.duration)} mensajes de {args.devices} dispositivos...")
+    schedule, transfers = build_schedule(args.devices, args.rate, args.duration, mix, FRAME_SIZES[args.size],
+                                         args.format, args.redeliver, args.poisson, args.seed,
+                                         args.chunk_size, args.chunk_loss, args.upload)
+
+    with tempfile.TemporaryDirectory() as storage:
+        iot, processing, dynamodb, iot_data = load_handlers(args.concurrency, storage,
+                                                            args.batch_size, args.batch_window)
+        dynamodb.meta.client.unprocessed_rate = args.unprocessed
+        print(f"🚀 {args.rate} msg/s durante {args.duration} s, concurrencia {args.concurrency}")
+        records, elapsed = run_fleet(schedule, iot, processing, args.concurrency, args.verbose,
+                                     transfers, iot_data, args.payload)
+        processing.shutdown()
+        summary = summarize(records, processing.invocations, elapsed, transfers,
+                            processing if args.batch_size else None)
+        mqtt = {}
+        for record in records:
+            if record['topic'] != 'upload':
+                mqtt.setdefault(record['topic'], []).append(record['bytes'])
+        summary['payload'] = {
+            'format': args.payload or 'json',
+            'mqttBytes': sum(sum(sizes) for sizes in mqtt.values()),
+            'meanBytes': {topic: round(float(np.mean(sizes)), 1) for topic, sizes in sorted(mqtt.items())},
+        }
+        devices = dynamodb.Table(os.environ['DEVICES_TABLE'])
+        summary['deviceWrites'] = {
+            'statusMessages': sum(1 for r in records if r['topic'] == 'status'),
+            'writes': devices.writes,
+            'conditionalRejects': devices.rejected,
+        }
+        presence = dynamodb.Table(os.environ['PRESENCE_TABLE'])
+        summary['presence'] = {
+            'heartbeats': sum(1 for r in records if r['topic'] != 'upload'),
+            'writes': presence.writes,
+            'devicesOnline': sum(1 for item in presence.items.values() if is_online(item['lastSeen'])),
+        }
+        buckets = dynamodb.Table(os.environ['TELEMETRY_TABLE']).items.values()
+        samples = sum(int(item['samples']) for item in buckets)
+        stored = sum(len(block) for item in buckets for block in item['blocks'])
+        summary['telemetry'] = {
+            'dataMessages': sum(1 for r in records if r['topic'] == 'data'),
+            'samples': samples,
+            'items': len(buckets),
+            'blockBytes': stored,
+            'bytesPerSample': round(stored / samples, 1) if samples else None,
+        }
+        if args.upload:
+            uploads = {r['timestamp'] for r in records if r['topic'] == 'upload'}
+            observations = dynamodb.Table(os.environ['OBSERVATIONS_TABLE']).items.values()
+            summary['uploads'] = {
+                'objects': len(uploads),
+                'puts': sum(1 for r in records if r['topic'] == 'upload'),
+                'observations': sum(1 for obs in observations if obs['observationId'] in uploads),
+            }
+
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
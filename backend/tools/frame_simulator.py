@@ -0,0 +1,272 @@
+"""
+Generador de frames sintéticos de espectrógrafo con verdad de referencia
+
+Cada frame es la imagen 2D que vería el ESP32-CAM detrás de la red de
+difracción: una banda horizontal con el espectro disperso, con líneas de
+emisión y de absorción conocidas, continuo, inclinación de la rendija,
+ruido de disparo y de lectura, pixeles calientes fijos por dispositivo,
+rayos cósmicos y artefactos de compresión JPEG. render_frame() retorna los
+bytes y la verdad del frame (posición y longitud de onda de cada línea,
+banda, inclinación, dispersión) para verificar el análisis.
+
+Uso:
+  python frame_simulator.py --preset hg --size VGA --count 5 --out /tmp/frames
+  python frame_simulator.py --preset solar --size UXGA --count 3 --check
+    (--check analiza cada frame con process_spectral_image y reporta la precisión)
+"""
+import argparse
+import io
+import json
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+# framesize_t del driver esp32-camera
+FRAME_SIZES = {
+    'QQVGA': (160, 120),
+    'QCIF': (176, 144),
+    'HQVGA': (240, 176),
+    'QVGA': (320, 240),
+    'CIF': (400, 296),
+    'HVGA': (480, 320),
+    'VGA': (640, 480),
+    'SVGA': (800, 600),
+    'XGA': (1024, 768),
+    'HD': (1280, 720),
+    'SXGA': (1280, 1024),
+    'UXGA': (1600, 1200),
+}
+
+# Rango que cubre el sensor sin calibrar (igual al que asume el análisis)
+DEFAULT_RANGE_NM = (400.0, 700.0)
+
+# Fuentes: continuo relativo (0 = solo líneas) y líneas (nm, amplitud, tipo)
+# Amplitudes en cuentas sobre el continuo; en absorción, profundidad relativa
+PRESETS = {
+    'hg': {
+        'continuum': 4.0,
+        'lines': [(404.66, 70, 'emission'), (435.83, 150, 'emission'), (487.7, 35, 'emission'),
+                  (542.4, 60, 'emission'), (546.07, 170, 'emission'), (578.0, 90, 'emission'),
+                  (611.6, 120, 'emission')],
+    },
+    'neon': {
+        'continuum': 2.0,
+        'lines': [(585.25, 140, 'emission'), (594.48, 60, 'emission'), (607.43, 50, 'emission'),
+                  (614.31, 80, 'emission'), (626.65, 45, 'emission'), (640.22, 110, 'emission'),
+                  (650.65, 70, 'emission'), (659.9, 40, 'emission'), (692.95, 55, 'emission')],
+    },
+    'solar': {
+        'continuum': 150.0,
+        'lines': [(430.8, 0.35, 'absorption'), (486.13, 0.45, 'absorption'), (517.3, 0.3, 'absorption'),
+                  (527.0, 0.25, 'absorption'), (589.3, 0.55, 'absorption'), (656.28, 0.5, 'absorption')],
+    },
+    'hydrogen': {
+        'continuum': 3.0,
+        'lines': [(410.17, 30, 'emission'), (434.05, 55, 'emission'), (486.13, 110, 'emission'),
+                  (656.28, 200, 'emission')],
+    },
+}
+
+# Sensibilidad relativa de cada canal (R, G, B) del OV2640: (centro nm, ancho nm)
+CHANNEL_RESPONSE = ((600.0, 45.0), (540.0, 40.0), (460.0, 35.0))
+
+
+def device_profile(device_id, size, preset='hg', seed=None):
+    """
+    Parámetros fijos de un dispositivo: banda, inclinación, dispersión,
+    pixeles calientes. Derivados del device_id para que sean reproducibles
+    """
+    width, height = size
+    rng = np.random.default_rng(seed if seed is not None else abs(hash(device_id)) % (2 ** 32))
+    band_height = int(height * rng.uniform(0.08, 0.18))
+    top = int(rng.uniform(0.2, 0.8) * (height - band_height))
+    span = DEFAULT_RANGE_NM[1] - DEFAULT_RANGE_NM[0]
+    return {
+        'deviceId': device_id,
+        'preset': preset,
+        'size': [width, height],
+        'band': [top, top + band_height],
+        'tiltDeg': float(rng.uniform(-1.0, 1.0)),
+        # Desvío de la dispersión respecto del rango lineal por defecto (nm en cada extremo, curvatura)
+        'dispersion': [DEFAULT_RANGE_NM[0] + rng.uniform(-1, 1), DEFAULT_RANGE_NM[1] + rng.uniform(-1, 1),
+                       float(rng.uniform(-0.002, 0.002) * span)],
+        'fwhmNm': float(rng.uniform(1.5, 3.0)),
+        'hotPixels': (rng.integers(0, height, 40).tolist(), rng.integers(0, width, 40).tolist()),
+        'darkLevel': float(rng.uniform(3, 8)),
+    }
+
+
+def pixel_wavelengths(profile):
+    """Longitud de onda de cada columna en la fila central de la banda"""
+    width = profile['size'][0]
+    start, end, curvature = profile['dispersion']
+    t = np.linspace(0.0, 1.0, width)
+    return start + (end - start) * t + curvature * 4 * t * (1 - t)
+
+
+def render_frame(profile, fmt='jpeg', jpeg_quality=85, exposure=1.0, read_noise=3.0,
+                 cosmic_rays=2, seed=0):
+    """
+    Renderiza un frame del dispositivo
+
+    exposure escala la señal (las cuentas satura en 255); fmt 'jpeg' (color,
+    como PIXFORMAT_JPEG) o 'gray' (8 bits, como PIXFORMAT_GRAYSCALE, en PNG)
+
+    Retorna (bytes de la imagen, verdad del frame)
+    """
+    rng = np.random.default_rng(seed)
+    width, height = profile['size']
+    top, bottom = profile['band']
+    preset = PRESETS[profile['preset']]
+    wavelengths = pixel_wavelengths(profile)
+    x = np.arange(width, dtype=np.float64)
+
+    # Coordenada de dispersión de cada pixel de la banda: la rendija inclinada
+    # desplaza el espectro en cada fila
+    margin = max(2, (bottom - top) // 4)
+    rows = np.arange(max(0, top - margin), min(height, bottom + margin))
+    center_row = (top + bottom - 1) / 2.0
+    shift = (rows - center_row) * np.tan(np.radians(profile['tiltDeg']))
+    x_eff = x[None, :] - shift[:, None]
+    wl_eff = np.interp(x_eff, x, wavelengths)
+    dispersion = np.abs(np.gradient(wavelengths)).mean()
+    sigma_px = profile['fwhmNm'] / 2.3548 / dispersion
+
+    continuum = preset['continuum'] * (0.6 + 0.4 * np.exp(-0.5 * ((wl_eff - 560.0) / 110.0) ** 2))
+    emission = np.zeros_like(x_eff)
+    absorption = np.ones_like(x_eff)
+    truth_lines = []
+    for line_nm, amplitude, kind in preset['lines']:
+        if not wavelengths[0] <= line_nm <= wavelengths[-1]:
+            continue
+        pixel = float(np.interp(line_nm, wavelengths, x))
+        shape = np.exp(-0.5 * ((x_eff - pixel) / sigma_px) ** 2)
+        if kind == 'emission':
+            emission += amplitude * shape
+        else:
+            absorption *= 1.0 - amplitude * shape
+        truth_lines.append({'wavelength': line_nm, 'pixel': round(pixel, 3),
+                            'amplitude': amplitude, 'type': kind})
+
+    signal = (continuum * absorption + emission) * exposure
+    # Perfil vertical de la rendija: bordes suaves
+    edge = np.clip(np.minimum(rows - top + 1, bottom - rows) / 2.0, 0, 1)
+    signal *= edge[:, None]
+
+    frame = np.full((height, width), profile['darkLevel'], dtype=np.float64)
+    frame[rows] += signal
+    # Ruido de disparo (ganancia ~1 e-/cuenta) y de lectura
+    frame = rng.poisson(np.maximum(frame, 0)).astype(np.float64)
+    frame += rng.normal(0, read_noise, frame.shape)
+
+    hot_rows, hot_cols = profile['hotPixels']
+    frame[hot_rows, hot_cols] += 180
+    ray_rows = rng.integers(0, height, cosmic_rays)
+    ray_cols = rng.integers(0, width, cosmic_rays)
+    frame[ray_rows, ray_cols] = 255
+
+    buffer = io.BytesIO()
+    if fmt == 'jpeg':
+        # Color: respuesta de cada canal según la longitud de onda de la columna,
+        # normalizada para que el promedio de canales conserve la intensidad
+        response = np.stack([np.exp(-0.5 * ((wavelengths - c) / w) ** 2) for c, w in CHANNEL_RESPONSE], axis=1)
+        response = 0.25 + response
+        response *= 3.0 / response.sum(axis=1, keepdims=True)
+        rgb = np.clip(frame[:, :, None] * response[None, :, :], 0, 255).astype(np.uint8)
+        Image.fromarray(rgb, 'RGB').save(buffer, 'JPEG', quality=jpeg_quality)
+    else:
+        Image.fromarray(np.clip(frame, 0, 255).astype(np.uint8), 'L').save(buffer, 'PNG', compress_level=1)
+
+    truth = {
+        'deviceId': profile['deviceId'],
+        'preset': profile['preset'],
+        'size': [width, height],
+        'format': fmt,
+        'jpegQuality': jpeg_quality if fmt == 'jpeg' else None,
+        'exposure': exposure,
+        'seed': seed,
+        'band': [top, bottom],
+        'tiltDeg': round(profile['tiltDeg'], 4),
+        'dispersion': [round(float(v), 4) for v in profile['dispersion']],
+        'fwhmNm': round(profile['fwhmNm'], 3),
+        'hotPixels': len(hot_rows),
+        'cosmicRays': int(cosmic_rays),
+        'lines': truth_lines,
+    }
+    return buffer.getvalue(), truth
+
+
+def evaluate(truth, spectral_data, tolerance_nm=2.0):
+    """
+    Compara las líneas detectadas con las de emisión de la verdad
+    Retorna recall, precisión y error de longitud de onda de las encontradas
+    """
+    expected = [line['wavelength'] for line in truth['lines'] if line['type'] == 'emission']
+    detected = [float(line['wavelength']) for line in spectral_data.get('spectralLines', [])]
+
+    errors, matched = [], set()
+    for wavelength in expected:
+        candidates = [(abs(d - wavelength), i) for i, d in enumerate(detected) if i not in matched]
+        if candidates:
+            error, index = min(candidates)
+            if error <= tolerance_nm:
+                matched.add(index)
+                errors.append(error)
+
+    return {
+        'expected': len(expected),
+        'detected': len(detected),
+        'matched': len(errors),
+        'recall': round(len(errors) / len(expected), 3) if expected else None,
+        'precision': round(len(matched) / len(detected), 3) if detected else None,
+        'meanErrorNm': round(float(np.mean(errors)), 3) if errors else None,
+        'maxErrorNm': round(float(np.max(errors)), 3) if errors else None,
+        'spurious': [d for i, d in enumerate(detected) if i not in matched],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Frames sintéticos de espectrógrafo con verdad de referencia')
+    parser.add_argument('--preset', default='hg', choices=sorted(PRESETS))
+    parser.add_argument('--size', default='VGA', choices=list(FRAME_SIZES))
+    parser.add_argument('--format', default='jpeg', choices=('jpeg', 'gray'))
+    parser.add_argument('--quality', type=int, default=85, help='calidad JPEG (artefactos)')
+    parser.add_argument('--count', type=int, default=1)
+    parser.add_argument('--device', default='sim-0')
+    parser.add_argument('--out', help='directorio donde guardar frames y verdad (.json)')
+    parser.add_argument('--check', action='store_true', help='analiza cada frame y reporta la precisión')
+    args = parser.parse_args()
+
+    profile = device_profile(args.device, FRAME_SIZES[args.size], args.preset, seed=0)
+    analyze = None
+    if args.check:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda', 'shared'))
+        for name in ('OBSERVATIONS_TABLE', 'DEVICES_TABLE', 'S3_BUCKET'):
+            os.environ.setdefault(name, 'simulator')
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+        import process_spectral_image as psi
+        analyze = lambda data: psi.analyze_spectrum(psi.open_image(data))
+
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    for i in range(args.count):
+        data, truth = render_frame(profile, args.format, args.quality, seed=i)
+        if args.out:
+            extension = 'jpg' if args.format == 'jpeg' else 'png'
+            with open(os.path.join(args.out, f"frame_{i:04d}.{extension}"), 'wb') as f:
+                f.write(data)
+            with open(os.path.join(args.out, f"frame_{i:04d}.json"), 'w') as f:
+                json.dump(truth, f, indent=2)
+        if analyze:
+            score = evaluate(truth, analyze(data))
+            print(f"frame {i}: recall {score['recall']} precisión {score['precision']} "
+                  f"error medio {score['meanErrorNm']} nm, espurias {score['spurious']}")
+        else:
+            print(f"frame {i}: {len(data)} bytes, {len(truth['lines'])} líneas")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,687 @@
+"""
+Sustitutos locales de DynamoDB y S3 para correr herramientas y handlers
+sin cuenta de AWS
+
+- LocalTable: tabla en memoria persistida en un archivo pickle, con clave
+  simple o compuesta (hash, range); implementa get_item, put_item,
+  update_item (SET con if_not_exists, ADD, REMOVE y ReturnValues),
+  delete_item, batch_writer, query y scan segmentado con
+  Limit/ExclusiveStartKey. Las condiciones pueden ser objetos
+  boto3.dynamodb.conditions (Attr/Key) o expresiones de texto simples:
+  attribute_exists/attribute_not_exists y comparaciones unidas por AND/OR,
+  sin paréntesis
+- LocalS3: objetos como archivos bajo un directorio; put/get/head/delete_object
+  con If-None-Match y errores ClientError iguales a los de boto3; notifica
+  los objetos creados (add_notification) como el bucket a su cola
+- LocalDynamoDB: sustituto de boto3.resource('dynamodb'); Table(nombre)
+  entrega siempre la misma LocalTable en memoria. meta.client es el
+  sustituto del cliente de bajo nivel (items en formato AttributeValue)
+- LocalLambda: sustituto de boto3.client('lambda'); invoke() llama al
+  handler registrado, en un pool de hilos si InvocationType es 'Event'
+- LocalIoTData: sustituto de boto3.client('iot-data'); publish() guarda el
+  mensaje y lo entrega a los suscriptores (dispositivos simulados)
+- LocalSQS: sustituto de boto3.client('sqs') junto con el mapeo de eventos
+  de Lambda: arma lotes, llama al handler con eventos Records y reencola
+  los batchItemFailures
+
+Solo cubren lo que usan las herramientas del repo; no son emuladores completos.
+"""
+import hashlib
+import io
+import json
+import os
+import pickle
+import random
+import re
+import tempfile
+import threading
+import time
+import types
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import count
+from urllib.parse import quote_plus
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+
+def _error(code, operation, message=''):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+class LocalTable:
+    def __init__(self, path, key):
+        """key: atributo de la clave, o tupla (hash, range) para claves compuestas"""
+        self.path = path
+        self.key = key
+        self.key_names = key if isinstance(key, tuple) else (key,)
+        self.items = {}
+        # Escrituras aplicadas y rechazadas por su condición (para medir escrituras evitadas)
+        self.writes = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.items = pickle.load(f)
+
+    def save(self):
+        """Escribe la tabla a disco (reemplazo atómico); las tablas sin archivo no se guardan"""
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        # Archivo temporal propio de la llamada y lock hasta el reemplazo:
+        # dos save() concurrentes no comparten archivo ni se reemplazan en desorden
+        with self._lock, tempfile.NamedTemporaryFile('wb', dir=directory, suffix='.part', delete=False) as f:
+            try:
+                pickle.dump(self.items, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.close()
+                os.replace(f.name, self.path)
+            except BaseException:
+                os.unlink(f.name)
+                raise
+
+    def _id(self, item):
+        if len(self.key_names) == 1:
+            return item[self.key_names[0]]
+        return tuple(item[name] for name in self.key_names)
+
+    def _key_of(self, item_id):
+        values = item_id if isinstance(item_id, tuple) else (item_id,)
+        return dict(zip(self.key_names, values))
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        with self._lock:
+            item = self.items.get(self._id(Key))
+        if item is None:
+            return {}
+        return {'Item': _project(item, ProjectionExpression, ExpressionAttributeNames)}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, **kwargs):
+        with self._lock:
+            current = self.items.get(self._id(Item))
+            if ConditionExpression is not None and not evaluate(
+                    ConditionExpression, current or {}, ExpressionAttributeNames, ExpressionAttributeValues):
+                self.rejected += 1
+                raise _error('ConditionalCheckFailedException', 'PutItem')
+            self.items[self._id(Item)] = dict(Item)
+            self.writes += 1
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None,
+                    ExpressionAttributeNames=None, ConditionExpression=None, ReturnValues='NONE', **kwargs):
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self._lock:
+            current = self.items.get(self._id(Key))
+            if ConditionExpression is not None and not evaluate(ConditionExpression, current or {}, names, values):
+                self.rejected += 1
+                raise _error('ConditionalCheckFailedException', 'UpdateItem')
+            item = dict(current or Key)
+            _apply_update(item, UpdateExpression, names, values)
+            self.items[self._id(Key)] = item
+            self.writes += 1
+        if ReturnValues == 'ALL_NEW':
+            return {'Attributes': dict(item)}
+        # UPDATED_OLD devuelve el item anterior completo, no solo lo actualizado
+        if ReturnValues in ('ALL_OLD', 'UPDATED_OLD') and current:
+            return {'Attributes': dict(current)}
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        with self._lock:
+            self.items.pop(self._id(Key), None)
+        return {}
+
+    def query(self, KeyConditionExpression, FilterExpression=None, Limit=None, ExclusiveStartKey=None,
+              ScanIndexForward=True, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+              ProjectionExpression=None, **kwargs):
+        """
+        Query por la clave de la tabla (sin índices: un índice disperso equivale
+        a filtrar por su clave); KeyConditionExpression de boto3 (Key) o de texto
+        """
+        names, values = ExpressionAttributeNames, ExpressionAttributeValues
+        with self._lock:
+            ids = sorted(k for k, item in self.items.items()
+                         if evaluate(KeyConditionExpression, item, names, values))
+        if not ScanIndexForward:
+            ids.reverse()
+        if ExclusiveStartKey is not None:
+            start = self._id(ExclusiveStartKey)
+            ids = [k for k in ids if (k > start if ScanIndexForward else k < start)]
+        page = ids[:Limit] if Limit else ids
+        with self._lock:
+            items = [dict(self.items[k]) for k in page if k in self.items]
+        if FilterExpression is not None:
+            items = [item for item in items if evaluate(FilterExpression, item, names, values)]
+        items = [_project(item, ProjectionExpression, names) for item in items]
+        response = {'Items': items, 'Count': len(items), 'ScannedCount': len(page)}
+        if Limit and len(ids) > Limit:
+            response['LastEvaluatedKey'] = self._key_of(page[-1])
+        return response
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return _BatchWriter(self)
+
+    def scan(self, Segment=0, TotalSegments=1, Limit=None, ExclusiveStartKey=None,
+             FilterExpression=None, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        """
+        Scan de un segmento: las claves se reparten por hash como en DynamoDB
+        Limit cuenta items leídos (antes del filtro), igual que el servicio
+        """
+        with self._lock:
+            keys = sorted(k for k in self.items if _segment(k, TotalSegments) == Segment)
+        if ExclusiveStartKey is not None:
+            keys = [k for k in keys if k > self._id(ExclusiveStartKey)]
+        page = keys[:Limit] if Limit else keys
+
+        items = []
+        with self._lock:
+            for k in page:
+                item = self.items.get(k)
+                if item is not None and (FilterExpression is None or evaluate(FilterExpression, item)):
+                    items.append(_project(item, ProjectionExpression, ExpressionAttributeNames))
+        response = {'Items': items, 'Count': len(items), 'ScannedCount': len(page)}
+        if Limit and len(keys) > Limit:
+            response['LastEvaluatedKey'] = self._key_of(page[-1])
+        return response
+
+
+class _BatchWriter:
+    def __init__(self, table):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def put_item(self, Item):
+        self.table.put_item(Item=Item)
+
+    def delete_item(self, Key):
+        self.table.delete_item(Key=Key)
+
+
+def s3_notification(bucket, key, size, etag):
+    """Notificación ObjectCreated:Put de S3 para un objeto"""
+    return {'Records': [{
+        'eventVersion': '2.1',
+        'eventSource': 'aws:s3',
+        'eventName': 'ObjectCreated:Put',
+        'eventTime': datetime.now(timezone.utc).isoformat(),
+        's3': {
+            'bucket': {'name': bucket, 'arn': f'arn:aws:s3:::{bucket}'},
+            'object': {'key': quote_plus(key, safe='/'), 'size': size, 'eTag': etag},
+        },
+    }]}
+
+
+class LocalS3:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._notifications = []
+
+    def add_notification(self, callback, prefix='', suffix=''):
+        """
+        Como la NotificationConfiguration del bucket: callback(evento) recibe
+        una notificación ObjectCreated:Put (formato de S3, clave codificada)
+        por cada objeto escrito cuya clave tenga ese prefijo y sufijo
+        """
+        self._notifications.append((callback, prefix, suffix))
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def put_object(self, Bucket, Key, Body, IfNoneMatch=None, Metadata=None, ContentType=None, **kwargs):
+        path = self._path(Bucket, Key)
+        if IfNoneMatch == '*' and os.path.exists(path):
+            raise _error('PreconditionFailed', 'PutObject')
+        data = Body if isinstance(Body, (bytes, bytearray)) else Body.read()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.part"
+        with open(partial, 'wb') as f:
+            f.write(data)
+        os.replace(partial, path)
+        etag = hashlib.md5(data).hexdigest()
+        for callback, prefix, suffix in self._notifications:
+            if Key.startswith(prefix) and Key.endswith(suffix):
+                callback(s3_notification(Bucket, Key, len(data), etag))
+        return {'ETag': f'"{etag}"'}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise _error('NoSuchKey', 'GetObject')
+        with open(path, 'rb') as f:
+            data = f.read()
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data),
+                'ETag': f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise _error('404', 'HeadObject')
+        with open(path, 'rb') as f:
+            data = f.read()
+        return {'ContentLength': len(data), 'ETag': f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        if os.path.exists(path):
+            os.remove(path)
+        return {}
+
+
+class LocalDynamoDB:
+    def __init__(self, keys=None):
+        # nombre de tabla -> atributo clave ('id' si no se indica)
+        self.keys = dict(keys or {})
+        self.tables = {}
+        self.meta = types.SimpleNamespace(client=LocalDynamoDBClient(self))
+
+    def Table(self, name):
+        if name not in self.tables:
+            self.tables[name] = LocalTable(None, self.keys.get(name, 'id'))
+        return self.tables[name]
+
+
+class LocalDynamoDBClient:
+    """Cliente de bajo nivel sobre las tablas de LocalDynamoDB"""
+
+    def __init__(self, resource):
+        self.resource = resource
+        self._deserializer = TypeDeserializer()
+        self._serializer = TypeSerializer()
+        self.unprocessed_rate = 0.0
+        self._random = random.Random(0)
+
+    def put_item(self, TableName, Item, **kwargs):
+        item = {name: self._deserializer.deserialize(value) for name, value in Item.items()}
+        return self.resource.Table(TableName).put_item(Item=item, **kwargs)
+
+    def get_item(self, TableName, Key, **kwargs):
+        key = self._deserialize(Key)
+        response = self.resource.Table(TableName).get_item(Key=key, **kwargs)
+        return {'Item': self._serialize(response['Item'])} if 'Item' in response else {}
+
+    def query(self, TableName, ExpressionAttributeValues=None, ExclusiveStartKey=None, **kwargs):
+        """KeyConditionExpression de texto; IndexName se ignora como en LocalTable.query"""
+        response = self.resource.Table(TableName).query(
+            ExpressionAttributeValues=self._deserialize(ExpressionAttributeValues or {}),
+            ExclusiveStartKey=self._deserialize(ExclusiveStartKey) if ExclusiveStartKey else None, **kwargs)
+        response = dict(response, Items=[self._serialize(item) for item in response['Items']])
+        if 'LastEvaluatedKey' in response:
+            response['LastEvaluatedKey'] = self._serialize(response['LastEvaluatedKey'])
+        return response
+
+    def _serialize(self, item):
+        return {name: self._serializer.serialize(value) for name, value in item.items()}
+
+    def _deserialize(self, item):
+        return {name: self._deserializer.deserialize(value) for name, value in item.items()}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        """
+        Solo PutRequest; con unprocessed_rate > 0 devuelve esa fracción como
+        UnprocessedItems (simula la limitación de capacidad)
+        """
+        unprocessed = {}
+        for table_name, writes in RequestItems.items():
+            if len(writes) > 25:
+                raise _error('ValidationException', 'BatchWriteItem', 'Too many items requested')
+            for write in writes:
+                if self.unprocessed_rate and self._random.random() < self.unprocessed_rate:
+                    unprocessed.setdefault(table_name, []).append(write)
+                else:
+                    self.put_item(table_name, write['PutRequest']['Item'])
+        return {'UnprocessedItems': unprocessed}
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        responses = {}
+        for table_name, request in RequestItems.items():
+            if len(request['Keys']) > 100:
+                raise _error('ValidationException', 'BatchGetItem', 'Too many items requested')
+            table = self.resource.Table(table_name)
+            for key in request['Keys']:
+                key = {name: self._deserializer.deserialize(value) for name, value in key.items()}
+                item = table.get_item(Key=key, ProjectionExpression=request.get('ProjectionExpression'),
+                                      ExpressionAttributeNames=request.get('ExpressionAttributeNames')).get('Item')
+                if item is not None:
+                    responses.setdefault(table_name, []).append(
+                        {name: self._serializer.serialize(value) for name, value in item.items()})
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+
+class LocalLambda:
+    """
+    Invocaciones a funciones registradas con register(nombre, handler)
+    Las asíncronas ('Event') se ejecutan en max_workers hilos, como la
+    concurrencia de Lambda; cada una queda en `invocations` con su demora
+    en cola, duración y resultado
+    """
+
+    def __init__(self, max_workers=4):
+        self.functions = {}
+        self.invocations = []
+        self._pool = ThreadPoolExecutor(max_workers)
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def register(self, name, handler):
+        self.functions[name] = handler
+
+    def invoke(self, FunctionName, Payload=b'{}', InvocationType='RequestResponse', **kwargs):
+        handler = self.functions.get(FunctionName)
+        if handler is None:
+            raise _error('ResourceNotFoundException', 'Invoke', f'Function not found: {FunctionName}')
+        event = json.loads(Payload)
+        if InvocationType == 'Event':
+            self._futures.append(self._pool.submit(self._run, FunctionName, handler, event, time.monotonic()))
+            return {'StatusCode': 202}
+        result = self._run(FunctionName, handler, event, time.monotonic())
+        return {'StatusCode': 200, 'Payload': io.BytesIO(json.dumps(result).encode())}
+
+    def wait(self):
+        """Espera a que terminen las invocaciones asíncronas pendientes"""
+        while self._futures:
+            self._futures.pop().result()
+
+    def shutdown(self):
+        self.wait()
+        self._pool.shutdown()
+
+    def _run(self, name, handler, event, queued):
+        started = time.monotonic()
+        try:
+            result, error = handler(event, None), None
+        except Exception as e:
+            result, error = None, str(e)
+        record = {'function': name, 'event': event, 'result': result, 'error': error,
+                  'queuedAt': queued, 'startedAt': started, 'finishedAt': time.monotonic()}
+        with self._lock:
+            self.invocations.append(record)
+        return result
+
+
+class LocalIoTData:
+    def __init__(self):
+        self.messages = []
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """callback(topic, mensaje) recibe cada publicación"""
+        self._subscribers.append(callback)
+
+    def publish(self, topic, qos=0, payload=b'', **kwargs):
+        message = json.loads(payload)
+        with self._lock:
+            self.messages.append((topic, message))
+        for callback in self._subscribers:
+            callback(topic, message)
+        return {}
+
+
+def evaluate(condition, item, names=None, values=None):
+    """Evalúa una condición (objeto de boto3.dynamodb.conditions o texto) sobre un item"""
+    if isinstance(condition, str):
+        return _evaluate_text(condition, item, names or {}, values or {})
+    expression = condition.get_expression()
+    operator = expression['operator']
+    values = expression['values']
+
+    if operator in ('AND', 'OR'):
+        left, right = (evaluate(v, item) for v in values)
+        return (left and right) if operator == 'AND' else (left or right)
+    if operator == 'NOT':
+        return not evaluate(values[0], item)
+
+    name = values[0].name
+    present = name in item
+    if operator == 'attribute_exists':
+        return present
+    if operator == 'attribute_not_exists':
+        return not present
+    if not present:
+        return False
+
+    current = item[name]
+    if operator == '=':
+        return current == values[1]
+    if operator == '<>':
+        return current != values[1]
+    if operator == '<':
+        return current < values[1]
+    if operator == '<=':
+        return current <= values[1]
+    if operator == '>':
+        return current > values[1]
+    if operator == '>=':
+        return current >= values[1]
+    if operator == 'BETWEEN':
+        return values[1] <= current <= values[2]
+    if operator == 'begins_with':
+        return str(current).startswith(values[1])
+    if operator == 'IN':
+        return current in values[1]
+    raise ValueError(f"Operador no soportado: {operator}")
+
+
+_COMPARISONS = {
+    '=': lambda a, b: a == b,
+    '<>': lambda a, b: a != b,
+    '<=': lambda a, b: a <= b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '>': lambda a, b: a > b,
+}
+
+
+def _evaluate_text(expression, item, names, values):
+    """Expresión de condición de texto: términos unidos por OR y AND (AND primero)"""
+    def term(text):
+        text = text.strip()
+        match = re.fullmatch(r'(attribute_exists|attribute_not_exists)\(\s*([#\w.]+)\s*\)', text)
+        if match:
+            present = names.get(match.group(2), match.group(2)) in item
+            return present if match.group(1) == 'attribute_exists' else not present
+        match = re.fullmatch(r'([#\w.]+)\s*(<>|<=|>=|=|<|>)\s*(:\w+)', text)
+        if not match:
+            raise ValueError(f"Condición no soportada: {text}")
+        name = names.get(match.group(1), match.group(1))
+        return name in item and _COMPARISONS[match.group(2)](item[name], values[match.group(3)])
+
+    # a BETWEEN :x AND :y equivale a a >= :x AND a <= :y
+    expression = re.sub(r'([#\w.]+)\s+BETWEEN\s+(:\w+)\s+AND\s+(:\w+)', r'\1 >= \2 AND \1 <= \3', expression)
+    return any(all(term(part) for part in re.split(r'\s+AND\s+', alternative))
+               for alternative in re.split(r'\s+OR\s+', expression))
+
+
+def _apply_update(item, expression, names, values):
+    """
+    Aplica una UpdateExpression: SET (valores o if_not_exists), ADD (números
+    y sets) y REMOVE; las cláusulas pueden ir en cualquier orden
+    Como en DynamoDB, los operandos leen el item anterior a la actualización
+    """
+    previous = dict(item)
+    clauses = re.split(r'\b(SET|ADD|REMOVE)\s+', expression.strip())
+    if clauses[0].strip():
+        raise _error('ValidationException', 'UpdateItem', f'Expresión no soportada: {expression}')
+    for action, body in zip(clauses[1::2], clauses[2::2]):
+        for part in _split_top_level(body):
+            if action == 'REMOVE':
+                item.pop(names.get(part, part), None)
+            elif action == 'ADD':
+                name, value = part.split()
+                name, value = names.get(name, name), values[value]
+                if isinstance(value, (set, frozenset)):
+                    item[name] = set(item.get(name, set())) | set(value)
+                else:
+                    item[name] = item.get(name, 0) + value
+            else:
+                name, value = (p.strip() for p in part.split('=', 1))
+                name = names.get(name, name)
+                match = re.fullmatch(r'if_not_exists\(\s*([#\w.]+)\s*,\s*(:\w+)\s*\)', value)
+                append = re.fullmatch(
+                    r'list_append\(\s*if_not_exists\(\s*([#\w.]+)\s*,\s*(:\w+)\s*\)\s*,\s*(:\w+)\s*\)', value)
+                if match:
+                    existing = names.get(match.group(1), match.group(1))
+                    item[name] = previous[existing] if existing in previous else values[match.group(2)]
+                elif append:
+                    existing = names.get(append.group(1), append.group(1))
+                    current = previous[existing] if existing in previous else values[append.group(2)]
+                    item[name] = list(current) + list(values[append.group(3)])
+                else:
+                    item[name] = values[value]
+
+
+def _split_top_level(text):
+    """Separa por comas fuera de paréntesis"""
+    parts, depth, current = [], 0, ''
+    for char in text:
+        if char == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+            continue
+        depth += (char == '(') - (char == ')')
+        current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def _segment(key, total):
+    """Segmento de scan de una clave (reparto estable por hash)"""
+    return zlib.crc32(str(key).encode()) % total if total > 1 else 0
+
+
+def _project(item, projection, names):
+    if not projection:
+        return dict(item)
+    names = names or {}
+    fields = [names.get(f.strip(), f.strip()) for f in projection.split(',')]
+    return {f: item[f] for f in fields if f in item}
+
+
+class LocalSQS:
+    """
+    Cola con el mapeo de eventos SQS -> Lambda: send_message() encola; cuando
+    hay un worker libre se arma un lote de hasta batch_size mensajes (espera
+    hasta window segundos a que se llene) y se llama al handler con un evento
+    Records. Los batchItemFailures (o todo el lote si el handler lanza)
+    vuelven a la cola tras retry_delay, hasta max_receives entregas; después
+    pasan a dead_letters
+
+    Como LocalLambda, deja en `invocations` un registro por mensaje terminado
+    (demora en cola desde el primer envío, duración del lote, entregas) y en
+    `batches` uno por lote
+    """
+
+    def __init__(self, handler, batch_size=10, window=0.5, max_workers=4, max_receives=5, retry_delay=0.2):
+        self.handler = handler
+        self.batch_size = batch_size
+        self.window = window
+        self.max_receives = max_receives
+        self.retry_delay = retry_delay
+        self.invocations = []
+        self.batches = []
+        self.dead_letters = []
+        self._queue = []
+        self._in_flight = 0
+        self._closed = False
+        self._ids = count()
+        self._cond = threading.Condition()
+        self._workers = threading.Semaphore(max_workers)
+        self._pool = ThreadPoolExecutor(max_workers)
+        self._poller = threading.Thread(target=self._poll, daemon=True)
+        self._poller.start()
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        now = time.monotonic()
+        message = {'messageId': f"local-{next(self._ids)}", 'body': MessageBody,
+                   'queuedAt': now, 'visibleAt': now, 'receives': 0}
+        with self._cond:
+            self._queue.append(message)
+            self._cond.notify_all()
+        return {'MessageId': message['messageId']}
+
+    def wait(self):
+        """Espera a que la cola y los lotes en curso se vacíen"""
+        with self._cond:
+            while self._queue or self._in_flight:
+                self._cond.wait(0.05)
+
+    def shutdown(self):
+        self.wait()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._poller.join()
+        self._pool.shutdown()
+
+    def _visible(self):
+        now = time.monotonic()
+        return [m for m in self._queue if m['visibleAt'] <= now]
+
+    def _poll(self):
+        while True:
+            self._workers.acquire()
+            with self._cond:
+                while not self._closed and not self._visible():
+                    self._cond.wait(0.01)
+                if self._closed:
+                    return
+                deadline = time.monotonic() + self.window
+                while len(self._visible()) < self.batch_size and time.monotonic() < deadline:
+                    self._cond.wait(max(0.0, deadline - time.monotonic()))
+                batch = self._visible()[:self.batch_size]
+                for message in batch:
+                    self._queue.remove(message)
+                    message['receives'] += 1
+                self._in_flight += len(batch)
+            self._pool.submit(self._run, batch)
+
+    def _run(self, batch):
+        event = {'Records': [{
+            'messageId': m['messageId'],
+            'receiptHandle': m['messageId'],
+            'body': m['body'],
+            'attributes': {'ApproximateReceiveCount': str(m['receives'])},
+            'eventSource': 'aws:sqs',
+            'eventSourceARN': 'arn:aws:sqs:local:000000000000:local',
+        } for m in batch]}
+        started = time.monotonic()
+        try:
+            result, error = self.handler(event, None), None
+            failed = {f['itemIdentifier'] for f in (result or {}).get('batchItemFailures', [])}
+        except Exception as e:
+            error = str(e)
+            failed = {m['messageId'] for m in batch}
+        finished = time.monotonic()
+
+        with self._cond:
+            self.batches.append({'size': len(batch), 'failures': len(failed),
+                                 'startedAt': started, 'finishedAt': finished})
+            for message in batch:
+                if message['messageId'] in failed and message['receives'] < self.max_receives:
+                    message['visibleAt'] = finished + self.retry_delay
+                    self._queue.append(message)
+                    continue
+                if message['messageId'] in failed:
+                    self.dead_letters.append(message)
+                ok = message['messageId'] not in failed
+                self.invocations.append({
+                    'function': 'sqs', 'messageId': message['messageId'],
+                    'event': json.loads(message['body']),
+                    'result': {'statusCode': 200 if ok else 500, 'body': '{}'},
+                    'error': None if ok else (error or 'batchItemFailure'),
+                    'receives': message['receives'], 'queuedAt': message['queuedAt'],
+                    'startedAt': started, 'finishedAt': finished,
+                })
+            self._in_flight -= len(batch)
+            self._cond.notify_all()
+        self._workers.release()